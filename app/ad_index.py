@@ -0,0 +1,287 @@
+"""Индекс отпечатков подтверждённых рекламных сцен для мгновенного узнавания повторов.
+
+Отпечаток сцены — dHash первых probe_frames выбранных кадров (64 бита на кадр). Хэши лежат
+в LSH-индексе: 64 бита режутся на BANDS полос по 16 бит, для каждой полосы хранится
+отсортированный массив значений, кандидаты ищутся через searchsorted и проверяются по
+расстоянию Хэмминга. Новые записи копятся в небольшом несортированном хвосте, который
+сливается с основными массивами, когда вырастает, — добавление не пересортировывает
+миллионы записей каждый раз.
+
+Индекс пополняют несколько процессов (воркеры job_queue.py): save берёт блокировку файла,
+перечитывает индекс с диска и дописывает к нему только свои новые сцены, так что добавления
+других процессов не теряются.
+"""
+import logging
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import cv2
+import numpy as np
+
+from metrics import METRICS
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+logger = logging.getLogger(__name__)
+
+AD_INDEX_PATH_ENV = "AD_DETECTOR_AD_INDEX"
+DEFAULT_AD_INDEX_PATH = os.path.join(os.path.expanduser("~"), ".ad_detector", "ad_index.npz")
+
+HASH_SIZE = 8
+BANDS = 4
+BAND_BITS = 64 // BANDS
+# Почти однотонный кадр (заставка, чёрный) даёт случайный хэш, совпадающий с чем угодно
+MIN_CONTRAST = 6.0
+MERGE_THRESHOLD = 65536
+# Оценка сцены (процент рекламных кадров), с которой она попадает в индекс: заметно выше порога
+# выбора сегментов, чтобы ложное срабатывание не закрепилось в индексе и не узнавалось дальше
+CONFIRM_SCORE = 80.0
+# Доля рекламных кадров среди пробных, при которой модель согласна с совпадением по индексу
+AGREE_RATIO = 0.5
+
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def dhash(frame, rgb=False) -> Optional[int]:
+    """64-битный разностный хэш BGR-кадра (RGB при rgb=True) или None для малоконтрастного кадра."""
+    small = cv2.resize(frame, (HASH_SIZE + 1, HASH_SIZE), interpolation=cv2.INTER_AREA)
+    gray = cv2.cvtColor(small, cv2.COLOR_RGB2GRAY if rgb else cv2.COLOR_BGR2GRAY)
+    if gray.std() < MIN_CONTRAST:
+        return None
+    bits = (gray[:, 1:] > gray[:, :-1]).ravel()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def _hamming(hashes: np.ndarray, value: int) -> np.ndarray:
+    diff = (hashes ^ np.uint64(value)).view(np.uint8).reshape(-1, 8)
+    return _POPCOUNT[diff].sum(axis=1)
+
+
+def _bands(hashes: np.ndarray) -> List[np.ndarray]:
+    mask = np.uint64((1 << BAND_BITS) - 1)
+    return [((hashes >> np.uint64(b * BAND_BITS)) & mask).astype(np.uint16) for b in range(BANDS)]
+
+
+@contextmanager
+def _file_lock(path):
+    """Межпроцессная блокировка на время чтения и перезаписи индекса."""
+    with open(path, "a+b") as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class AdIndex:
+    def __init__(self, path=None, probe_frames=4, min_matches=3, max_distance=8):
+        self.path = path
+        self.probe_frames = probe_frames
+        self.min_matches = min_matches
+        self.max_distance = max_distance
+        self._lock = threading.Lock()
+
+        self.hashes = np.empty(0, dtype=np.uint64)
+        self.scene_ids = np.empty(0, dtype=np.int64)
+        self.scene_scores = np.empty(0, dtype=np.float32)
+        self._band_keys = [np.empty(0, dtype=np.uint16) for _ in range(BANDS)]
+        self._band_order = [np.empty(0, dtype=np.int64) for _ in range(BANDS)]
+        self._tail_hashes = []
+        self._tail_scene_ids = []
+        self._tail_scores = []
+        # Сцены, добавленные после загрузки и ещё не записанные: (хэши, оценка)
+        self._unsaved = []
+
+    @classmethod
+    def load(cls, path=None, **options) -> "AdIndex":
+        path = path or os.environ.get(AD_INDEX_PATH_ENV) or DEFAULT_AD_INDEX_PATH
+        index = cls(path, **options)
+        index._read(path)
+        return index
+
+    def _read(self, path):
+        if not os.path.exists(path):
+            return
+        with np.load(path) as data:
+            self.hashes = data["hashes"]
+            self.scene_ids = data["scene_ids"]
+            self.scene_scores = data["scene_scores"]
+        self._build_bands()
+
+    def _build_bands(self):
+        self._band_keys = []
+        self._band_order = []
+        for keys in _bands(self.hashes):
+            order = np.argsort(keys, kind="stable")
+            self._band_keys.append(keys[order])
+            self._band_order.append(order)
+
+    @property
+    def scene_count(self) -> int:
+        return len(self.scene_scores) + len(self._tail_scores)
+
+    def __len__(self):
+        return len(self.hashes) + len(self._tail_hashes)
+
+    def _candidates(self, value: int) -> np.ndarray:
+        found = []
+        for b in range(BANDS):
+            # Ключ того же dtype, что и массив, иначе searchsorted приводит весь массив к int64
+            key = np.uint16((value >> (b * BAND_BITS)) & ((1 << BAND_BITS) - 1))
+            keys = self._band_keys[b]
+            lo = np.searchsorted(keys, key, side="left")
+            hi = np.searchsorted(keys, key, side="right")
+            if hi > lo:
+                found.append(self._band_order[b][lo:hi])
+        if not found:
+            return np.empty(0, dtype=np.int64)
+        return np.unique(np.concatenate(found))
+
+    def _frame_matches(self, value: int) -> set:
+        scenes = set()
+        candidates = self._candidates(value)
+        if len(candidates):
+            close = candidates[_hamming(self.hashes[candidates], value) <= self.max_distance]
+            scenes.update(self.scene_ids[close].tolist())
+        if self._tail_hashes:
+            tail = np.array(self._tail_hashes, dtype=np.uint64)
+            close = np.flatnonzero(_hamming(tail, value) <= self.max_distance)
+            scenes.update(self._tail_scene_ids[i] for i in close)
+        return scenes
+
+    def match(self, hashes: Sequence[Optional[int]]) -> Optional[Tuple[int, float]]:
+        """(id сцены, её оценка), если не меньше min_matches кадров совпали с одной сценой."""
+        with METRICS.timer("ad_index_lookup"), self._lock:
+            votes: Dict[int, int] = {}
+            for value in hashes:
+                if value is None:
+                    continue
+                for scene_id in self._frame_matches(value):
+                    votes[scene_id] = votes.get(scene_id, 0) + 1
+        best = max(votes.items(), key=lambda item: item[1], default=None)
+        if best is None or best[1] < self.min_matches:
+            return None
+        return best[0], self.score_of(best[0])
+
+    def score_of(self, scene_id: int) -> float:
+        if scene_id < len(self.scene_scores):
+            return float(self.scene_scores[scene_id])
+        return self._tail_scores[scene_id - len(self.scene_scores)]
+
+    def add(self, hashes: Sequence[Optional[int]], score: float) -> Optional[int]:
+        values = [value for value in hashes if value is not None]
+        if len(values) < self.min_matches:
+            return None
+        with self._lock:
+            self._unsaved.append((values, float(score)))
+            scene_id = self._append(values, float(score))
+        METRICS.count("ad_index_scenes_added")
+        return scene_id
+
+    def _append(self, values, score) -> int:
+        scene_id = self.scene_count
+        self._tail_scores.append(score)
+        self._tail_hashes.extend(values)
+        self._tail_scene_ids.extend([scene_id] * len(values))
+        if len(self._tail_hashes) >= MERGE_THRESHOLD:
+            self._merge_tail()
+        return scene_id
+
+    def _merge_tail(self):
+        if not self._tail_hashes:
+            return
+        self.hashes = np.concatenate([self.hashes, np.array(self._tail_hashes, dtype=np.uint64)])
+        self.scene_ids = np.concatenate([self.scene_ids, np.array(self._tail_scene_ids, dtype=np.int64)])
+        self.scene_scores = np.concatenate([self.scene_scores, np.array(self._tail_scores, dtype=np.float32)])
+        self._tail_hashes, self._tail_scene_ids, self._tail_scores = [], [], []
+        self._build_bands()
+
+    def save(self, path=None):
+        """Дописывает новые сцены к индексу на диске; после записи в памяти — объединённый индекс."""
+        path = path or self.path
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        with _file_lock(path + ".lock"), self._lock:
+            if os.path.exists(path):
+                # Файл мог перезаписать другой процесс: берём его версию и добавляем к ней свои сцены
+                self._tail_hashes, self._tail_scene_ids, self._tail_scores = [], [], []
+                self._read(path)
+                for values, score in self._unsaved:
+                    self._append(values, score)
+            self._merge_tail()
+            fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".npz")
+            with os.fdopen(fd, "wb") as f:
+                np.savez(f, hashes=self.hashes, scene_ids=self.scene_ids, scene_scores=self.scene_scores)
+            os.replace(tmp_path, path)
+            self._unsaved = []
+
+
+class AdMatchSession:
+    """Связка индекса с одним прогоном анализа: запоминает отпечатки сцен (по началу и концу),
+    чтобы после выбора рекламных сегментов добавить в индекс новые подтверждённые сцены."""
+
+    def __init__(self, index: AdIndex, confirm_score=CONFIRM_SCORE, agree_ratio=AGREE_RATIO):
+        self.index = index
+        self.probe_frames = index.probe_frames
+        self.confirm_score = confirm_score
+        self.agree_ratio = agree_ratio
+        self._fingerprints = {}
+        self._matched = set()
+        self._lock = threading.Lock()
+
+    def match(self, start_time, end_time, hashes) -> Optional[float]:
+        with self._lock:
+            self._fingerprints[(start_time, end_time)] = list(hashes)
+        found = self.index.match(hashes)
+        if found is None:
+            return None
+        with self._lock:
+            self._matched.add((start_time, end_time))
+        METRICS.count("ad_index_matches")
+        return found[1]
+
+    def confirm(self, segments, scores_by_scene) -> int:
+        """Добавляет в индекс рекламные сцены прогона, которые не были узнаны; возвращает их число.
+
+        Берутся только сцены с собственной оценкой классификатора не ниже confirm_score: сцены,
+        прошедшие лишь сниженный порог соседства или склеенные в сегмент, в индекс не попадают."""
+        added = 0
+        for scene in segments:
+            scene = tuple(scene)
+            if scene in self._matched or scene not in self._fingerprints:
+                continue
+            score = scores_by_scene.get(scene)
+            if score is None or score < self.confirm_score:
+                continue
+            if self.index.add(self._fingerprints[scene], score) is not None:
+                added += 1
+        return added
+
+
+_default_index: Optional[AdIndex] = None
+_default_lock = threading.Lock()
+
+
+def default_index() -> AdIndex:
+    global _default_index
+    with _default_lock:
+        if _default_index is None:
+            with METRICS.timer("ad_index_load"):
+                _default_index = AdIndex.load()
+            logger.info(f"Ad index: {_default_index.scene_count} scenes from {_default_index.path}")
+        return _default_index
@@ -0,0 +1,392 @@
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Tuple
+
+from ad_index import AdMatchSession, default_index
+from checkpoint import AnalysisCheckpoint
+from frame_classifier import (
+    BATCH_SIZE, ad_percentage, buffer_pool, classify_batch, detect_scenes, process_video_segments_after_
+)
+from frame_ring import KIND_FRAME, FrameRing, decode_worker
+from host_config import host_config
+from keyframes import keyframe_index
+from metrics import METRICS, dump, record_memory, summarize
+from prefilter import find_candidates
+from proxy_cache import ProxyCache
+from sampling import scene_sample_times
+from video_source import VideoSource, source_path
+
+logger = logging.getLogger(__name__)
+
+Scene = Tuple[float, float]
+
+
+@dataclass
+class AnalysisSettings:
+    frame_interval: float = 0.5
+    scene_threshold: float = 65.0
+    # Уменьшение кадров для детектора сцен (1 — полное разрешение), None — автоматически
+    scene_downscale: Optional[int] = None
+    base_thresh: float = 12.5
+    boost: float = 10
+    # По умолчанию — из конфигурации хоста (autotune.py), иначе min(cpu_count, 4) и BATCH_SIZE
+    workers: Optional[int] = None
+    batch_size: int = field(default_factory=lambda: host_config().batch_size or BATCH_SIZE)
+    # "threads" — сцены в пуле потоков; "processes" — workers процессов-декодеров пишут кадры
+    # в кольцо shared memory, инференс батчами в текущем процессе
+    mode: str = "threads"
+    # Предфильтр (prefilter.py): сцены рядом с чёрными кадрами и тишиной — с шагом frame_interval,
+    # остальные — с шагом sparse_frame_interval
+    prefilter: bool = False
+    prefilter_margin: float = 60.0
+    sparse_frame_interval: float = 2.0
+    # Бюджет кадров на сцену: цена анализа растёт с числом сцен, а не с длиной видео.
+    # Длинная сцена получает не больше max_scene_samples кадров, разнесённых по стратам,
+    # короткая — не меньше min_scene_samples (sampling.scene_sample_times); None — без ограничения
+    min_scene_samples: Optional[int] = 2
+    max_scene_samples: Optional[int] = 32
+    # Узнавать уже подтверждённую рекламу по индексу отпечатков (ad_index.py): при совпадении
+    # и согласии модели на пробных кадрах остаток сцены не классифицируется; индекс пополняется
+    # сценами с уверенной оценкой. Только для mode="threads"
+    match_known_ads: bool = False
+    # Seek к ключевым кадрам по индексу (keyframes.py, строится один раз ffprobe) и grab() до
+    # нужного кадра; без ffprobe — обычный seek по времени
+    keyframe_seek: bool = True
+    # Кэш прокси-кадров (proxy_cache.py): при первом анализе видео декодируется один раз
+    # в 224×224 с частотой proxy_fps, сцены и кадры потом берутся из прокси без декодирования
+    proxy_cache: bool = False
+    proxy_fps: float = 4.0
+
+    def max_workers(self) -> int:
+        return self.workers or host_config().workers or min(os.cpu_count() or 4, 4)
+
+
+@dataclass
+class AnalysisResult:
+    scenes: List[Scene] = field(default_factory=list)
+    scores: List[Optional[float]] = field(default_factory=list)
+    segments: List[Scene] = field(default_factory=list)
+    metrics: dict = field(default_factory=dict)
+    # False — анализ остановлен или оборвался: оценки неполные, сохранять такой результат нельзя
+    completed: bool = False
+
+
+def is_advertisement(model_score: float, base_thresh: float, boost: float, is_isolated: bool) -> bool:
+    adjusted_thresh = base_thresh if is_isolated else base_thresh - boost
+    return model_score >= adjusted_thresh
+
+
+def select_ad_scenes(
+        scenes: List[Scene],
+        scores: List[Optional[float]],
+        base_thresh: float = 12.5,
+        boost: float = 10
+) -> List[Scene]:
+    # Сцены без оценки (None) ещё в работе: считаем их не рекламой до прихода результата
+    preds_final = []
+    for i, score in enumerate(scores):
+        if score is None:
+            continue
+
+        prev_score = scores[i - 1] if i > 0 else None
+        next_score = scores[i + 1] if i < len(scores) - 1 else None
+        prev_ad = prev_score is not None and prev_score >= base_thresh
+        next_ad = next_score is not None and next_score >= base_thresh
+        is_isolated = not prev_ad and not next_ad
+
+        if is_advertisement(score, base_thresh=base_thresh, boost=boost, is_isolated=is_isolated):
+            preds_final.append(scenes[i])
+
+    return preds_final
+
+
+def sample_intervals(scenes: List[Scene], settings: AnalysisSettings, windows=None) -> List[float]:
+    """Шаг выборки кадров для каждой сцены; windows — IntervalIndex окон-кандидатов предфильтра."""
+    if windows is None:
+        return [settings.frame_interval] * len(scenes)
+    return [settings.frame_interval if windows.overlapping(start, end) else settings.sparse_frame_interval
+            for start, end in scenes]
+
+
+def sample_plan(scenes: List[Scene], intervals: List[float], settings: AnalysisSettings,
+                fps: Optional[float] = None) -> List[List[float]]:
+    """Моменты выборки кадров по сценам с учётом бюджета кадров на сцену; fps — частота кадров,
+    из которых берутся кадры (видео или прокси), чтобы не выбирать один кадр дважды."""
+    return [scene_sample_times(start, end, interval, settings.min_scene_samples, settings.max_scene_samples, fps)
+            for (start, end), interval in zip(scenes, intervals)]
+
+
+def score_scenes(
+        video,
+        model,
+        scenes: List[Scene],
+        settings: AnalysisSettings,
+        should_stop: Optional[Callable[[], bool]] = None,
+        on_scene: Optional[Callable[[int, float], None]] = None,
+        on_frame: Optional[Callable[[int], None]] = None,
+        on_decoded: Optional[Callable] = None,
+        plan: Optional[List[List[float]]] = None,
+        ad_matcher: Optional[AdMatchSession] = None,
+        proxy=None
+) -> Dict[int, float]:
+    if plan is None:
+        fps = proxy.fps if proxy is not None else video.metadata.fps if isinstance(video, VideoSource) else None
+        plan = sample_plan(scenes, sample_intervals(scenes, settings), settings, fps)
+    # С прокси декодировать нечего — процессы-декодеры не нужны
+    if settings.mode == "processes" and proxy is None:
+        # Декодеры отдают только 224×224 кадры в кольцо, on_decoded в этом режиме не вызывается
+        return _score_scenes_processes(video, model, scenes, plan, settings,
+                                       should_stop, on_scene, on_frame)
+    if settings.mode != "threads":
+        raise ValueError(f"Unknown analysis mode: {settings.mode}")
+
+    preds = {}
+    executor = ThreadPoolExecutor(max_workers=settings.max_workers())
+    try:
+        futures = {
+            executor.submit(
+                process_video_segments_after_,
+                video,
+                model,
+                start,
+                end,
+                should_stop=should_stop,
+                on_frame=on_frame,
+                batch_size=settings.batch_size,
+                on_decoded=on_decoded,
+                ad_matcher=ad_matcher,
+                times=plan[i],
+                proxy=proxy
+            ): i
+            for i, (start, end) in enumerate(scenes)
+        }
+
+        pending = len(futures)
+        METRICS.gauge("scene_queue_depth", pending)
+        for future in as_completed(futures):
+            pending -= 1
+            METRICS.gauge("scene_queue_depth", pending)
+            record_memory()
+            if should_stop is not None and should_stop():
+                break
+            i = futures[future]
+            preds[i] = future.result()
+            if on_scene is not None:
+                on_scene(i, preds[i])
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+    return preds
+
+
+def _check_decoders(procs, ring):
+    # Упавший декодер не допишет заявленные сцены: ждать остальных бессмысленно
+    for proc in procs:
+        if proc.exitcode not in (None, 0):
+            raise RuntimeError(f"Decoder process exited with code {proc.exitcode}")
+    # Все декодеры завершились, а кольцо пусто (проверяем после exitcode: декодер мог
+    # дописать кадры прямо перед выходом) — оставшиеся сцены уже не придут
+    if all(proc.exitcode is not None for proc in procs) and not ring.ready():
+        raise RuntimeError("Decoder processes exited before all scenes were decoded")
+
+
+def _score_scenes_processes(video, model, scenes, plan, settings, should_stop, on_scene, on_frame):
+    keyframes = video.keyframes if isinstance(video, VideoSource) else None
+    ctx = multiprocessing.get_context("spawn")
+    ring = FrameRing.create(ctx, slots=max(4 * settings.batch_size, 32))
+    stop_event = ctx.Event()
+    jobs = ctx.Queue()
+    for i, (start, end) in enumerate(scenes):
+        jobs.put((i, start, end, plan[i]))
+    decoders = settings.max_workers()
+    for _ in range(decoders):
+        jobs.put(None)
+
+    procs = [
+        ctx.Process(target=decode_worker,
+                    args=(source_path(video), jobs, ring.spec(), stop_event, keyframes),
+                    daemon=True)
+        for _ in range(decoders)
+    ]
+    for proc in procs:
+        proc.start()
+
+    pool = buffer_pool(model)
+    buffers = pool.acquire(settings.batch_size)
+    batch_meta = []
+    labels = {}
+    ended = []
+    preds = {}
+    try:
+        while len(preds) < len(scenes):
+            if should_stop is not None and should_stop():
+                break
+
+            if ring.ready():
+                slot = ring.peek()
+                scene = int(ring.scene[slot])
+                if ring.kind[slot] == KIND_FRAME:
+                    buffers.add_rgb(ring.frames[slot])
+                    batch_meta.append((scene, float(ring.time[slot])))
+                else:
+                    ended.append(scene)
+                ring.release()
+                if not buffers.full:
+                    continue
+            elif not buffers.count and not ended:
+                _check_decoders(procs, ring)
+                time.sleep(0.0005)
+                continue
+
+            METRICS.gauge("ring_depth", ring.depth())
+            if buffers.count:
+                count = buffers.count
+                for (scene, frame_time), label in zip(batch_meta, classify_batch(buffers, model)):
+                    labels.setdefault(scene, []).append((frame_time, label))
+                batch_meta.clear()
+                if on_frame is not None:
+                    on_frame(count)
+
+            # Маркер конца сцены идёт в кольце после всех её кадров, значит они уже классифицированы
+            for scene in ended:
+                preds[scene] = ad_percentage(labels.pop(scene, []))
+                if on_scene is not None:
+                    on_scene(scene, preds[scene])
+            ended.clear()
+    finally:
+        stop_event.set()
+        for proc in procs:
+            proc.join(timeout=5)
+            if proc.is_alive():
+                proc.terminate()
+        jobs.close()
+        jobs.cancel_join_thread()
+        pool.release(buffers)
+        ring.close()
+    return preds
+
+
+def analyze_video(
+        video,
+        model,
+        settings: Optional[AnalysisSettings] = None,
+        should_stop: Optional[Callable[[], bool]] = None,
+        on_scenes: Optional[Callable[[List[Scene], List[int]], None]] = None,
+        on_scene: Optional[Callable[[int, float], None]] = None,
+        on_frame: Optional[Callable[[int], None]] = None,
+        on_decoded: Optional[Callable] = None,
+        checkpoint: Optional[AnalysisCheckpoint] = None
+) -> AnalysisResult:
+    """video — путь к файлу или открытый VideoSource (например, из GUI, где он уже открыт
+    для метаданных); по пути источник открывается на время анализа.
+
+    on_scenes(сцены, число кадров по сценам) вызывается, когда известен план выборки.
+    С checkpoint готовые оценки сцен сохраняются по ходу анализа, а прерванный анализ
+    продолжается с них (уже готовые сцены приходят в on_scene сразу)."""
+    settings = settings or AnalysisSettings()
+    record_memory()
+    before = METRICS.snapshot(window=True)
+    source = video if isinstance(video, VideoSource) else VideoSource(video, max_handles=settings.max_workers())
+    try:
+        if settings.keyframe_seek and source.keyframes is None:
+            _attach_keyframes(source)
+        result = _analyze_video(source, model, settings, should_stop,
+                                on_scenes, on_scene, on_frame, on_decoded, checkpoint)
+    finally:
+        if source is not video:
+            source.close()
+        if checkpoint is not None:
+            checkpoint.close()
+    record_memory()
+    result.metrics = summarize(before, METRICS.snapshot(since=before))
+    dump(result.metrics, video=source.path)
+    return result
+
+
+def _attach_keyframes(source):
+    try:
+        with METRICS.timer("keyframe_index"):
+            source.set_keyframes(keyframe_index(source.path))
+    except Exception as e:
+        logger.warning(f"No keyframe index for {source.path}, seeking by time: {e}")
+
+
+def _analyze_video(source, model, settings, should_stop, on_scenes, on_scene, on_frame,
+                   on_decoded, checkpoint) -> AnalysisResult:
+    proxy = None
+    if settings.proxy_cache:
+        proxy = ProxyCache().get_or_build(source, settings.proxy_fps, should_stop=should_stop)
+        if should_stop is not None and should_stop():
+            return AnalysisResult()
+
+    resumed = checkpoint.load() if checkpoint is not None else None
+    if resumed is not None:
+        scenes, intervals, preds = resumed
+        METRICS.count("scenes_resumed", len(preds))
+    else:
+        scenes = detect_scenes(source, threshold=settings.scene_threshold, downscale=settings.scene_downscale,
+                               proxy=proxy)
+        if should_stop is not None and should_stop():
+            return AnalysisResult(scenes=scenes)
+        if not scenes:
+            return AnalysisResult(completed=True)
+
+        windows = None
+        if settings.prefilter:
+            candidates = find_candidates(source, margin=settings.prefilter_margin, should_stop=should_stop)
+            windows = candidates.index()
+        intervals = sample_intervals(scenes, settings, windows)
+        preds = {}
+        if checkpoint is not None:
+            checkpoint.start(scenes, intervals)
+
+    plan = sample_plan(scenes, intervals, settings, fps=proxy.fps if proxy is not None else source.metadata.fps)
+    frame_counts = [len(times) for times in plan]
+    if on_scenes is not None:
+        on_scenes(scenes, frame_counts)
+    for i, score in preds.items():
+        if on_frame is not None:
+            on_frame(frame_counts[i])
+        if on_scene is not None:
+            on_scene(i, score)
+
+    ad_matcher = None
+    if settings.match_known_ads and settings.mode == "threads":
+        ad_matcher = AdMatchSession(default_index())
+
+    pending = [i for i in range(len(scenes)) if i not in preds]
+
+    def on_pending_scene(j, score):
+        if checkpoint is not None:
+            checkpoint.record(pending[j], score)
+        if on_scene is not None:
+            on_scene(pending[j], score)
+
+    if pending:
+        pending_preds = score_scenes(source, model, [scenes[i] for i in pending], settings,
+                                     should_stop=should_stop, on_scene=on_pending_scene, on_frame=on_frame,
+                                     on_decoded=on_decoded, plan=[plan[i] for i in pending],
+                                     ad_matcher=ad_matcher, proxy=proxy)
+        preds.update((pending[j], score) for j, score in pending_preds.items())
+    scores = [preds.get(i) for i in range(len(scenes))]
+    if should_stop is not None and should_stop():
+        return AnalysisResult(scenes=scenes, scores=scores)
+    if not preds:
+        return AnalysisResult(scenes=scenes, scores=scores, completed=True)
+
+    segments = select_ad_scenes(scenes, scores, base_thresh=settings.base_thresh, boost=settings.boost)
+    if ad_matcher is not None:
+        _remember_ads(ad_matcher, scenes, scores, segments)
+    if checkpoint is not None:
+        checkpoint.remove()
+    return AnalysisResult(scenes=scenes, scores=scores, segments=segments, completed=True)
+
+
+def _remember_ads(ad_matcher, scenes, scores, segments):
+    added = ad_matcher.confirm(segments, dict(zip(scenes, scores)))
+    if added:
+        with METRICS.timer("ad_index_save"):
+            ad_matcher.index.save()
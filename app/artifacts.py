@@ -0,0 +1,18 @@
+import os
+
+from catalog import file_fingerprint
+
+CACHE_DIR_ENV = "AD_DETECTOR_CACHE_DIR"
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".ad_detector", "artifacts")
+
+
+def cache_root():
+    return os.environ.get(CACHE_DIR_ENV) or DEFAULT_CACHE_DIR
+
+
+def artifact_dir(video_path, fingerprint=None, create=True):
+    """Каталог производных данных видео (миниатюры, индексы и т.п.), по отпечатку содержимого."""
+    path = os.path.join(cache_root(), fingerprint or file_fingerprint(video_path))
+    if create:
+        os.makedirs(path, exist_ok=True)
+    return path
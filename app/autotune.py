@@ -0,0 +1,238 @@
+"""Автонастройка инференса на CPU под конкретную машину.
+
+Меряет пропускную способность реальной модели (model_loader.load_weights) при разных
+channels_last / bf16 autocast, числе потоков torch и размере батча (по очереди, каждый раз
+фиксируя лучшее), затем число воркеров анализа на синтетическом видео. Конфигурация
+принимается, только если выходы отличаются от эталона (fp32, NCHW) не больше чем на
+--tolerance по вероятностям, а метки совпадают не реже --min-agreement. Лучшая сохраняется
+в файл хоста (см. host_config.py), его подхватывают model_loader и AnalysisSettings.
+
+    python autotune.py --model Swin --frames 64
+"""
+import argparse
+import copy
+import json
+import os
+import tempfile
+import time
+
+# Настраиваем CPU-инференс, даже если рядом есть CUDA
+os.environ.setdefault("CUDA_VISIBLE_DEVICES", "")
+
+import torch
+
+from analysis import AnalysisSettings, analyze_video
+from benchmark import git_commit, sample_frames
+from buffers import BatchBuffers
+from host_config import HostConfig, host_config_path, save_host_config
+from model_loader import apply_host_config, load_weights, model_identity
+from synthetic_video import generate_synthetic_video
+
+
+def bf16_supported():
+    try:
+        with torch.autocast(device_type="cpu", dtype=torch.bfloat16):
+            torch.nn.functional.linear(torch.ones(2, 2), torch.ones(2, 2))
+        return True
+    except RuntimeError:
+        return False
+
+
+def make_inputs(video_path, duration, frames):
+    # Ровно frames кадров с шагом по всему ролику: бюджет кадров на сцену здесь не нужен
+    settings = AnalysisSettings(frame_interval=duration / frames, min_scene_samples=None, max_scene_samples=None,
+                                match_known_ads=False)
+    _, probe = sample_frames(video_path, [(0.0, duration)], settings, keep=frames)
+    buffers = BatchBuffers(len(probe), torch.device("cpu"))
+    for frame in probe:
+        buffers.add(frame)
+    return buffers.tensor().clone()
+
+
+def run_inference(model, inputs, batch_size):
+    outputs = []
+    with torch.no_grad():
+        for i in range(0, len(inputs), batch_size):
+            outputs.append(model(inputs[i:i + batch_size]).float())
+    return torch.cat(outputs)
+
+
+def measure(raw_model, inputs, config: HostConfig, repeat):
+    """(кадров в секунду, вероятности классов) для конфигурации."""
+    model = apply_host_config(copy.deepcopy(raw_model), config)
+    batch_size = config.batch_size
+    run_inference(model, inputs[:batch_size], batch_size)
+    best = None
+    outputs = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        outputs = run_inference(model, inputs, batch_size)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return len(inputs) / best, torch.softmax(outputs, 1)
+
+
+def describe(config: HostConfig):
+    return (f"threads={config.torch_threads} batch={config.batch_size} "
+            f"channels_last={config.channels_last} bf16={config.bf16}")
+
+
+class Tuner:
+    def __init__(self, raw_model, inputs, args):
+        self.raw_model = raw_model
+        self.inputs = inputs
+        self.args = args
+        self.reference = None
+        self.trials = []
+
+    def trial(self, config: HostConfig):
+        fps, probs = measure(self.raw_model, self.inputs, config, self.args.repeat)
+        if self.reference is None:
+            self.reference = probs
+        max_diff = (probs - self.reference).abs().max().item()
+        agreement = (probs.argmax(1) == self.reference.argmax(1)).float().mean().item()
+        valid = max_diff <= self.args.tolerance and agreement >= self.args.min_agreement
+        self.trials.append({"config": describe(config), "frames_per_sec": fps, "max_abs_diff": max_diff,
+                            "label_agreement": agreement, "valid": valid})
+        print(f"{describe(config):>60}: {fps:8.1f} frames/s  diff {max_diff:.4f}  "
+              f"agree {agreement:.3f}" + ("" if valid else "  REJECTED"))
+        return fps if valid else None, max_diff, agreement
+
+    def best_of(self, configs, fallback=None):
+        """(конфигурация, кадров/с, отклонение, совпадение меток) лучшей из прошедших проверку."""
+        best = fallback
+        for config in configs:
+            fps, max_diff, agreement = self.trial(config)
+            if fps is not None and (best is None or fps > best[1]):
+                best = (config, fps, max_diff, agreement)
+        return best
+
+
+def thread_candidates(cpu_count):
+    candidates = {cpu_count}
+    threads = 1
+    while threads < cpu_count:
+        candidates.add(threads)
+        threads *= 2
+    return sorted(candidates)
+
+
+def tune_workers(video_path, model, config: HostConfig, candidates, frame_interval):
+    best = None
+    results = []
+    for workers in candidates:
+        settings = AnalysisSettings(frame_interval=frame_interval, workers=workers, batch_size=config.batch_size,
+                                    match_known_ads=False)
+        started = time.perf_counter()
+        result = analyze_video(video_path, model, settings)
+        elapsed = time.perf_counter() - started
+        frames = result.metrics.get("counters", {}).get("frames_classified", 0)
+        fps = frames / elapsed if elapsed > 0 else 0.0
+        results.append({"workers": workers, "seconds": elapsed, "frames_per_sec": fps})
+        print(f"{'workers=' + str(workers):>60}: {fps:8.1f} frames/s end-to-end")
+        if best is None or fps > best[1]:
+            best = (workers, fps)
+    return best, results
+
+
+def autotune(args):
+    raw_model = load_weights(args.model)
+    if raw_model is None:
+        raise SystemExit(f"Model {args.model} could not be loaded")
+    raw_model = raw_model.cpu().eval()
+    cpu_count = os.cpu_count() or 1
+
+    with tempfile.TemporaryDirectory() as tmp:
+        video_path = os.path.join(tmp, "autotune.mp4")
+        generate_synthetic_video(video_path, args.width, args.height, args.duration, 25.0, args.cut_every,
+                                 seed=args.seed)
+        inputs = make_inputs(video_path, args.duration, args.frames)
+        tuner = Tuner(raw_model, inputs, args)
+
+        base = HostConfig(torch_threads=torch.get_num_threads(), batch_size=16)
+        print("Precision and layout:")
+        layouts = [(False, False), (True, False)]
+        if bf16_supported():
+            layouts += [(False, True), (True, True)]
+        # Первая конфигурация — эталон fp32/NCHW, она всегда проходит проверку
+        chosen = tuner.best_of(
+            HostConfig(torch_threads=base.torch_threads, batch_size=base.batch_size,
+                       channels_last=channels_last, bf16=bf16)
+            for channels_last, bf16 in layouts
+        )
+
+        print("Torch threads:")
+        best = chosen[0]
+        chosen = tuner.best_of((
+            HostConfig(torch_threads=threads, batch_size=best.batch_size,
+                       channels_last=best.channels_last, bf16=best.bf16)
+            for threads in thread_candidates(cpu_count)
+        ), fallback=chosen)
+
+        print("Batch size:")
+        best = chosen[0]
+        best, inference_fps, max_diff, agreement = tuner.best_of((
+            HostConfig(torch_threads=best.torch_threads, batch_size=batch_size,
+                       channels_last=best.channels_last, bf16=best.bf16)
+            for batch_size in args.batch_sizes
+        ), fallback=chosen)
+
+        print("Analysis workers:")
+        model = apply_host_config(copy.deepcopy(raw_model), best)
+        (workers, end_to_end_fps), worker_results = tune_workers(
+            video_path, model, best, [w for w in thread_candidates(cpu_count) if w <= args.max_workers],
+            args.frame_interval
+        )
+
+    best.workers = workers
+    best.meta = {
+        "model": model_identity(args.model),
+        "tuned_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "commit": git_commit(),
+        "cpu_count": cpu_count,
+        "torch": torch.__version__,
+        "inference_frames_per_sec": inference_fps,
+        "end_to_end_frames_per_sec": end_to_end_fps,
+        "max_abs_diff": max_diff,
+        "label_agreement": agreement,
+        "tolerance": args.tolerance,
+    }
+    return best, {"trials": tuner.trials, "workers": worker_results}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Find the fastest CPU inference settings for this host")
+    parser.add_argument("--model", default="Swin")
+    parser.add_argument("--frames", type=int, default=64, help="frames in the inference benchmark")
+    parser.add_argument("--repeat", type=int, default=3, help="best-of-N per configuration")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 4, 8, 16, 32])
+    parser.add_argument("--max-workers", type=int, default=8)
+    parser.add_argument("--tolerance", type=float, default=0.02,
+                        help="max absolute difference of class probabilities vs fp32")
+    parser.add_argument("--min-agreement", type=float, default=0.99, help="min share of identical labels")
+    parser.add_argument("--width", type=int, default=640)
+    parser.add_argument("--height", type=int, default=360)
+    parser.add_argument("--duration", type=float, default=30.0, help="synthetic video length, seconds")
+    parser.add_argument("--cut-every", type=float, default=3.0)
+    parser.add_argument("--frame-interval", type=float, default=0.5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help=f"defaults to {host_config_path()}")
+    parser.add_argument("--report", default=None, help="write all trials as JSON")
+    parser.add_argument("--dry-run", action="store_true", help="do not save the host config")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    best, report = autotune(args)
+    print(f"Best: {describe(best)} workers={best.workers} "
+          f"({best.meta['end_to_end_frames_per_sec']:.1f} frames/s end-to-end)")
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    if not args.dry_run:
+        print(f"Host config written to {save_host_config(best, args.output)}")
+
+
+if __name__ == "__main__":
+    main()
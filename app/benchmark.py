@@ -0,0 +1,206 @@
+"""Воспроизводимый бенчмарк пайплайна на синтетических видео.
+
+Работает офлайн на CPU со случайно инициализированной моделью, результат пишется в JSON:
+
+    python benchmark.py --width 1280 --height 720 --duration 120 --cut-every 4 --output bench.json
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+
+# Бенчмарк всегда меряет CPU, даже если рядом есть CUDA
+os.environ.setdefault("CUDA_VISIBLE_DEVICES", "")
+
+import cv2
+import torch
+from PIL import Image
+
+from analysis import AnalysisSettings, analyze_video
+from buffers import BatchBuffers
+from frame_classifier import _iter_segment_frames, classify_frame, detect_scenes, transform
+from metrics import peak_rss_mb
+from model_loader import build_model
+from sampling import scene_sample_times
+from synthetic_video import generate_synthetic_video
+from video_source import VideoSource
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_stage(name, func, items_of=len, repeat=1):
+    best = None
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+
+    items = items_of(result) if items_of is not None else None
+    stage = {
+        "seconds": best,
+        "items": items,
+        "items_per_sec": items / best if items and best > 0 else None,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+    print(f"{name:>22}: {best:8.3f} s" + (f"  {stage['items_per_sec']:9.1f} items/s" if stage["items_per_sec"] else ""))
+    return stage, result
+
+
+def sample_frames(video_path, scenes, settings, keep=0):
+    # Возвращаем число кадров и только первые keep кадров, чтобы не держать в памяти всё видео.
+    # Выборка та же, что у analyze_video: с бюджетом кадров на сцену
+    count = 0
+    kept = []
+    with VideoSource(video_path, max_handles=1) as source, source.lease() as handle:
+        for start, end in scenes:
+            times = scene_sample_times(start, end, settings.frame_interval, settings.min_scene_samples,
+                                       settings.max_scene_samples, source.metadata.fps)
+            for _, frame in _iter_segment_frames(handle, times):
+                count += 1
+                if len(kept) < keep:
+                    kept.append(frame)
+    return count, kept
+
+
+def preprocess(frames):
+    return [transform(Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))) for frame in frames]
+
+
+def preprocess_pooled(frames, batch_size):
+    buffers = BatchBuffers(batch_size, torch.device("cpu"))
+    for frame in frames:
+        if buffers.full:
+            buffers.tensor()
+            buffers.reset()
+        buffers.add(frame)
+    buffers.tensor()
+    return frames
+
+
+def batched_inference(model, tensors, batch_size):
+    labels = []
+    with torch.no_grad():
+        for i in range(0, len(tensors), batch_size):
+            batch = torch.stack(tensors[i:i + batch_size])
+            labels.extend(torch.argmax(model(batch), 1).tolist())
+    return labels
+
+
+def run_benchmark(args):
+    torch.manual_seed(args.seed)
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    # Индекс известной рекламы не трогаем: он исказил бы замер и пополнился бы синтетикой
+    settings = AnalysisSettings(frame_interval=args.frame_interval, workers=args.workers,
+                                batch_size=args.batch_size, mode=args.mode, match_known_ads=False)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        video_path = os.path.join(tmp, f"synthetic.{args.container}")
+        stages = {}
+        stages["generate_video"], video_info = run_stage("generate_video", lambda: generate_synthetic_video(
+            video_path, args.width, args.height, args.duration, args.fps,
+            args.cut_every, args.codec, args.seed
+        ), items_of=lambda info: info["frames"])
+        video_info = {k: v for k, v in video_info.items() if k != "path"}
+
+        model = build_model(pretrained=False).eval()
+
+        stages["detect_scenes"], scenes = run_stage(
+            "detect_scenes", lambda: detect_scenes(video_path, threshold=settings.scene_threshold),
+            items_of=lambda _: video_info["frames"]
+        )
+        stages["frame_sampling"], (frames_sampled, probe) = run_stage(
+            "frame_sampling", lambda: sample_frames(video_path, scenes, settings, args.max_frames),
+            items_of=lambda sampled: sampled[0]
+        )
+        stages["preprocessing"], tensors = run_stage(
+            "preprocessing", lambda: preprocess(probe), repeat=args.repeat
+        )
+        stages["preprocessing_pooled"], _ = run_stage(
+            "preprocessing_pooled", lambda: preprocess_pooled(probe, settings.batch_size), repeat=args.repeat
+        )
+        stages["classify_frame"], _ = run_stage(
+            "classify_frame", lambda: [classify_frame(frame, model) for frame in probe], repeat=args.repeat
+        )
+        for batch_size in args.batch_sizes:
+            name = f"batched_inference_bs{batch_size}"
+            stages[name], _ = run_stage(
+                name, lambda: batched_inference(model, tensors, batch_size), repeat=args.repeat
+            )
+        stages["end_to_end"], result = run_stage(
+            "end_to_end", lambda: analyze_video(video_path, model, settings),
+            items_of=lambda _: frames_sampled
+        )
+
+    return {
+        "meta": {
+            "commit": git_commit(),
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "processor": platform.processor(),
+            "cpu_count": os.cpu_count(),
+            "torch": torch.__version__,
+            "torch_threads": torch.get_num_threads(),
+            "opencv": cv2.__version__,
+            "settings": vars(args),
+        },
+        "video": video_info,
+        "scenes_detected": len(scenes),
+        "frames_sampled": frames_sampled,
+        "ad_segments": len(result.segments),
+        "stages": stages,
+        "pipeline_metrics": result.metrics,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the ad detection pipeline on a synthetic video")
+    parser.add_argument("--width", type=int, default=640)
+    parser.add_argument("--height", type=int, default=360)
+    parser.add_argument("--duration", type=float, default=60.0, help="seconds")
+    parser.add_argument("--fps", type=float, default=25.0)
+    parser.add_argument("--cut-every", type=float, default=5.0, help="seconds between hard cuts")
+    parser.add_argument("--codec", default="mp4v", help="FourCC passed to cv2.VideoWriter")
+    parser.add_argument("--container", default="mp4")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--frame-interval", type=float, default=0.5)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--threads", type=int, default=None, help="torch intra-op threads")
+    parser.add_argument("--mode", choices=["threads", "processes"], default="threads",
+                        help="scene scoring backend of the end-to-end run")
+    parser.add_argument("--batch-size", type=int, default=16, help="batch size of the end-to-end run")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8, 32],
+                        help="batch sizes of the inference micro-benchmark")
+    parser.add_argument("--max-frames", type=int, default=64,
+                        help="frames used for the preprocessing/inference micro-benchmarks")
+    parser.add_argument("--repeat", type=int, default=3, help="best-of-N for micro-benchmarks")
+    parser.add_argument("--output", default="bench_output.json")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    report = run_benchmark(args)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
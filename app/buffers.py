@@ -0,0 +1,90 @@
+import threading
+
+import cv2
+import numpy as np
+import torch
+
+from metrics import METRICS
+
+INPUT_SIZE = 224
+MEAN = (0.485, 0.456, 0.406)
+STD = (0.229, 0.224, 0.225)
+
+
+class BatchBuffers:
+    """Переиспользуемые буферы одного потока: кадр для cap.read(image=...), промежуточный
+    224×224 RGB и float32-батч фиксированной формы, который нормализуется на месте."""
+
+    def __init__(self, batch_size, device, size=INPUT_SIZE):
+        self.batch_size = batch_size
+        self.size = size
+        self.device = device
+        self.frame = None
+        self.resized = np.empty((size, size, 3), dtype=np.uint8)
+        self.rgb = np.empty((size, size, 3), dtype=np.uint8)
+        self.host_batch = torch.empty((batch_size, 3, size, size), dtype=torch.float32,
+                                      pin_memory=device.type == "cuda")
+        if device.type == "cuda":
+            self.device_batch = torch.empty_like(self.host_batch, device=device)
+        else:
+            self.device_batch = self.host_batch
+        self.mean = torch.tensor(MEAN, dtype=torch.float32, device=device).view(1, 3, 1, 1)
+        self.inv_std = (1.0 / torch.tensor(STD, dtype=torch.float32, device=device)).view(1, 3, 1, 1)
+        self.count = 0
+
+    @property
+    def full(self):
+        return self.count >= self.batch_size
+
+    def read(self, cap):
+        # cap.read пишет в уже выделенный массив, если форма совпадает с форматом потока
+        ret, frame = cap.read(self.frame)
+        if ret:
+            if self.frame is not None and frame is self.frame:
+                METRICS.count("frame_buffer_reuses")
+            else:
+                METRICS.count("frame_buffer_allocations")
+            self.frame = frame
+        return ret, frame
+
+    def add(self, frame):
+        with METRICS.timer("preprocess"):
+            cv2.resize(frame, (self.size, self.size), dst=self.resized, interpolation=cv2.INTER_AREA)
+            cv2.cvtColor(self.resized, cv2.COLOR_BGR2RGB, dst=self.rgb)
+            self.add_rgb(self.rgb)
+
+    def add_rgb(self, rgb):
+        # rgb — уже готовый size×size RGB uint8, например слот кольца в shared memory
+        self.host_batch[self.count].copy_(torch.from_numpy(rgb).permute(2, 0, 1))
+        self.count += 1
+
+    def tensor(self):
+        batch = self.device_batch[:self.count]
+        if batch.data_ptr() != self.host_batch.data_ptr():
+            batch.copy_(self.host_batch[:self.count], non_blocking=True)
+        return batch.mul_(1.0 / 255).sub_(self.mean).mul_(self.inv_std)
+
+    def reset(self):
+        self.count = 0
+
+
+class BufferPool:
+    def __init__(self, device):
+        self.device = device
+        self._free = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, batch_size):
+        with self._lock:
+            free = self._free.get(batch_size)
+            if free:
+                METRICS.count("batch_buffer_reuses")
+                buffers = free.pop()
+                buffers.reset()
+                return buffers
+        METRICS.count("batch_buffer_allocations")
+        return BatchBuffers(batch_size, self.device)
+
+    def release(self, buffers):
+        with self._lock:
+            self._free.setdefault(buffers.batch_size, []).append(buffers)
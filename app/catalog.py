@@ -0,0 +1,304 @@
+"""SQLite-каталог проанализированных видео: метаданные, сцены с оценками и рекламные сегменты.
+
+Видео опознаётся по отпечатку содержимого (см. file_fingerprint), поэтому переименованный или
+перемещённый файл находится в каталоге без повторного анализа. Результат переиспользуется,
+только если совпадают модель и влияющие на результат настройки (см. settings_hash).
+
+Отчёт по дням считается от времени начала записи: оно передаётся при сохранении (очередь
+задач, job_queue.py add --recorded-at), иначе берётся из имени файла или тега creation_time
+контейнера (см. recording_time), а у уже сохранённых видео задаётся командой tag.
+
+    python catalog.py report --channel "Первый канал" --since 2026-01-01
+    python catalog.py tag /archive/ch1/rec.ts --channel "Первый канал" --recorded-at 2026-10-17T20:00
+"""
+import argparse
+import datetime
+import hashlib
+import json
+import os
+import re
+import shutil
+import sqlite3
+import subprocess
+from dataclasses import asdict, dataclass, field, is_dataclass
+from typing import List, Optional, Tuple
+
+CATALOG_PATH_ENV = "AD_DETECTOR_CATALOG"
+DEFAULT_CATALOG_PATH = os.path.join(os.path.expanduser("~"), ".ad_detector", "catalog.sqlite3")
+FINGERPRINT_CHUNK = 4 * 1024 * 1024
+# Настройки, от которых зависит только скорость анализа, а не сцены, оценки и сегменты
+EXECUTION_SETTINGS = ("workers", "batch_size", "mode", "keyframe_seek")
+# Время начала записи в имени файла: 2026-10-17_20-00-00, 20261017_2000, 2026.10.17 20.00 и т. п.
+RECORDED_AT_PATTERN = re.compile(
+    r"(?<!\d)(\d{4})[-_.]?(\d{2})[-_.]?(\d{2})[T_ .-]?(\d{2})[-_.:h]?(\d{2})(?:[-_.:m]?(\d{2}))?(?!\d)"
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS videos (
+    id INTEGER PRIMARY KEY,
+    fingerprint TEXT NOT NULL UNIQUE,
+    path TEXT NOT NULL,
+    file_name TEXT NOT NULL,
+    file_size INTEGER NOT NULL,
+    channel TEXT,
+    recorded_at TEXT,
+    duration REAL,
+    fps REAL,
+    frame_count INTEGER,
+    width INTEGER,
+    height INTEGER,
+    model TEXT,
+    settings TEXT,
+    settings_hash TEXT,
+    analyzed_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS scenes (
+    video_id INTEGER NOT NULL REFERENCES videos(id) ON DELETE CASCADE,
+    idx INTEGER NOT NULL,
+    start REAL NOT NULL,
+    "end" REAL NOT NULL,
+    score REAL,
+    PRIMARY KEY (video_id, idx)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS ad_segments (
+    id INTEGER PRIMARY KEY,
+    video_id INTEGER NOT NULL REFERENCES videos(id) ON DELETE CASCADE,
+    start REAL NOT NULL,
+    "end" REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_videos_channel_recorded ON videos(channel, recorded_at);
+CREATE INDEX IF NOT EXISTS idx_videos_path ON videos(path);
+CREATE INDEX IF NOT EXISTS idx_ad_segments_video ON ad_segments(video_id, start);
+"""
+
+
+def file_fingerprint(path, chunk_size=FINGERPRINT_CHUNK):
+    """Быстрый отпечаток файла: размер + начало, середина и конец (не читает файл целиком)."""
+    size = os.path.getsize(path)
+    digest = hashlib.sha1(str(size).encode("ascii"))
+    with open(path, "rb") as f:
+        for offset in sorted({0, max(size // 2 - chunk_size // 2, 0), max(size - chunk_size, 0)}):
+            f.seek(offset)
+            digest.update(f.read(chunk_size))
+    return digest.hexdigest()
+
+
+def settings_hash(settings) -> str:
+    if is_dataclass(settings):
+        settings = asdict(settings)
+    relevant = {name: value for name, value in (settings or {}).items() if name not in EXECUTION_SETTINGS}
+    return hashlib.sha1(json.dumps(relevant, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def parse_recorded_at(value) -> str:
+    """ISO-время (YYYY-MM-DD[THH:MM[:SS]]) в виде, в котором оно хранится в каталоге: местное, без пояса."""
+    recorded = datetime.datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if recorded.tzinfo is not None:
+        recorded = recorded.astimezone().replace(tzinfo=None)
+    return recorded.isoformat(timespec="seconds")
+
+
+def _filename_recorded_at(video_path) -> Optional[str]:
+    match = RECORDED_AT_PATTERN.search(os.path.basename(video_path))
+    if match is None:
+        return None
+    try:
+        return datetime.datetime(*(int(part or 0) for part in match.groups())).isoformat(timespec="seconds")
+    except ValueError:
+        return None
+
+
+def _probe_creation_time(video_path) -> Optional[str]:
+    ffprobe = shutil.which("ffprobe")
+    if ffprobe is None:
+        return None
+    command = [ffprobe, "-v", "error", "-show_entries", "format_tags=creation_time", "-of", "json", video_path]
+    try:
+        process = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=30)
+        value = json.loads(process.stdout or b"{}").get("format", {}).get("tags", {}).get("creation_time")
+        if process.returncode != 0 or not value:
+            return None
+        # creation_time пишется в UTC, отчёт по дням — в местном времени, как и имена файлов
+        return parse_recorded_at(value)
+    except (OSError, subprocess.SubprocessError, ValueError):
+        return None
+
+
+def recording_time(video_path) -> Optional[str]:
+    """Время начала записи: из имени файла, иначе из тега creation_time (ffprobe), иначе None."""
+    return _filename_recorded_at(video_path) or _probe_creation_time(video_path)
+
+
+@dataclass
+class CatalogEntry:
+    video_id: int
+    fingerprint: str
+    path: str
+    channel: Optional[str]
+    recorded_at: Optional[str]
+    duration: Optional[float]
+    model: Optional[str]
+    settings: dict
+    analyzed_at: str
+    scenes: List[Tuple[float, float]] = field(default_factory=list)
+    scores: List[Optional[float]] = field(default_factory=list)
+    segments: List[Tuple[float, float]] = field(default_factory=list)
+
+
+class Catalog:
+    def __init__(self, path=None):
+        self.path = path or os.environ.get(CATALOG_PATH_ENV) or DEFAULT_CATALOG_PATH
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self.conn = sqlite3.connect(self.path, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA foreign_keys=ON")
+        self.conn.executescript(SCHEMA)
+        self._migrate()
+
+    def _migrate(self):
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(videos)")}
+        if "settings_hash" not in columns:
+            # Старые записи без хэша настроек не совпадут ни с какими настройками и будут пересчитаны
+            with self.conn:
+                self.conn.execute("ALTER TABLE videos ADD COLUMN settings_hash TEXT")
+
+    def close(self):
+        self.conn.close()
+
+    def find(self, fingerprint, model=None, settings=None) -> Optional[CatalogEntry]:
+        """Запись видео; с model (model_loader.model_identity) и settings — только если анализ
+        сделан той же моделью с теми же влияющими на результат настройками."""
+        row = self.conn.execute(
+            "SELECT id, fingerprint, path, channel, recorded_at, duration, model, settings, analyzed_at, "
+            "settings_hash FROM videos WHERE fingerprint = ?", (fingerprint,)
+        ).fetchone()
+        if row is None:
+            return None
+        if model is not None and row[6] != model:
+            return None
+        if settings is not None and row[9] != settings_hash(settings):
+            return None
+
+        entry = CatalogEntry(*row[:7], settings=json.loads(row[7] or "{}"), analyzed_at=row[8])
+        for start, end, score in self.conn.execute(
+                'SELECT start, "end", score FROM scenes WHERE video_id = ? ORDER BY idx', (entry.video_id,)):
+            entry.scenes.append((start, end))
+            entry.scores.append(score)
+        entry.segments = [tuple(row) for row in self.conn.execute(
+            'SELECT start, "end" FROM ad_segments WHERE video_id = ? ORDER BY start', (entry.video_id,))]
+        return entry
+
+    def find_by_path(self, video_path, model=None, settings=None) -> Optional[CatalogEntry]:
+        return self.find(file_fingerprint(video_path), model, settings)
+
+    def save(self, video_path, result, metadata=None, model=None, settings=None,
+             channel=None, recorded_at=None, fingerprint=None) -> int:
+        """Сохраняет (или перезаписывает) результат analysis.AnalysisResult для видео.
+
+        model — model_loader.model_identity, чтобы find отличал результаты другой модели или весов.
+        recorded_at — время начала записи (ISO), по умолчанию recording_time; если его не удалось
+        узнать, видео не входит в отчёт по дням, пока время не задано через tag."""
+        metadata = metadata or {}
+        fingerprint = fingerprint or file_fingerprint(video_path)
+        if channel is None:
+            # По умолчанию записи одного канала лежат в одном каталоге
+            channel = os.path.basename(os.path.dirname(os.path.abspath(video_path))) or None
+        recorded_at = parse_recorded_at(recorded_at) if recorded_at else recording_time(video_path)
+        if is_dataclass(settings):
+            settings = asdict(settings)
+
+        with self.conn:
+            self.conn.execute("DELETE FROM videos WHERE fingerprint = ?", (fingerprint,))
+            video_id = self.conn.execute(
+                "INSERT INTO videos (fingerprint, path, file_name, file_size, channel, recorded_at, duration, fps, "
+                "frame_count, width, height, model, settings, settings_hash, analyzed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    fingerprint, os.path.abspath(video_path), os.path.basename(video_path),
+                    os.path.getsize(video_path), channel, recorded_at,
+                    metadata.get("duration"), metadata.get("fps"), metadata.get("frame_count"),
+                    metadata.get("width"), metadata.get("height"), model,
+                    json.dumps(settings or {}), settings_hash(settings),
+                    datetime.datetime.now().isoformat(timespec="seconds"),
+                )
+            ).lastrowid
+            self.conn.executemany(
+                'INSERT INTO scenes (video_id, idx, start, "end", score) VALUES (?, ?, ?, ?, ?)',
+                [(video_id, i, start, end, score)
+                 for i, ((start, end), score) in enumerate(zip(result.scenes, result.scores))]
+            )
+            self.conn.executemany(
+                'INSERT INTO ad_segments (video_id, start, "end") VALUES (?, ?, ?)',
+                [(video_id, start, end) for start, end in result.segments]
+            )
+        return video_id
+
+    def tag(self, fingerprint, channel=None, recorded_at=None) -> bool:
+        """Задаёт канал и/или время начала записи уже сохранённого видео; False — видео нет в каталоге."""
+        with self.conn:
+            cursor = self.conn.execute(
+                "UPDATE videos SET channel = COALESCE(?, channel), recorded_at = COALESCE(?, recorded_at) "
+                "WHERE fingerprint = ?",
+                (channel, parse_recorded_at(recorded_at) if recorded_at else None, fingerprint)
+            )
+        return cursor.rowcount == 1
+
+    def ad_seconds_per_channel_per_day(self, channel=None, since=None, until=None):
+        """[(канал, день, секунд рекламы), ...]; день считается по времени начала сегмента.
+        Видео без известного времени начала записи (recorded_at IS NULL) не учитываются."""
+        return self.conn.execute(
+            """
+            SELECT channel, day, SUM(seconds) FROM (
+                SELECT v.channel AS channel,
+                       date(v.recorded_at, printf('+%d seconds', CAST(s.start AS INTEGER))) AS day,
+                       s."end" - s.start AS seconds
+                FROM ad_segments s JOIN videos v ON v.id = s.video_id
+                WHERE v.recorded_at IS NOT NULL AND (:channel IS NULL OR v.channel = :channel)
+            )
+            WHERE (:since IS NULL OR day >= :since) AND (:until IS NULL OR day <= :until)
+            GROUP BY channel, day
+            ORDER BY day, channel
+            """,
+            {"channel": channel, "since": since, "until": until}
+        ).fetchall()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Query the catalog of analyzed videos")
+    parser.add_argument("--catalog", default=None, help=f"defaults to ${CATALOG_PATH_ENV} or {DEFAULT_CATALOG_PATH}")
+    sub = parser.add_subparsers(dest="command", required=True)
+    report = sub.add_parser("report", help="total ad seconds per channel per day")
+    report.add_argument("--channel")
+    report.add_argument("--since", help="YYYY-MM-DD")
+    report.add_argument("--until", help="YYYY-MM-DD")
+    tag = sub.add_parser("tag", help="set the channel and/or recording start of analyzed videos")
+    tag.add_argument("paths", nargs="+")
+    tag.add_argument("--channel")
+    tag.add_argument("--recorded-at", help="recording start, YYYY-MM-DDTHH:MM[:SS]; only with a single video")
+    args = parser.parse_args(argv)
+    if args.command == "tag":
+        if args.channel is None and args.recorded_at is None:
+            parser.error("tag needs --channel and/or --recorded-at")
+        if args.recorded_at is not None:
+            if len(args.paths) > 1:
+                parser.error("--recorded-at applies to a single video")
+            try:
+                parse_recorded_at(args.recorded_at)
+            except ValueError:
+                parser.error(f"invalid --recorded-at: {args.recorded_at}")
+
+    catalog = Catalog(args.catalog)
+    try:
+        if args.command == "report":
+            for channel, day, seconds in catalog.ad_seconds_per_channel_per_day(args.channel, args.since, args.until):
+                print(f"{day}\t{channel}\t{seconds:.1f}")
+        elif args.command == "tag":
+            for path in args.paths:
+                if not catalog.tag(file_fingerprint(path), args.channel, args.recorded_at):
+                    print(f"Not in the catalog: {path}")
+    finally:
+        catalog.close()
+
+
+if __name__ == "__main__":
+    main()
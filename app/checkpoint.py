@@ -0,0 +1,131 @@
+"""Контрольная точка долгого анализа: после сбоя или остановки анализ того же файла
+продолжается с уже посчитанных сцен.
+
+Файл — JSON lines в каталоге артефактов видео: первая строка — заголовок (отпечаток файла,
+модель, влияющие на оценки настройки, сцены и шаг выборки по сценам), дальше по строке на
+готовую сцену. Строки копятся в памяти и дописываются не чаще раза в flush_interval секунд;
+оборванная при падении последняя строка при чтении пропускается.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from artifacts import artifact_dir
+from metrics import METRICS
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_FILE = "checkpoint.jsonl"
+# Настройки, от которых зависят сцены и их оценки; пороги выбора сегментов сюда не входят
+SCORE_SETTINGS = ("frame_interval", "scene_threshold", "scene_downscale", "prefilter", "prefilter_margin",
+                  "sparse_frame_interval", "min_scene_samples", "max_scene_samples", "match_known_ads",
+                  "proxy_cache", "proxy_fps")
+
+
+class AnalysisCheckpoint:
+    def __init__(self, path, identity: dict, flush_interval=1.0, max_buffered=64):
+        self.path = path
+        self.identity = identity
+        self.flush_interval = flush_interval
+        self.max_buffered = max_buffered
+        self._file = None
+        self._buffer = []
+        self._last_flush = 0.0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def for_video(cls, video_path, settings, model_id, fingerprint=None, **options):
+        directory = artifact_dir(video_path, fingerprint)
+        identity = {
+            "fingerprint": os.path.basename(directory),
+            "model": model_id,
+            "settings": {name: getattr(settings, name, None) for name in SCORE_SETTINGS},
+        }
+        return cls(os.path.join(directory, CHECKPOINT_FILE), identity, **options)
+
+    def load(self) -> Optional[Tuple[List[Tuple[float, float]], List[float], Dict[int, float]]]:
+        """(сцены, шаги выборки, {индекс сцены: оценка}) или None, если продолжать нечего."""
+        if not os.path.exists(self.path):
+            return None
+        header = None
+        scores = {}
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if header is None:
+                    header = record
+                    if header.get("identity") != self.identity:
+                        logger.info(f"Checkpoint {self.path} belongs to another model or settings, ignoring it")
+                        return None
+                else:
+                    scores[record["i"]] = record["s"]
+        if header is None:
+            return None
+        scenes = [tuple(scene) for scene in header["scenes"]]
+        return scenes, header["intervals"], {i: s for i, s in scores.items() if 0 <= i < len(scenes)}
+
+    def start(self, scenes, intervals):
+        header = {"identity": self.identity, "scenes": scenes, "intervals": intervals}
+        with self._lock:
+            self._close_file()
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(json.dumps(header) + "\n")
+            os.replace(tmp_path, self.path)
+
+    def record(self, index, score):
+        with self._lock:
+            self._buffer.append(json.dumps({"i": index, "s": score}) + "\n")
+            now = time.monotonic()
+            if len(self._buffer) >= self.max_buffered or now - self._last_flush >= self.flush_interval:
+                self._flush(now)
+
+    def _flush(self, now=None):
+        if not self._buffer:
+            return
+        with METRICS.timer("checkpoint_flush"):
+            if self._file is None:
+                self._file = open(self.path, "a", encoding="utf-8")
+                if not self._ends_with_newline():
+                    # Хвост оборванной при падении строки не должен склеиться со следующей
+                    self._file.write("\n")
+            self._file.write("".join(self._buffer))
+            self._file.flush()
+        self._buffer.clear()
+        self._last_flush = now or time.monotonic()
+
+    def _ends_with_newline(self):
+        with open(self.path, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            if f.tell() == 0:
+                return True
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b"\n"
+
+    def _close_file(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def close(self):
+        with self._lock:
+            self._flush()
+            if self._file is not None:
+                os.fsync(self._file.fileno())
+            self._close_file()
+
+    def remove(self):
+        """Анализ завершён — продолжать нечего."""
+        with self._lock:
+            self._buffer.clear()
+            self._close_file()
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
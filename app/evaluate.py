@@ -0,0 +1,258 @@
+"""Оценка компромисса скорость/точность на размеченных видео.
+
+Для каждой комбинации настроек из сетки прогоняет analyze_video по всем видео каталога,
+меряет время и кадры в секунду и сравнивает найденные рекламные сегменты с разметкой:
+точность/полнота/F1 по сегментам (совпадение при IoU >= --iou), средний IoU совпавших пар и
+IoU по секундам. Итог — JSON и CSV с отметкой Парето-фронта (точность против скорости).
+
+    python evaluate.py videos/ --grid grid.json --output eval
+
+videos/labels.json: {"имя файла": [[начало, конец], ...], ...}
+grid.json: {"frame_interval": [0.5, 1.0], "scene_downscale": [null, 4], "quantize": [false, true]}
+Ключи сетки — поля AnalysisSettings и quantize (int8-квантизация модели).
+"""
+import argparse
+import csv
+import itertools
+import json
+import os
+import time
+from dataclasses import asdict, fields
+from typing import Dict, List, Sequence, Tuple
+
+from analysis import AnalysisSettings, analyze_video
+from intervals import merge_intervals
+from model_loader import load_model, load_weights, quantize_dynamic
+
+Interval = Tuple[float, float]
+
+LABELS_FILE = "labels.json"
+MODEL_OPTIONS = ("quantize",)
+DEFAULT_GRID = {"frame_interval": [0.5, 1.0, 2.0]}
+# Соседние сцены одной рекламы (стык меньше MERGE_GAP секунд) склеиваются в один сегмент
+MERGE_GAP = 0.5
+
+
+def _overlap(a: Interval, b: Interval) -> float:
+    return max(0.0, min(a[1], b[1]) - max(a[0], b[0]))
+
+
+def interval_iou(a: Interval, b: Interval) -> float:
+    inter = _overlap(a, b)
+    union = (a[1] - a[0]) + (b[1] - b[0]) - inter
+    return inter / union if union > 0 else 0.0
+
+
+def _total(intervals):
+    return sum(end - start for start, end in intervals)
+
+
+def segment_scores(predicted: Sequence[Interval], truth: Sequence[Interval], iou_threshold=0.5) -> dict:
+    """Счётчики для одного видео; отношения считаются после суммирования по видео (score_totals)."""
+    predicted = merge_intervals(predicted, MERGE_GAP)
+    truth = merge_intervals(truth, MERGE_GAP)
+
+    pairs = sorted(((interval_iou(p, t), i, j) for i, p in enumerate(predicted) for j, t in enumerate(truth)),
+                   reverse=True)
+    used_pred, used_truth = set(), set()
+    matched_iou = []
+    for iou, i, j in pairs:
+        if iou < iou_threshold:
+            break
+        if i in used_pred or j in used_truth:
+            continue
+        used_pred.add(i)
+        used_truth.add(j)
+        matched_iou.append(iou)
+
+    intersection = sum(_overlap(p, t) for p in predicted for t in truth)
+    return {
+        "predicted": len(predicted),
+        "truth": len(truth),
+        "matched": len(matched_iou),
+        "matched_iou_sum": sum(matched_iou),
+        "predicted_seconds": _total(predicted),
+        "truth_seconds": _total(truth),
+        "overlap_seconds": intersection,
+    }
+
+
+def _ratio(numerator, denominator):
+    return numerator / denominator if denominator else None
+
+
+def score_totals(counts: dict) -> dict:
+    precision = _ratio(counts["matched"], counts["predicted"])
+    recall = _ratio(counts["matched"], counts["truth"])
+    f1 = (2 * precision * recall / (precision + recall)
+          if precision is not None and recall is not None and precision + recall > 0 else 0.0)
+    union = counts["predicted_seconds"] + counts["truth_seconds"] - counts["overlap_seconds"]
+    return {
+        "precision": precision,
+        "recall": recall,
+        "f1": f1,
+        "mean_iou": _ratio(counts["matched_iou_sum"], counts["matched"]),
+        "seconds_iou": _ratio(counts["overlap_seconds"], union),
+        "seconds_precision": _ratio(counts["overlap_seconds"], counts["predicted_seconds"]),
+        "seconds_recall": _ratio(counts["overlap_seconds"], counts["truth_seconds"]),
+    }
+
+
+def pareto_front(rows: List[dict], accuracy_key: str, speed_key: str) -> List[int]:
+    """Индексы строк, которые не хуже остальных сразу по точности и скорости."""
+    front = []
+    for i, row in enumerate(rows):
+        a, s = row[accuracy_key] or 0.0, row[speed_key] or 0.0
+        dominated = any(
+            (other[accuracy_key] or 0.0) >= a and (other[speed_key] or 0.0) >= s
+            and ((other[accuracy_key] or 0.0) > a or (other[speed_key] or 0.0) > s)
+            for j, other in enumerate(rows) if j != i
+        )
+        if not dominated:
+            front.append(i)
+    return front
+
+
+def expand_grid(grid: Dict[str, list]) -> List[dict]:
+    known = {f.name for f in fields(AnalysisSettings)} | set(MODEL_OPTIONS)
+    unknown = set(grid) - known
+    if unknown:
+        raise ValueError(f"Unknown grid keys: {', '.join(sorted(unknown))}")
+    keys = sorted(grid)
+    return [dict(zip(keys, values)) for values in itertools.product(*(grid[key] for key in keys))]
+
+
+def load_labels(directory, labels_path=None) -> Dict[str, List[Interval]]:
+    with open(labels_path or os.path.join(directory, LABELS_FILE), encoding="utf-8") as f:
+        labels = json.load(f)
+    return {os.path.join(directory, name): [tuple(segment) for segment in segments]
+            for name, segments in labels.items()}
+
+
+class ModelVariants:
+    def __init__(self, model_name):
+        self.model_name = model_name
+        self._models = {}
+
+    def get(self, quantize=False):
+        if quantize not in self._models:
+            model = load_weights(self.model_name) if quantize else load_model(self.model_name)
+            if model is None:
+                raise RuntimeError(f"Model {self.model_name} could not be loaded")
+            if quantize:
+                # int8-модель считает только на CPU; буферы кадров под неё — тоже на CPU (buffer_pool)
+                model = quantize_dynamic(model)
+            self._models[quantize] = model
+        return self._models[quantize]
+
+
+def evaluate_config(labels, options, models: ModelVariants, iou_threshold) -> dict:
+    settings_options = {key: value for key, value in options.items() if key not in MODEL_OPTIONS}
+    # Индекс известной рекламы исказил бы замер; в сетке его можно включить явно
+    settings_options.setdefault("match_known_ads", False)
+    settings = AnalysisSettings(**settings_options)
+    model = models.get(quantize=options.get("quantize", False))
+
+    totals = None
+    videos = {}
+    wall_seconds = 0.0
+    frames = 0
+    video_seconds = 0.0
+    for video_path, truth in labels.items():
+        started = time.perf_counter()
+        result = analyze_video(video_path, model, settings)
+        elapsed = time.perf_counter() - started
+        counts = segment_scores(result.segments, truth, iou_threshold)
+        video_frames = result.metrics.get("counters", {}).get("frames_classified", 0)
+        duration = max((end for _, end in result.scenes), default=0.0)
+
+        wall_seconds += elapsed
+        frames += video_frames
+        video_seconds += duration
+        totals = counts if totals is None else {key: totals[key] + value for key, value in counts.items()}
+        videos[video_path] = dict(score_totals(counts), counts=counts, wall_seconds=elapsed,
+                                  frames_classified=video_frames, segments=result.segments)
+
+    row = dict(options)
+    row.update(score_totals(totals or segment_scores([], [])))
+    row.update({
+        "wall_seconds": wall_seconds,
+        "frames_classified": frames,
+        "frames_per_sec": frames / wall_seconds if wall_seconds > 0 else None,
+        "realtime_factor": video_seconds / wall_seconds if wall_seconds > 0 else None,
+    })
+    return {"row": row, "settings": asdict(settings), "videos": videos}
+
+
+def run_evaluation(args) -> dict:
+    labels = load_labels(args.directory, args.labels)
+    grid = DEFAULT_GRID
+    if args.grid:
+        with open(args.grid, encoding="utf-8") as f:
+            grid = json.load(f)
+    configs = expand_grid(grid)
+    models = ModelVariants(args.model)
+
+    runs = []
+    for i, options in enumerate(configs, 1):
+        print(f"[{i}/{len(configs)}] {json.dumps(options)}")
+        run = evaluate_config(labels, options, models, args.iou)
+        row = run["row"]
+        print(f"    f1 {row['f1']:.3f}  seconds IoU {row['seconds_iou'] or 0:.3f}  "
+              f"{row['frames_per_sec'] or 0:.1f} frames/s  x{row['realtime_factor'] or 0:.1f} realtime")
+        runs.append(run)
+
+    rows = [run["row"] for run in runs]
+    front = set(pareto_front(rows, args.accuracy, args.speed))
+    for i, row in enumerate(rows):
+        row["pareto"] = i in front
+    return {
+        "grid": grid,
+        "iou_threshold": args.iou,
+        "objectives": {"accuracy": args.accuracy, "speed": args.speed},
+        "videos": list(labels),
+        "runs": runs,
+        "pareto_front": [rows[i] for i in sorted(front, key=lambda i: -(rows[i][args.speed] or 0))],
+    }
+
+
+def write_csv(path, rows):
+    columns = []
+    for row in rows:
+        columns.extend(key for key in row if key not in columns)
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=columns)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Sweep pipeline settings over labeled videos")
+    parser.add_argument("directory", help=f"videos plus {LABELS_FILE} with ground-truth ad intervals")
+    parser.add_argument("--labels", default=None, help=f"defaults to <directory>/{LABELS_FILE}")
+    parser.add_argument("--grid", default=None, help=f"JSON grid of settings, defaults to {json.dumps(DEFAULT_GRID)}")
+    parser.add_argument("--model", default="Swin")
+    parser.add_argument("--iou", type=float, default=0.5, help="IoU needed to match a predicted segment")
+    parser.add_argument("--accuracy", default="f1",
+                        choices=["f1", "precision", "recall", "mean_iou", "seconds_iou"])
+    parser.add_argument("--speed", default="realtime_factor", choices=["realtime_factor", "frames_per_sec"])
+    parser.add_argument("--output", default="evaluation", help="writes <output>.json and <output>.csv")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    report = run_evaluation(args)
+    with open(args.output + ".json", "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    write_csv(args.output + ".csv", [run["row"] for run in report["runs"]])
+    print("Pareto front:")
+    for row in report["pareto_front"]:
+        options = {key: row[key] for key in report["grid"]}
+        print(f"    {json.dumps(options)}: {args.accuracy} {row[args.accuracy] or 0:.3f}, "
+              f"{args.speed} {row[args.speed] or 0:.2f}")
+    print(f"Results written to {args.output}.json and {args.output}.csv")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+"""Экспорт без перекодирования: видео без рекламы или только реклама.
+
+Найденные рекламные сегменты превращаются в список фрагментов, границы которых сдвинуты
+к ключевым кадрам (keyframes.py): ближайший ключевой кадр в пределах tolerance секунд, иначе
+начало фрагмента уходит вперёд к следующему ключевому кадру, чтобы в выход не попали кадры
+соседнего сегмента. Фрагменты склеивает локальный ffmpeg (concat demuxer с inpoint/outpoint,
+-c copy) — секунды вместо перекодирования в реальном времени. Список фрагментов можно
+сохранить как JSON или EDL (CMX 3600).
+
+    python export.py video.mp4 --mode ad_free --output clean.mp4 --cut-list cuts.json --edl cuts.edl
+"""
+import argparse
+import json
+import logging
+import os
+import shutil
+import subprocess
+import tempfile
+from dataclasses import asdict, dataclass
+from typing import List, Optional, Sequence, Tuple
+
+from catalog import Catalog
+from intervals import merge_intervals
+from keyframes import Keyframes, keyframe_index, probe_video
+from metrics import METRICS
+
+logger = logging.getLogger(__name__)
+
+Interval = Tuple[float, float]
+
+MODES = ("ad_free", "ads_only")
+# Соседние рекламные сцены со стыком меньше этого склеиваются в один блок
+MERGE_GAP = 0.5
+MIN_CUT = 0.1
+
+
+@dataclass
+class Cut:
+    start: float
+    end: float
+    # Границы до привязки к ключевым кадрам
+    requested_start: float
+    requested_end: float
+
+    @property
+    def duration(self) -> float:
+        return self.end - self.start
+
+
+def keep_intervals(segments: Sequence[Interval], duration: float, mode="ad_free") -> List[Interval]:
+    """Что остаётся в выходе: промежутки между рекламой или сама реклама."""
+    if mode not in MODES:
+        raise ValueError(f"Unknown export mode: {mode}")
+    ads = [(max(start, 0.0), min(end, duration)) for start, end in merge_intervals(segments, MERGE_GAP)
+           if end > 0 and start < duration]
+    if mode == "ads_only":
+        return ads
+    keep = []
+    position = 0.0
+    for start, end in ads:
+        if start > position:
+            keep.append((position, start))
+        position = max(position, end)
+    if position < duration:
+        keep.append((position, duration))
+    return keep
+
+
+def snap_start(seconds, keyframes: Keyframes, tolerance) -> Optional[float]:
+    nearest = keyframes.nearest(seconds)
+    if nearest is not None and abs(nearest - seconds) <= tolerance:
+        return nearest
+    return keyframes.at_or_after(seconds)
+
+
+def snap_end(seconds, keyframes: Keyframes, tolerance) -> float:
+    # Конец фрагмента не обязан быть ключевым кадром, но привязка к тому же кадру, что и начало
+    # соседнего фрагмента, делает выходы ad_free и ads_only взаимно дополняющими
+    nearest = keyframes.nearest(seconds)
+    if nearest is not None and abs(nearest - seconds) <= tolerance:
+        return nearest
+    return seconds
+
+
+def cut_list(segments: Sequence[Interval], duration: float, keyframes: Keyframes,
+             mode="ad_free", tolerance=1.0, min_cut=MIN_CUT) -> List[Cut]:
+    cuts = []
+    for start, end in keep_intervals(segments, duration, mode):
+        snapped_start = 0.0 if start <= 0 else snap_start(start, keyframes, tolerance)
+        snapped_end = duration if end >= duration else snap_end(end, keyframes, tolerance)
+        if snapped_start is None or snapped_end - snapped_start < min_cut:
+            logger.info(f"Dropping cut {start:.2f}-{end:.2f}: no keyframe inside")
+            continue
+        cuts.append(Cut(snapped_start, snapped_end, start, end))
+    return cuts
+
+
+def _concat_line(path):
+    return "file '" + os.path.abspath(path).replace("'", "'\\''") + "'\n"
+
+
+def concat_script(video_path, cuts: Sequence[Cut], duration: float, start_time=0.0) -> str:
+    # inpoint/outpoint — метки файла, а время фрагментов отсчитывается от начала дорожки
+    lines = []
+    for cut in cuts:
+        lines.append(_concat_line(video_path))
+        if cut.start > 0:
+            lines.append(f"inpoint {cut.start + start_time:.6f}\n")
+        if cut.end < duration:
+            lines.append(f"outpoint {cut.end + start_time:.6f}\n")
+    return "".join(lines)
+
+
+def run_ffmpeg_concat(video_path, cuts: Sequence[Cut], duration: float, output_path, start_time=0.0):
+    ffmpeg = shutil.which("ffmpeg")
+    if ffmpeg is None:
+        raise RuntimeError("ffmpeg not found, install ffmpeg")
+    if not cuts:
+        raise ValueError("Nothing to export")
+
+    fd, script_path = tempfile.mkstemp(suffix=".ffconcat", text=True)
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(concat_script(video_path, cuts, duration, start_time))
+        command = [ffmpeg, "-nostdin", "-v", "error", "-y", "-f", "concat", "-safe", "0", "-i", script_path,
+                   "-map", "0", "-c", "copy", "-avoid_negative_ts", "make_zero", output_path]
+        with METRICS.timer("export_ffmpeg"):
+            process = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        if process.returncode != 0:
+            raise RuntimeError(f"ffmpeg failed: {process.stderr.decode(errors='replace').strip()}")
+    finally:
+        os.remove(script_path)
+
+
+def _timecode(seconds, fps):
+    frames = int(round(seconds * fps))
+    rate = max(int(round(fps)), 1)
+    return (f"{frames // (rate * 3600):02d}:{frames // (rate * 60) % 60:02d}:"
+            f"{frames // rate % 60:02d}:{frames % rate:02d}")
+
+
+def to_edl(cuts: Sequence[Cut], fps: float, title="Ad Detector") -> str:
+    """EDL CMX 3600: по событию на фрагмент, запись идёт подряд с нуля."""
+    lines = [f"TITLE: {title}", "FCM: NON-DROP FRAME", ""]
+    record = 0.0
+    for i, cut in enumerate(cuts, 1):
+        lines.append(f"{i:03d}  AX       AA/V  C        "
+                     f"{_timecode(cut.start, fps)} {_timecode(cut.end, fps)} "
+                     f"{_timecode(record, fps)} {_timecode(record + cut.duration, fps)}")
+        record += cut.duration
+    return "\n".join(lines) + "\n"
+
+
+def to_json(video_path, segments, cuts: Sequence[Cut], mode, tolerance, duration) -> dict:
+    return {
+        "video": os.path.abspath(video_path),
+        "mode": mode,
+        "tolerance": tolerance,
+        "duration": duration,
+        "segments": [list(segment) for segment in segments],
+        "cuts": [asdict(cut) for cut in cuts],
+    }
+
+
+def plan_export(video_path, segments, mode="ad_free", tolerance=1.0, keyframes=None):
+    """(фрагменты, метаданные ffprobe, ключевые кадры) без запуска ffmpeg."""
+    info = probe_video(video_path)
+    keyframes = keyframes if keyframes is not None else keyframe_index(video_path)
+    return cut_list(segments, info["duration"], keyframes, mode, tolerance), info, keyframes
+
+
+def export_video(video_path, segments, output_path=None, mode="ad_free", tolerance=1.0,
+                 cut_list_path=None, edl_path=None, keyframes=None) -> List[Cut]:
+    """Пишет видео (output_path) и/или списки фрагментов; возвращает фрагменты."""
+    cuts, info, keyframes = plan_export(video_path, segments, mode, tolerance, keyframes)
+    if cut_list_path:
+        with open(cut_list_path, "w", encoding="utf-8") as f:
+            json.dump(to_json(video_path, segments, cuts, mode, tolerance, info["duration"]), f, indent=2)
+    if edl_path:
+        with open(edl_path, "w", encoding="utf-8") as f:
+            f.write(to_edl(cuts, info["fps"] or 25.0, title=os.path.basename(video_path)))
+    if output_path:
+        run_ffmpeg_concat(video_path, cuts, info["duration"], output_path, keyframes.start_time)
+        logger.info(f"Exported {len(cuts)} cuts ({sum(cut.duration for cut in cuts):.1f} s) to {output_path}")
+    return cuts
+
+
+def load_segments(video_path, segments_path=None) -> List[Interval]:
+    if segments_path:
+        with open(segments_path, encoding="utf-8") as f:
+            return [tuple(segment) for segment in json.load(f)]
+    catalog = Catalog()
+    try:
+        entry = catalog.find_by_path(video_path)
+    finally:
+        catalog.close()
+    if entry is None:
+        raise SystemExit(f"{video_path} has not been analyzed yet, pass --segments")
+    return entry.segments
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Cut detected ads out (or keep only them) without re-encoding")
+    parser.add_argument("video")
+    parser.add_argument("--segments", default=None,
+                        help="JSON list of [start, end] ad segments, defaults to the catalog entry")
+    parser.add_argument("--mode", choices=MODES, default="ad_free")
+    parser.add_argument("--tolerance", type=float, default=1.0,
+                        help="max shift of a boundary to the nearest keyframe, seconds")
+    parser.add_argument("--output", default=None, help="video file to write")
+    parser.add_argument("--cut-list", default=None, help="JSON cut list to write")
+    parser.add_argument("--edl", default=None, help="CMX 3600 EDL to write")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    logging.basicConfig(level=logging.INFO)
+    args = parse_args(argv)
+    if not (args.output or args.cut_list or args.edl):
+        raise SystemExit("Nothing to do: pass --output, --cut-list or --edl")
+    segments = load_segments(args.video, args.segments)
+    cuts = export_video(args.video, segments, args.output, args.mode, args.tolerance, args.cut_list, args.edl)
+    for cut in cuts:
+        print(f"{cut.start:10.3f} - {cut.end:10.3f}  (requested {cut.requested_start:.3f} - {cut.requested_end:.3f})")
+
+
+if __name__ == "__main__":
+    main()
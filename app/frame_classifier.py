@@ -1,11 +1,26 @@
+import itertools
+from contextlib import contextmanager
+
 import cv2
 import torch
 import torchvision.transforms as transforms
 from PIL import Image
-from scenedetect import VideoManager, SceneManager
+from scenedetect import SceneManager
+from scenedetect.backends.opencv import VideoCaptureAdapter
 from scenedetect.detectors import ContentDetector
 
+from ad_index import dhash
+from buffers import BufferPool
+from metrics import METRICS
+from sampling import sample_times
+from video_source import lease_capture
+
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+BATCH_SIZE = 16
+# Класс "реклама" на выходе модели (см. ad_percentage)
+AD_LABEL = 0
+BUFFER_POOL = BufferPool(device)
+_BUFFER_POOLS = {device: BUFFER_POOL}
 
 
 transform = transforms.Compose([
@@ -16,91 +31,196 @@ transform = transforms.Compose([
 
 
 def classify_frame(frame, model):
-    image = Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
-    image_tensor = transform(image).unsqueeze(0).to(device)
-    with torch.no_grad():
+    with METRICS.timer("preprocess"):
+        image = Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+        image_tensor = transform(image).unsqueeze(0).to(model_device(model))
+    with METRICS.timer("forward"), torch.no_grad():
         outputs = model(image_tensor)
         _, predicted = torch.max(outputs, 1)
-    return predicted.item()
-
-
-def process_video_segments(video_path, model, start_time, end_time, frame_interval=0.5):
-    cap = cv2.VideoCapture(video_path)
-    total_frames = 0
-    ad_frames = 0
-    frame_count = 0
-    current_time = start_time
-    while current_time <= end_time:
-        cap.set(cv2.CAP_PROP_POS_MSEC, current_time * 1000)
-        ret, frame = cap.read()
-        if not ret:
-            break
+        label = predicted.item()
+    METRICS.count("frames_classified")
+    return label
 
-        total_frames += 1
-        label = classify_frame(frame, model)
 
-        if label == 0:
-            ad_frames += 1
-
-        current_time += frame_interval
-        frame_count += 1
-
-    cap.release()
-    ad_percentage = (ad_frames / total_frames) * 100 if total_frames > 0 else 0.0
-    return ad_percentage
+def _iter_segment_frames(handle, times, should_stop=None, buffers=None):
+    # handle — video_source.CaptureHandle, times — возрастающие моменты выборки; с buffers кадр
+    # читается в переиспользуемый массив и валиден только до следующей итерации
+    for current_time in times:
+        if should_stop is not None and should_stop():
+            break
+        if not handle.seek(current_time):
+            break
+        with METRICS.timer("decode"):
+            ret, frame = buffers.read(handle) if buffers is not None else handle.read()
+        if not ret:
+            break
+        METRICS.count("frames_decoded")
+        yield current_time, frame
+
+
+@contextmanager
+def _segment_frames(video, start_time, times, should_stop, buffers, proxy=None):
+    # Кадры из прокси (proxy_cache.Proxy) уже 224×224 RGB и не декодируются
+    if proxy is not None:
+        yield proxy.iter_frames(times, should_stop)
+        return
+    with lease_capture(video, start_time) as handle:
+        yield _iter_segment_frames(handle, times, should_stop, buffers)
+
+
+def model_device(model):
+    # model может быть и не nn.Module (service.InferenceBatcher) — тогда устройство по умолчанию
+    parameters = getattr(model, "parameters", None)
+    if parameters is None:
+        return device
+    for tensor in itertools.chain(parameters(), model.buffers()):
+        return tensor.device
+    return device
+
+
+def buffer_pool(model) -> BufferPool:
+    """Пул буферов на устройстве модели: int8-модель (model_loader.quantize_dynamic) работает
+    только на CPU, даже если основная модель на CUDA."""
+    model_dev = model_device(model)
+    pool = _BUFFER_POOLS.get(model_dev)
+    if pool is None:
+        pool = _BUFFER_POOLS.setdefault(model_dev, BufferPool(model_dev))
+    return pool
+
+
+def classify_batch(buffers, model):
+    with METRICS.timer("forward"), torch.no_grad():
+        outputs = model(buffers.tensor())
+        labels = torch.argmax(outputs, 1).tolist()
+    METRICS.count("frames_classified", len(labels))
+    METRICS.count("batches")
+    buffers.reset()
+    return labels
+
+
+def classify_segment(video, model, start_time, end_time, frame_interval=0.5,
+                     should_stop=None, on_frame=None, batch_size=BATCH_SIZE, on_decoded=None,
+                     ad_matcher=None, times=None, proxy=None):
+    """Метки кадров сцены [(время, метка), ...], кадры классифицируются батчами.
+
+    video — путь к файлу или video_source.VideoSource, из пула которого берётся дескриптор.
+    times — готовый план выборки (sampling.scene_sample_times), иначе кадры через frame_interval.
+    proxy — proxy_cache.Proxy: кадры берутся из него без декодирования, on_decoded не вызывается.
+
+    on_decoded(время, кадр) получает каждый декодированный кадр (например, для миниатюр);
+    кадр нельзя сохранять — буфер переиспользуется.
+
+    ad_matcher (ad_index.AdMatchSession): если первые кадры сцены совпали с известной рекламой,
+    они классифицируются сразу, и при согласии модели остальные кадры сцены пропускаются —
+    оценка сцены считается по пробным кадрам."""
+    if times is None:
+        times = sample_times(start_time, end_time, frame_interval)
+    pool = buffer_pool(model)
+    buffers = pool.acquire(batch_size)
+    frame_times = []
+    labels = []
+    probe = [] if ad_matcher is not None else None
+    try:
+        rgb = proxy is not None
+        with _segment_frames(video, start_time, times, should_stop, buffers, proxy) as frames:
+            for current_time, frame in frames:
+                if rgb:
+                    buffers.add_rgb(frame)
+                else:
+                    if on_decoded is not None:
+                        on_decoded(current_time, frame)
+                    buffers.add(frame)
+                frame_times.append(current_time)
+                if probe is not None:
+                    probe.append(dhash(frame, rgb=rgb))
+                    if len(probe) == ad_matcher.probe_frames:
+                        if ad_matcher.match(start_time, end_time, probe) is not None and \
+                                _probe_agrees(ad_matcher, model, labels, buffers, on_frame):
+                            _skip_rest(len(times) - len(frame_times), on_frame)
+                            return list(zip(frame_times, labels))
+                        probe = None
+                if buffers.full:
+                    labels.extend(classify_batch(buffers, model))
+                    if on_frame is not None:
+                        on_frame(batch_size)
+
+        # Сцена короче probe_frames: пропускать нечего, только запоминаем отпечаток для пополнения
+        # индекса (и отмечаем сцену узнанной, если она в нём уже есть)
+        if probe and not (should_stop is not None and should_stop()):
+            ad_matcher.match(start_time, end_time, probe)
+
+        if buffers.count and not (should_stop is not None and should_stop()):
+            count = buffers.count
+            labels.extend(classify_batch(buffers, model))
+            if on_frame is not None:
+                on_frame(count)
+    finally:
+        pool.release(buffers)
+    return list(zip(frame_times, labels))
+
+
+def _probe_agrees(ad_matcher, model, labels, buffers, on_frame) -> bool:
+    # Совпадение отпечатка — только подсказка: заставки, логотипы и студийные планы тоже
+    # повторяются, поэтому пробные кадры классифицируются, и сцену не досчитываем, лишь если
+    # модель тоже видит в них рекламу
+    if buffers.count:
+        count = buffers.count
+        labels.extend(classify_batch(buffers, model))
+        if on_frame is not None:
+            on_frame(count)
+    ad_frames = sum(1 for label in labels if label == AD_LABEL)
+    if labels and ad_frames >= ad_matcher.agree_ratio * len(labels):
+        return True
+    METRICS.count("ad_index_disagreements")
+    return False
+
+
+def _skip_rest(skipped, on_frame):
+    METRICS.count("frames_skipped_by_index", skipped)
+    if on_frame is not None and skipped > 0:
+        on_frame(skipped)
+
+
+def process_video_segments(video, model, start_time, end_time, frame_interval=0.5,
+                           should_stop=None, on_frame=None, batch_size=BATCH_SIZE, on_decoded=None,
+                           ad_matcher=None, times=None, proxy=None):
+    labels = classify_segment(video, model, start_time, end_time, frame_interval,
+                              should_stop, on_frame, batch_size, on_decoded, ad_matcher, times, proxy)
+    return ad_percentage(labels)
+
+
+def ad_percentage(labels):
+    total_frames = len(labels)
+    ad_frames = sum(1 for _, label in labels if label == AD_LABEL)
+    return (ad_frames / total_frames) * 100 if total_frames > 0 else 0.0
 
 
 # Вычисляем взвешенный процент рекламы
-def process_video_segments_weigth(video_path, model, start_time, end_time, frame_interval=0.5):
-    cap = cv2.VideoCapture(video_path)
+def process_video_segments_weigth(video, model, start_time, end_time, frame_interval=0.5,
+                                  should_stop=None, on_frame=None, batch_size=BATCH_SIZE, on_decoded=None,
+                                  ad_matcher=None, times=None, proxy=None):
+    labels = classify_segment(video, model, start_time, end_time, frame_interval,
+                              should_stop, on_frame, batch_size, on_decoded, ad_matcher, times, proxy)
     total_weighted_value = 0.0
     total_weight = 0.0
-    current_time = start_time
     segment_duration = end_time - start_time
-    while current_time <= end_time:
-        cap.set(cv2.CAP_PROP_POS_MSEC, current_time * 1000)
-        ret, frame = cap.read()
-        if not ret:
-            break
+    for current_time, label in labels:
         frame_position = (current_time - start_time) / segment_duration
         weight = frame_position
 
-        label = classify_frame(frame, model)
         total_weight += weight
-        if label == 0:
+        if label == AD_LABEL:
             total_weighted_value += weight
 
-        current_time += frame_interval
-
-    cap.release()
     weighted_ad_percentage = (total_weighted_value / total_weight) * 100 if total_weight > 0 else 0.0
     return weighted_ad_percentage
 
-def process_video_segments_after_(video_path, model, start_time, end_time, frame_interval=0.5):
-    cap = cv2.VideoCapture(video_path)
-    total_frames = 0
-    ad_frames = 0
-    frame_count = 0
-    current_time = start_time
-
-    while current_time <= end_time:
-        cap.set(cv2.CAP_PROP_POS_MSEC, current_time * 1000)
-        ret, frame = cap.read()
-        if not ret:
-            break
-
-        total_frames += 1
-        label = classify_frame(frame, model)
-
-        if label == 0:
-            ad_frames += 1
-
-        current_time += frame_interval
-        frame_count += 1
-
-    cap.release()
-    ad_percentage = (ad_frames / total_frames) * 100 if total_frames > 0 else 0.0
-    return ad_percentage
+def process_video_segments_after_(video, model, start_time, end_time, frame_interval=0.5,
+                                  should_stop=None, on_frame=None, batch_size=BATCH_SIZE, on_decoded=None,
+                                  ad_matcher=None, times=None, proxy=None):
+    return process_video_segments(video, model, start_time, end_time, frame_interval,
+                                  should_stop=should_stop, on_frame=on_frame, batch_size=batch_size,
+                                  on_decoded=on_decoded, ad_matcher=ad_matcher, times=times, proxy=proxy)
 
 
 def detect_ad_scenes_from_segments(video_path, model, name, threshold):
@@ -125,24 +245,55 @@ def detect_ad_scenes_from_segments_and_get_all_results_to_logs(video_path, scene
     return result_dict
 
 
-def detect_ad_scenes_from_segments_and_get_all_results(video_path, scenes, model):
+def detect_ad_scenes_from_segments_and_get_all_results(video_path, scenes, model, should_stop=None, on_frame=None):
     result_dict = {}
     for start, end in scenes:
-        result = process_video_segments_after_(video_path, model, start, end)
+        if should_stop is not None and should_stop():
+            break
+        result = process_video_segments_after_(video_path, model, start, end,
+                                               should_stop=should_stop, on_frame=on_frame)
         result_dict[(start, end)] = result
     return result_dict
 
 
-def detect_scenes(video_path, threshold=65.0):
-    video_manager = VideoManager([video_path])
+def detect_scenes(video, threshold=65.0, downscale=None, proxy=None):
+    """downscale — во сколько раз уменьшать кадры для детектора; None — автоматически по ширине.
+    С proxy (proxy_cache.Proxy) сцены ищутся по кадрам прокси без декодирования видео."""
+    with METRICS.timer("detect_scenes"):
+        if proxy is not None:
+            scene_times = _detect_scenes_proxy(proxy, threshold)
+        else:
+            with lease_capture(video, 0.0) as handle:
+                scene_times = _detect_scenes(handle, threshold, downscale)
+    METRICS.count("scenes_detected", len(scene_times))
+    return scene_times
+
+
+def _detect_scenes_proxy(proxy, threshold, min_scene_seconds=0.6):
+    # min_scene_len детектора — в кадрах; 15 кадров по умолчанию при 4 кадрах в секунду
+    # выбросили бы короткие рекламные сцены
     scene_manager = SceneManager()
-    scene_manager.add_detector(ContentDetector(threshold=threshold))
+    scene_manager.add_detector(ContentDetector(threshold=threshold,
+                                               min_scene_len=max(1, round(min_scene_seconds * proxy.fps))))
+    scene_manager.auto_downscale = False
+    scene_manager.downscale = 1
+    scene_manager.detect_scenes(video=VideoCaptureAdapter(proxy.capture(), framerate=proxy.fps))
+    scene_list = scene_manager.get_scene_list()
+    return [(start.get_seconds(), end.get_seconds()) for start, end in scene_list]
 
-    video_manager.set_downscale_factor()
-    video_manager.start()
-    scene_manager.detect_scenes(frame_source=video_manager)
+
+def _detect_scenes(handle, threshold, downscale):
+    # Сцены ищем на уже открытом дескрипторе пула, а не открываем видео ещё раз через VideoManager
+    handle.seek(0.0)
+    scene_manager = SceneManager()
+    scene_manager.add_detector(ContentDetector(threshold=threshold))
+    if downscale is not None:
+        scene_manager.auto_downscale = False
+        scene_manager.downscale = downscale
+    try:
+        scene_manager.detect_scenes(video=VideoCaptureAdapter(handle.cap))
+    finally:
+        handle.invalidate()
 
     scene_list = scene_manager.get_scene_list()
-    scene_times = [(start.get_seconds(), end.get_seconds()) for start, end in scene_list]
-    video_manager.release()
-    return scene_times
+    return [(start.get_seconds(), end.get_seconds()) for start, end in scene_list]
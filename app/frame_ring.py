@@ -0,0 +1,150 @@
+"""Кольцевой буфер кадров в shared memory между процессами-декодерами и процессом инференса.
+
+Декодеры пишут готовые 224×224 RGB uint8 кадры прямо в слоты кольца, процесс инференса читает
+их оттуда без pickle. Передача слота — по номерам последовательности (схема Вьюкова):
+производитель с билетом t ждёт seq[slot] == t, пишет кадр и ставит seq = t + 1; потребитель
+с билетом c ждёт seq[slot] == c + 1, забирает кадр и ставит seq = c + slots.
+
+Модуль намеренно не импортирует torch: он грузится в каждом дочернем процессе.
+"""
+import time
+from multiprocessing import shared_memory
+
+import cv2
+import numpy as np
+
+from video_source import VideoSource
+
+KIND_FRAME = 0
+KIND_END_OF_SCENE = 1
+
+_META_FIELDS = 4  # seq, kind, scene, time (float64 в int64-ячейке)
+
+
+class FrameRing:
+    def __init__(self, shm, slots, size, lock, ticket, owner):
+        self.shm = shm
+        self.slots = slots
+        self.size = size
+        self._lock = lock
+        self._ticket = ticket
+        self._owner = owner
+        self._next_read = 0
+
+        meta_bytes = slots * _META_FIELDS * 8
+        meta = np.ndarray((_META_FIELDS, slots), dtype=np.int64, buffer=shm.buf)
+        self.seq = meta[0]
+        self.kind = meta[1]
+        self.scene = meta[2]
+        self.time = meta[3].view(np.float64)
+        self.frames = np.ndarray((slots, size, size, 3), dtype=np.uint8, buffer=shm.buf, offset=meta_bytes)
+
+    @classmethod
+    def create(cls, ctx, slots=64, size=224):
+        nbytes = slots * _META_FIELDS * 8 + slots * size * size * 3
+        shm = shared_memory.SharedMemory(create=True, size=nbytes)
+        ticket = ctx.Value("q", 0)
+        ring = cls(shm, slots, size, ticket.get_lock(), ticket, owner=True)
+        ring.seq[:] = np.arange(slots)
+        return ring
+
+    @classmethod
+    def attach(cls, spec):
+        name, slots, size, ticket = spec
+        try:
+            shm = shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:
+            # До Python 3.13 нет track=False; дочерние процессы делят resource_tracker родителя,
+            # поэтому повторная регистрация сегмента безвредна, а удаляет его только владелец
+            shm = shared_memory.SharedMemory(name=name)
+        return cls(shm, slots, size, ticket.get_lock(), ticket, owner=False)
+
+    def spec(self):
+        return self.shm.name, self.slots, self.size, self._ticket
+
+    def _fence(self):
+        # Захват семафора — полный барьер памяти, нужен на архитектурах со слабым порядком записи
+        with self._lock:
+            pass
+
+    # --- сторона декодера ---
+
+    def claim(self, stop_event=None):
+        with self._lock:
+            ticket = self._ticket.value
+            self._ticket.value = ticket + 1
+        slot = ticket % self.slots
+        while self.seq[slot] != ticket:
+            if stop_event is not None and stop_event.is_set():
+                return None, None
+            time.sleep(0.0005)
+        return ticket, slot
+
+    def publish(self, ticket, slot, kind, scene, frame_time):
+        self.kind[slot] = kind
+        self.scene[slot] = scene
+        self.time[slot] = frame_time
+        with self._lock:
+            self.seq[slot] = ticket + 1
+
+    # --- сторона инференса (один потребитель) ---
+
+    def ready(self):
+        slot = self._next_read % self.slots
+        return self.seq[slot] == self._next_read + 1
+
+    def peek(self):
+        """Слот следующего готового элемента; данные валидны до release()."""
+        self._fence()
+        return self._next_read % self.slots
+
+    def depth(self):
+        return self._ticket.value - self._next_read
+
+    def release(self):
+        slot = self._next_read % self.slots
+        self.seq[slot] = self._next_read + self.slots
+        self._next_read += 1
+
+    def close(self):
+        self.frames = None
+        self.seq = self.kind = self.scene = self.time = None
+        self.shm.close()
+        if self._owner:
+            self.shm.unlink()
+
+
+def decode_worker(video_path, jobs, ring_spec, stop_event, keyframes=None):
+    """Процесс-декодер: берёт сцены (с планом выборки) из очереди jobs и пишет кадры сцены в кольцо,
+    после кадров сцены — маркер KIND_END_OF_SCENE."""
+    ring = FrameRing.attach(ring_spec)
+    frame = None
+    resized = np.empty((ring.size, ring.size, 3), dtype=np.uint8)
+    try:
+        with VideoSource(video_path, max_handles=1, keyframes=keyframes) as source, source.lease() as handle:
+            while not stop_event.is_set():
+                job = jobs.get()
+                if job is None:
+                    break
+                scene_index, start_time, end_time, times = job
+                for current_time in times:
+                    if stop_event.is_set():
+                        return
+                    if not handle.seek(current_time):
+                        break
+                    ret, frame = handle.read(frame)
+                    if not ret:
+                        break
+                    ticket, slot = ring.claim(stop_event)
+                    if ticket is None:
+                        return
+                    cv2.resize(frame, (ring.size, ring.size), dst=resized, interpolation=cv2.INTER_AREA)
+                    cv2.cvtColor(resized, cv2.COLOR_BGR2RGB, dst=ring.frames[slot])
+                    ring.publish(ticket, slot, KIND_FRAME, scene_index, current_time)
+
+                ticket, slot = ring.claim(stop_event)
+                if ticket is None:
+                    return
+                ring.publish(ticket, slot, KIND_END_OF_SCENE, scene_index, end_time)
+    finally:
+        ring.close()
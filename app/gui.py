@@ -1,19 +1,28 @@
+import json
 import logging
 import os
-from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
 from typing import List, Tuple, Optional
 
-import cv2
 import matplotlib
 import matplotlib.pyplot as plt
-from PyQt6.QtCore import QThread, pyqtSignal, Qt
+from PyQt6.QtCore import QThread, QTimer, pyqtSignal, Qt
 from PyQt6.QtWidgets import (
     QLabel, QFileDialog, QHBoxLayout, QPushButton, QScrollArea,
-    QMessageBox, QWidget, QVBoxLayout, QSplitter, QSizePolicy)
+    QMessageBox, QWidget, QVBoxLayout, QSplitter, QSizePolicy, QProgressBar)
 
 from app import model_loader
-from frame_classifier import detect_ad_scenes_from_segments_and_get_all_results, detect_scenes
+from analysis import AnalysisResult, AnalysisSettings, analyze_video, select_ad_scenes
+from artifacts import artifact_dir
+from catalog import Catalog, file_fingerprint
+from checkpoint import AnalysisCheckpoint
+from export import export_video
+from metrics import METRICS
+from service_client import analyze_remote, service_url
 from player import VLCPlayer, format_time
+from thumbnails import ThumbnailIndex, ThumbnailSpriteWriter
+from video_source import VideoSource
 from styles import (
     MAIN_STYLE, VIDEO_LABEL_STYLE, VIDEO_INFO_LABEL_STYLE,
     get_html_style, get_button_style
@@ -25,6 +34,9 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Насколько граница экспортируемого фрагмента может сдвинуться к ключевому кадру, секунды
+EXPORT_TOLERANCE = 1.0
+
 matplotlib.use("QtAgg")
 plt.ioff()
 
@@ -40,7 +52,10 @@ class Worker(QThread):
     finished = pyqtSignal()
     result = pyqtSignal(object)
     error = pyqtSignal(str)
-    progress = pyqtSignal(int)
+    # scenes_done, scenes_total, frames_done, frames_total, eta_seconds (-1 — оценки пока нет)
+    progress = pyqtSignal(int, int, int, int, float)
+    scenes_detected = pyqtSignal(object)
+    scene_result = pyqtSignal(int, float)
 
     def __init__(self, classify_func, *args, **kwargs):
         super().__init__()
@@ -52,6 +67,9 @@ class Worker(QThread):
     def stop(self):
         self._is_running = False
 
+    def should_stop(self) -> bool:
+        return not self._is_running
+
     def run(self):
         try:
             if not self._is_running:
@@ -65,8 +83,45 @@ class Worker(QThread):
             if self._is_running:
                 self.error.emit(str(e))
         finally:
-            if self._is_running:
-                self.finished.emit()
+            self.finished.emit()
+
+
+class AnalysisProgress:
+    """Потокобезопасный счётчик кадров и сцен: шлёт прогресс с оценкой оставшегося времени не чаще min_interval."""
+
+    def __init__(self, worker: Worker, scenes_total: int, frames_total: int, min_interval: float = 0.25):
+        self.worker = worker
+        self.scenes_total = scenes_total
+        self.frames_total = frames_total
+        self.scenes_done = 0
+        self.frames_done = 0
+        self.min_interval = min_interval
+        self._started = time.monotonic()
+        self._last_emit = 0.0
+        self._lock = threading.Lock()
+
+    def frame_done(self, count: int = 1):
+        with self._lock:
+            self.frames_done += count
+            self._emit(force=False)
+
+    def scene_done(self):
+        with self._lock:
+            self.scenes_done += 1
+            self._emit(force=True)
+
+    def _emit(self, force: bool):
+        now = time.monotonic()
+        if not force and now - self._last_emit < self.min_interval:
+            return
+        self._last_emit = now
+
+        eta = -1.0
+        if self.frames_done:
+            rate = self.frames_done / (now - self._started)
+            eta = max(self.frames_total - self.frames_done, 0) / rate
+        self.worker.progress.emit(self.scenes_done, self.scenes_total,
+                                  self.frames_done, self.frames_total, eta)
 
 
 class VideoAnalyzerApp(QWidget):
@@ -78,6 +133,21 @@ class VideoAnalyzerApp(QWidget):
         self.duration: float = 0
         self.vlc_player: Optional[VLCPlayer] = None
         self.worker: Optional[Worker] = None
+        self.export_worker: Optional[Worker] = None
+        self.settings = AnalysisSettings()
+        self.scenes: List[Tuple[float, float]] = []
+        self.scene_scores: List[Optional[float]] = []
+        self._pending_scene_results = 0
+        self.video_meta: dict = {}
+        self.video_fingerprint: Optional[str] = None
+        # Открыт на время работы с видео: метаданные и дескрипторы переиспользуются анализом
+        self.video_source: Optional[VideoSource] = None
+        self.thumbnails: Optional[ThumbnailIndex] = None
+        self.catalog: Optional[Catalog] = None
+        try:
+            self.catalog = Catalog()
+        except Exception as e:
+            logger.warning(f"Catalog is unavailable, results will not be persisted: {e}")
         self._init_ui()
 
     def _init_ui(self):
@@ -115,11 +185,36 @@ class VideoAnalyzerApp(QWidget):
         self.btn_select.clicked.connect(self._load_video)
         self.btn_analyse = QPushButton("Analyze Video")
         self.btn_analyse.clicked.connect(self._start_analysis)
+        self.btn_stop = QPushButton("Stop Analysis")
+        self.btn_stop.clicked.connect(self._stop_analysis)
+        self.btn_stop.setVisible(False)
+        self.btn_export_clean = QPushButton("Export Without Ads")
+        self.btn_export_clean.clicked.connect(lambda: self._export_video("ad_free"))
+        self.btn_export_ads = QPushButton("Export Ads Only")
+        self.btn_export_ads.clicked.connect(lambda: self._export_video("ads_only"))
+        self.btn_export_cuts = QPushButton("Export Cut List")
+        self.btn_export_cuts.clicked.connect(self._export_cut_list)
+        self._update_export_buttons()
+
+        self.progress_bar = QProgressBar()
+        self.progress_bar.setTextVisible(True)
+        self.progress_bar.setVisible(False)
+
+        # Частичные результаты приходят из потока анализа, перерисовываем не чаще раза в 250 мс
+        self._live_refresh_timer = QTimer(self)
+        self._live_refresh_timer.setSingleShot(True)
+        self._live_refresh_timer.setInterval(250)
+        self._live_refresh_timer.timeout.connect(self._refresh_live_results)
 
         self.left_layout.addWidget(self.video_label)
         self.left_layout.addWidget(self.scroll_area)
+        self.left_layout.addWidget(self.progress_bar)
         self.left_layout.addWidget(self.btn_select)
         self.left_layout.addWidget(self.btn_analyse)
+        self.left_layout.addWidget(self.btn_stop)
+        self.left_layout.addWidget(self.btn_export_clean)
+        self.left_layout.addWidget(self.btn_export_ads)
+        self.left_layout.addWidget(self.btn_export_cuts)
         self.left_layout.addStretch()
 
         self.splitter = QSplitter(Qt.Orientation.Horizontal)
@@ -143,21 +238,19 @@ class VideoAnalyzerApp(QWidget):
             return
 
         try:
+            self._close_video_source()
             self.video_path = file_path
             self.timecodes = None
+            self._hide_video_player()
+            self._update_export_buttons()
             self.video_label.setText(f"Selected: {file_path}")
-            cap = cv2.VideoCapture(file_path)
-            if not cap.isOpened():
-                raise RuntimeError("Failed to open video file")
+            self.video_source = VideoSource(file_path, max_handles=self.settings.max_workers())
 
-            fps = cap.get(cv2.CAP_PROP_FPS)
-            frame_count = cap.get(cv2.CAP_PROP_FRAME_COUNT)
-
-            if fps <= 0:
+            if self.video_source.metadata.fps <= 0:
                 raise RuntimeError("Invalid video FPS")
 
-            self.duration = frame_count / fps
-            cap.release()
+            self.duration = self.video_source.metadata.duration
+            self.video_meta = self.video_source.metadata.as_dict()
 
             minutes = int(self.duration // 60)
             seconds = int(self.duration % 60)
@@ -167,6 +260,7 @@ class VideoAnalyzerApp(QWidget):
             self.video_info_label.setText(
                 f"Video: {file_name}\nDuration: {duration_str}"
             )
+            self._load_cached_analysis()
 
         except Exception as e:
             logger.error(f"Error loading video: {e}")
@@ -175,99 +269,183 @@ class VideoAnalyzerApp(QWidget):
                 "Error",
                 f"Failed to load video: {str(e)}"
             )
+            self._close_video_source()
             self.video_path = None
             self.video_label.setText("Select video for analysis")
             self.video_info_label.setText("No video selected")
 
+    def _close_video_source(self):
+        if self.video_source is not None:
+            self.video_source.close()
+            self.video_source = None
+
+    def _thumbnail_dir(self) -> str:
+        return os.path.join(artifact_dir(self.video_path, self.video_fingerprint), "thumbnails")
 
-    def _analyze_video(self) -> List[Tuple[float, float]]:
+    def _load_thumbnails(self):
         try:
-            model_swin = model_loader.load_model("Swin")
-            scenes = detect_scenes(self.video_path)
-            if not scenes:
-                return []
-
-            with ThreadPoolExecutor(max_workers=min(os.cpu_count() or 4, 4)) as executor:
-                futures = []
-                for scene in scenes:
-                    if not self.worker._is_running:
-                        break
-                    futures.append(
-                        executor.submit(
-                            detect_ad_scenes_from_segments_and_get_all_results,
-                            self.video_path,
-                            [scene],
-                            model_swin
-                        )
-                    )
-
-                preds = {}
-                for future in futures:
-                    if not self.worker._is_running:
-                        break
-                    preds.update(future.result())
-
-            if not preds:
-                return []
-
-            scores = [preds[(start, end)] for (start, end) in scenes]
-            base_thresh = 12.5
-            boost = 10
-
-            preds_final = []
-            for i, score in enumerate(scores):
-                if not self.worker._is_running:
-                    break
-
-                prev_ad = i > 0 and scores[i - 1] >= base_thresh
-                next_ad = i < len(scores) - 1 and scores[i + 1] >= base_thresh
-                is_isolated = not prev_ad and not next_ad
-
-                is_ad = self._is_advertisement(
-                    score,
-                    base_thresh=base_thresh,
-                    boost=boost,
-                    is_isolated=is_isolated
-                )
-
-                if is_ad:
-                    preds_final.append(scenes[i])
-
-            return preds_final
+            self.thumbnails = ThumbnailIndex.load(self._thumbnail_dir())
+        except Exception as e:
+            logger.warning(f"Failed to load thumbnails: {e}")
+            self.thumbnails = None
+        if self.vlc_player is not None:
+            self.vlc_player.set_thumbnails(self.thumbnails)
+
+    def _load_cached_analysis(self):
+        self.video_fingerprint = file_fingerprint(self.video_path)
+        self._load_thumbnails()
+        if self.catalog is None:
+            return
+        # Результат другой модели или с другими настройками не подходит — видео анализируется заново
+        entry = self.catalog.find(self.video_fingerprint, model=model_loader.model_identity("Swin"),
+                                  settings=self.settings)
+        if entry is None:
+            return
+
+        logger.info(f"Loaded analysis of {self.video_path} from catalog ({entry.analyzed_at})")
+        self.video_label.setText(f"Selected: {self.video_path} (analyzed {entry.analyzed_at})")
+        self.scenes = entry.scenes
+        self.scene_scores = entry.scores
+        if not entry.segments:
+            self._show_no_ads_message()
+            return
+        self.timecodes = entry.segments
+        self._update_results_display()
+        self._setup_video_player()
+
+    def _save_to_catalog(self, result: AnalysisResult):
+        if self.catalog is None:
+            return
+        try:
+            self.catalog.save(self.video_path, result, self.video_meta,
+                              model=model_loader.model_identity("Swin"), settings=self.settings,
+                              fingerprint=self.video_fingerprint)
+        except Exception as e:
+            logger.error(f"Failed to save analysis to catalog: {e}")
+
+    def _analyze_video(self) -> AnalysisResult:
+        worker = self.worker
+        try:
+            progress: Optional[AnalysisProgress] = None
+
+            def on_scenes(scenes, frame_counts):
+                nonlocal progress
+                progress = AnalysisProgress(worker, scenes_total=len(scenes), frames_total=sum(frame_counts))
+                worker.scenes_detected.emit(scenes)
+
+            def on_scene(index, score):
+                progress.scene_done()
+                worker.scene_result.emit(index, score)
+
+            thumbnails: Optional[ThumbnailSpriteWriter] = None
+            callbacks = dict(
+                should_stop=worker.should_stop,
+                on_scenes=on_scenes,
+                on_scene=on_scene,
+                on_frame=lambda count: progress.frame_done(count)
+            )
+            if service_url():
+                # Тонкий клиент: модель и батчинг живут в сервисе (service.py)
+                result = analyze_remote(self.video_path, self.settings, **callbacks)
+            else:
+                # Кадры всё равно декодируются для классификации — попутно собираем превью для таймлайна
+                thumbnails = ThumbnailSpriteWriter(self._thumbnail_dir())
+                # Остановленный или упавший анализ этого файла продолжится с готовых сцен
+                checkpoint = AnalysisCheckpoint.for_video(self.video_path, self.settings,
+                                                          model_loader.model_identity("Swin"),
+                                                          fingerprint=self.video_fingerprint)
+                try:
+                    result = analyze_video(self.video_source, model_loader.load_model("Swin"), self.settings,
+                                           on_decoded=thumbnails.add, checkpoint=checkpoint, **callbacks)
+                finally:
+                    thumbnails.finish()
+            logger.info(f"Analysis metrics: {json.dumps(result.metrics)}")
+            return result
 
         except Exception as e:
             logger.error(f"Analysis error: {e}")
             raise
 
-    def _is_advertisement(
-            self,
-            model_score: float,
-            base_thresh: float,
-            boost: float,
-            is_isolated: bool
-    ) -> bool:
-        adjusted_thresh = base_thresh if is_isolated else base_thresh - boost
-        return model_score >= adjusted_thresh
-
     def _start_analysis(self):
         if not self.video_path:
             self.video_label.setText("⚠️ Please select a video first!")
             return
 
         self._disable_controls()
+        self.scenes = []
+        self.scene_scores = []
+        self.progress_bar.setRange(0, 0)
+        self.progress_bar.setFormat("Detecting scenes...")
+        self.progress_bar.setVisible(True)
 
         self.worker = Worker(self._analyze_video)
         self.worker.result.connect(self._on_analysis_result)
         self.worker.error.connect(self._on_analysis_error)
         self.worker.finished.connect(self._on_analysis_finished)
+        self.worker.progress.connect(self._on_analysis_progress)
+        self.worker.scenes_detected.connect(self._on_scenes_detected)
+        self.worker.scene_result.connect(self._on_scene_result)
         self.worker.start()
 
-    def _on_analysis_result(self, result: List[Tuple[float, float]]):
-        if not result:
+    def _stop_analysis(self):
+        if self.worker is None:
+            return
+        self.worker.stop()
+        self.btn_stop.setEnabled(False)
+        self.progress_bar.setFormat("Stopping...")
+
+    def _on_analysis_progress(self, scenes_done: int, scenes_total: int,
+                              frames_done: int, frames_total: int, eta: float):
+        self.progress_bar.setRange(0, max(frames_total, 1))
+        self.progress_bar.setValue(min(frames_done, frames_total))
+        eta_str = format_time(eta) if eta >= 0 else "--:--"
+        self.progress_bar.setFormat(
+            f"Scenes {scenes_done}/{scenes_total} · Frames {frames_done}/{frames_total} · ETA {eta_str}"
+        )
+
+    def _on_scenes_detected(self, scenes: List[Tuple[float, float]]):
+        self.scenes = scenes
+        self.scene_scores = [None] * len(scenes)
+        self.timecodes = []
+        self._setup_video_player()
+
+    def _on_scene_result(self, index: int, score: float):
+        if index >= len(self.scene_scores):
+            return
+        self.scene_scores[index] = score
+        self._pending_scene_results += 1
+        METRICS.gauge("ui_pending_scene_results", self._pending_scene_results)
+        if not self._live_refresh_timer.isActive():
+            self._live_refresh_timer.start()
+
+    def _refresh_live_results(self):
+        self._pending_scene_results = 0
+        if not self.scenes:
+            return
+        with METRICS.timer("ui_refresh"):
+            timecodes = select_ad_scenes(self.scenes, self.scene_scores,
+                                         base_thresh=self.settings.base_thresh, boost=self.settings.boost)
+            if timecodes == self.timecodes:
+                return
+            self.timecodes = timecodes
+            self._update_results_display()
+            if self.vlc_player is not None:
+                self.vlc_player.set_ad_timestamps(self.timecodes)
+
+    def _on_analysis_result(self, result: AnalysisResult):
+        self._live_refresh_timer.stop()
+        if not result.completed:
+            # Остановленный анализ не сохраняем и не объявляем «рекламы нет»: на экране остаются
+            # сегменты по уже готовым сценам
+            self._refresh_live_results()
+            return
+        if result.scores:
+            self._save_to_catalog(result)
+        if not result.segments:
             self._show_no_ads_message()
             return
 
-        self.timecodes = result
+        self.timecodes = result.segments
         self._update_results_display()
         self._setup_video_player()
 
@@ -279,11 +457,9 @@ class VideoAnalyzerApp(QWidget):
             </div>
         """)
         self.video_info_label.setTextFormat(Qt.TextFormat.RichText)
+        self._update_export_buttons()
 
-        if self.vlc_player is not None:
-            self.splitter.widget(1).deleteLater()
-            self.splitter.insertWidget(1, QWidget())
-            self.vlc_player = None
+        self._hide_video_player()
 
     def _update_results_display(self):
         text_result = f"""
@@ -322,20 +498,100 @@ class VideoAnalyzerApp(QWidget):
         self.video_info_label.setWordWrap(True)
         self.video_info_label.setAlignment(Qt.AlignmentFlag.AlignTop)
         self.scroll_area.verticalScrollBar().setValue(0)
+        self._update_export_buttons()
 
-    def _setup_video_player(self):
-        if self.vlc_player is not None:
-            self.splitter.widget(1).deleteLater()
+    def _update_export_buttons(self):
+        visible = bool(self.timecodes)
+        enabled = visible and self.worker is None and self.export_worker is None
+        for button in (self.btn_export_clean, self.btn_export_ads, self.btn_export_cuts):
+            button.setVisible(visible)
+            button.setEnabled(enabled)
 
-        self.vlc_player = VLCPlayer(self.video_path, self.timecodes)
-        policy = QSizePolicy(QSizePolicy.Policy.Preferred, QSizePolicy.Policy.Expanding)
-        self.vlc_player.setSizePolicy(policy)
-        self.vlc_player.error_occurred.connect(self._on_player_error)
-        if self.splitter.count() > 1:
-            self.splitter.insertWidget(1, self.vlc_player)
+    def _export_video(self, mode: str):
+        if not self.video_path or not self.timecodes:
+            return
+        base, ext = os.path.splitext(self.video_path)
+        suffix = "no_ads" if mode == "ad_free" else "ads"
+        output_path, _ = QFileDialog.getSaveFileName(
+            self,
+            "Export Video",
+            f"{base}.{suffix}{ext}",
+            "Video Files (*.mp4 *.avi *.mkv)"
+        )
+        if not output_path:
+            return
+        self._start_export(output_path=output_path, mode=mode)
+
+    def _export_cut_list(self):
+        if not self.video_path or not self.timecodes:
+            return
+        base, _ = os.path.splitext(self.video_path)
+        path, _ = QFileDialog.getSaveFileName(
+            self,
+            "Export Cut List",
+            f"{base}.cuts.json",
+            "JSON cut list (*.json);;Edit decision list (*.edl)"
+        )
+        if not path:
+            return
+        if path.lower().endswith(".edl"):
+            self._start_export(edl_path=path)
         else:
+            self._start_export(cut_list_path=path)
+
+    def _start_export(self, **kwargs):
+        # Копирование потоков ffmpeg занимает секунды, но не в потоке интерфейса
+        self.export_worker = Worker(export_video, self.video_path, list(self.timecodes),
+                                    tolerance=EXPORT_TOLERANCE, **kwargs)
+        self.export_worker.result.connect(self._on_export_result)
+        self.export_worker.error.connect(self._on_export_error)
+        self.export_worker.finished.connect(self._on_export_finished)
+        self._update_export_buttons()
+        self.progress_bar.setRange(0, 0)
+        self.progress_bar.setFormat("Exporting...")
+        self.progress_bar.setVisible(True)
+        self.export_worker.start()
+
+    def _on_export_result(self, cuts):
+        duration = sum(cut.duration for cut in cuts)
+        QMessageBox.information(
+            self,
+            "Export",
+            f"Exported {len(cuts)} cuts, {format_time(duration)} total."
+        )
+
+    def _on_export_error(self, error_msg: str):
+        logger.error(f"Export error: {error_msg}")
+        QMessageBox.critical(
+            self,
+            "Export Error",
+            f"Failed to export: {error_msg}"
+        )
+
+    def _on_export_finished(self):
+        self.export_worker = None
+        if self.worker is None:
+            self.progress_bar.setVisible(False)
+        self._update_export_buttons()
+
+    def _setup_video_player(self):
+        # Плеер создаётся один раз, дальше в нём меняются видео и сегменты
+        if self.vlc_player is None:
+            self.vlc_player = VLCPlayer()
+            policy = QSizePolicy(QSizePolicy.Policy.Preferred, QSizePolicy.Policy.Expanding)
+            self.vlc_player.setSizePolicy(policy)
+            self.vlc_player.error_occurred.connect(self._on_player_error)
             self.splitter.addWidget(self.vlc_player)
 
+        self.vlc_player.set_media(self.video_path, self.timecodes)
+        self.vlc_player.set_thumbnails(self.thumbnails)
+        self.vlc_player.show()
+
+    def _hide_video_player(self):
+        if self.vlc_player is not None:
+            self.vlc_player.stop()
+            self.vlc_player.hide()
+
     def _on_player_error(self, error_msg: str):
         logger.error(f"Player error: {error_msg}")
         QMessageBox.warning(
@@ -353,24 +609,38 @@ class VideoAnalyzerApp(QWidget):
         )
 
     def _on_analysis_finished(self):
-        self._enable_controls()
+        # Превью пишутся и при остановке анализа — подхватываем то, что успели собрать
+        self._load_thumbnails()
         self.worker = None
+        self._enable_controls()
+        self.progress_bar.setVisible(False)
 
     def _disable_controls(self):
         self.btn_select.setEnabled(False)
         self.btn_analyse.setEnabled(False)
         self.btn_analyse.setStyleSheet(get_button_style('disabled'))
+        self.btn_stop.setEnabled(True)
+        self.btn_stop.setVisible(True)
+        for button in (self.btn_export_clean, self.btn_export_ads, self.btn_export_cuts):
+            button.setEnabled(False)
 
     def _enable_controls(self):
         self.btn_select.setEnabled(True)
         self.btn_analyse.setEnabled(True)
         self.btn_analyse.setStyleSheet(get_button_style('normal'))
+        self.btn_stop.setVisible(False)
+        self._update_export_buttons()
 
     def closeEvent(self, event):
         if self.worker is not None:
             self.worker.stop()
             self.worker.wait()
+        if self.export_worker is not None:
+            self.export_worker.wait()
 
         if self.vlc_player is not None:
-            self.vlc_player.close()
+            self.vlc_player.release()
+        if self.catalog is not None:
+            self.catalog.close()
+        self._close_video_source()
         event.accept()
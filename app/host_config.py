@@ -0,0 +1,78 @@
+"""Лучшая конфигурация инференса для этой машины, найденная autotune.py.
+
+Хранится в ~/.ad_detector/hosts/<имя хоста>.json (или в файле из AD_DETECTOR_HOST_CONFIG) и
+читается один раз при старте: model_loader применяет потоки torch, channels_last и bf16,
+AnalysisSettings берёт оттуда число воркеров и размер батча по умолчанию.
+"""
+import json
+import logging
+import os
+import socket
+import threading
+from dataclasses import asdict, dataclass, field, fields
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+HOST_CONFIG_ENV = "AD_DETECTOR_HOST_CONFIG"
+DEFAULT_HOST_CONFIG_DIR = os.path.join(os.path.expanduser("~"), ".ad_detector", "hosts")
+
+
+@dataclass
+class HostConfig:
+    torch_threads: Optional[int] = None
+    workers: Optional[int] = None
+    batch_size: Optional[int] = None
+    channels_last: bool = False
+    bf16: bool = False
+    # Как получена конфигурация: модель, пропускная способность, отклонение выходов и т.п.
+    meta: dict = field(default_factory=dict)
+
+
+def host_config_path() -> str:
+    return os.environ.get(HOST_CONFIG_ENV) or os.path.join(DEFAULT_HOST_CONFIG_DIR, f"{socket.gethostname()}.json")
+
+
+def read_host_config(path=None) -> HostConfig:
+    path = path or host_config_path()
+    if not os.path.exists(path):
+        return HostConfig()
+    try:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError) as e:
+        logger.warning(f"Ignoring unreadable host config {path}: {e}")
+        return HostConfig()
+
+    cpu_count = data.get("meta", {}).get("cpu_count")
+    if cpu_count is not None and cpu_count != os.cpu_count():
+        # Файл мог приехать с машины другого типа (общий домашний каталог, образ)
+        logger.warning(f"Host config {path} was tuned for {cpu_count} CPUs, this host has {os.cpu_count()}; "
+                       f"ignoring it, run autotune.py again")
+        return HostConfig()
+    known = {f.name for f in fields(HostConfig)}
+    return HostConfig(**{key: value for key, value in data.items() if key in known})
+
+
+def save_host_config(config: HostConfig, path=None) -> str:
+    path = path or host_config_path()
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(asdict(config), f, indent=2)
+    os.replace(tmp_path, path)
+    return path
+
+
+_host_config: Optional[HostConfig] = None
+_host_config_lock = threading.Lock()
+
+
+def host_config() -> HostConfig:
+    global _host_config
+    with _host_config_lock:
+        if _host_config is None:
+            _host_config = read_host_config()
+            if _host_config != HostConfig():
+                logger.info(f"Using tuned host config from {host_config_path()}")
+        return _host_config
@@ -0,0 +1,68 @@
+from typing import Iterable, List, Sequence, Tuple
+
+
+def merge_intervals(intervals: Iterable[Tuple[float, float]], gap: float = 0.0) -> List[Tuple[float, float]]:
+    """Объединение интервалов: пересекающиеся и разделённые промежутком не больше gap склеиваются."""
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1] + gap:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return [(start, end) for start, end in merged]
+
+
+class IntervalIndex:
+    """Статическое дерево интервалов поверх отсортированного по началу массива.
+
+    Узел поддерева [lo, hi) — его середина, для каждого узла хранится максимальный конец
+    интервала в поддереве. Запросы по точке и по диапазону — O(log n + k).
+    """
+
+    def __init__(self, intervals: Sequence[Tuple[float, float]]):
+        order = sorted(range(len(intervals)), key=lambda i: (intervals[i][0], intervals[i][1]))
+        self.order = order
+        self.starts = [float(intervals[i][0]) for i in order]
+        self.ends = [float(intervals[i][1]) for i in order]
+        self._max_end = [0.0] * len(order)
+        if order:
+            self._build(0, len(order))
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __getitem__(self, position) -> Tuple[float, float]:
+        return self.starts[position], self.ends[position]
+
+    def _build(self, lo, hi):
+        mid = (lo + hi) // 2
+        max_end = self.ends[mid]
+        if lo < mid:
+            max_end = max(max_end, self._build(lo, mid))
+        if mid + 1 < hi:
+            max_end = max(max_end, self._build(mid + 1, hi))
+        self._max_end[mid] = max_end
+        return max_end
+
+    def overlapping(self, start: float, end: float) -> List[int]:
+        """Позиции (в порядке начала) интервалов, пересекающихся с [start, end]."""
+        result = []
+        self._query(0, len(self.starts), start, end, result)
+        return result
+
+    def at(self, point: float) -> List[int]:
+        return self.overlapping(point, point)
+
+    def _query(self, lo, hi, start, end, result):
+        if lo >= hi:
+            return
+        mid = (lo + hi) // 2
+        if self._max_end[mid] < start:
+            return
+        self._query(lo, mid, start, end, result)
+        if self.starts[mid] > end:
+            # Правее начала только больше — там пересечений нет
+            return
+        if self.ends[mid] >= start:
+            result.append(mid)
+        self._query(mid + 1, hi, start, end, result)
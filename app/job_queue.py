@@ -0,0 +1,540 @@
+"""Надёжная очередь анализа для ночной обработки архива.
+
+Задачи лежат в SQLite (pending → leased → done | failed) и переживают перезапуск. N процессов
+воркеров один раз грузят модель и по очереди берут задачи в аренду на lease секунд; пока
+анализ идёт, аренда продлевается. Если воркер упал, его задачи возвращаются в очередь
+(сразу — силами супервизора, иначе по истечении аренды) и повторяются до max_attempts раз;
+прерванный анализ продолжается с контрольной точки (checkpoint.py). Результаты пишутся
+в каталог (catalog.py), время каждой задачи — в очередь.
+
+    python job_queue.py add /archive/2026-10-17 --settings '{"prefilter": true}'
+    python job_queue.py add /archive/ch1/rec.ts --channel "Первый канал" --recorded-at 2026-10-17T20:00
+    python job_queue.py run --workers 4 --exit-when-empty
+    python job_queue.py status
+    python job_queue.py report --output jobs.csv
+"""
+import argparse
+import csv
+import json
+import logging
+import multiprocessing
+import os
+import socket
+import sqlite3
+import threading
+import time
+from dataclasses import asdict, dataclass
+from typing import List, Optional
+
+logger = logging.getLogger(__name__)
+
+QUEUE_PATH_ENV = "AD_DETECTOR_QUEUE"
+DEFAULT_QUEUE_PATH = os.path.join(os.path.expanduser("~"), ".ad_detector", "jobs.sqlite3")
+VIDEO_EXTENSIONS = (".mp4", ".avi", ".mkv", ".ts", ".mov")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL,
+    settings TEXT,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    worker TEXT,
+    lease_until REAL,
+    enqueued_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    seconds REAL,
+    video_seconds REAL,
+    frames INTEGER,
+    error TEXT,
+    channel TEXT,
+    recorded_at TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, id);
+CREATE INDEX IF NOT EXISTS idx_jobs_path ON jobs(path);
+"""
+
+JOB_COLUMNS = ("id", "path", "settings", "status", "attempts", "max_attempts", "worker", "lease_until",
+               "enqueued_at", "started_at", "finished_at", "seconds", "video_seconds", "frames", "error",
+               "channel", "recorded_at")
+
+
+@dataclass
+class Job:
+    id: int
+    path: str
+    settings: Optional[str]
+    status: str
+    attempts: int
+    max_attempts: int
+    worker: Optional[str]
+    lease_until: Optional[float]
+    enqueued_at: float
+    started_at: Optional[float]
+    finished_at: Optional[float]
+    seconds: Optional[float]
+    video_seconds: Optional[float]
+    frames: Optional[int]
+    error: Optional[str]
+    # Для отчёта каталога по каналам и дням; None — канал по каталогу, время по имени файла
+    channel: Optional[str] = None
+    recorded_at: Optional[str] = None
+
+
+class JobQueue:
+    def __init__(self, path=None):
+        self.path = path or os.environ.get(QUEUE_PATH_ENV) or DEFAULT_QUEUE_PATH
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        # Транзакции открываем сами (BEGIN IMMEDIATE), чтобы выдача задачи была атомарной
+        self.conn = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+        self._migrate()
+
+    def _migrate(self):
+        # Воркеры открывают очередь одновременно: столбцы проверяются под блокировкой
+        with self._transaction():
+            columns = {row[1] for row in self.conn.execute("PRAGMA table_info(jobs)")}
+            for column in ("channel", "recorded_at"):
+                if column not in columns:
+                    self.conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} TEXT")
+
+    def close(self):
+        self.conn.close()
+
+    def _transaction(self):
+        return _Transaction(self.conn)
+
+    def enqueue(self, paths, settings=None, max_attempts=3, force=False, channel=None, recorded_at=None) -> int:
+        """Добавляет видео; уже стоящие в очереди или готовые пропускаются, если не force.
+
+        channel и recorded_at (начало записи, ISO) попадают в каталог вместе с результатом."""
+        settings_json = json.dumps(settings) if settings else None
+        added = 0
+        now = time.time()
+        with self._transaction():
+            for path in paths:
+                path = os.path.abspath(path)
+                if not force and self.conn.execute(
+                        "SELECT 1 FROM jobs WHERE path = ? AND status != 'failed'", (path,)).fetchone():
+                    continue
+                self.conn.execute(
+                    "INSERT INTO jobs (path, settings, status, max_attempts, enqueued_at, channel, recorded_at) "
+                    "VALUES (?, ?, 'pending', ?, ?, ?, ?)",
+                    (path, settings_json, max_attempts, now, channel, recorded_at)
+                )
+                added += 1
+        return added
+
+    def _expire_leases(self, now):
+        self.conn.execute(
+            "UPDATE jobs SET status = CASE WHEN attempts >= max_attempts THEN 'failed' ELSE 'pending' END, "
+            "error = 'lease expired', worker = NULL, lease_until = NULL "
+            "WHERE status = 'leased' AND lease_until < ?", (now,)
+        )
+
+    def lease(self, worker, lease_seconds=600.0) -> Optional[Job]:
+        now = time.time()
+        with self._transaction():
+            self._expire_leases(now)
+            row = self.conn.execute("SELECT id FROM jobs WHERE status = 'pending' ORDER BY id LIMIT 1").fetchone()
+            if row is None:
+                return None
+            self.conn.execute(
+                "UPDATE jobs SET status = 'leased', attempts = attempts + 1, worker = ?, lease_until = ?, "
+                "started_at = ?, error = NULL WHERE id = ?",
+                (worker, now + lease_seconds, now, row[0])
+            )
+            return self.get(row[0])
+
+    def heartbeat(self, job_id, worker, lease_seconds=600.0) -> bool:
+        """Продлевает аренду; False — задачу уже отобрали (аренда истекла)."""
+        with self._transaction():
+            cursor = self.conn.execute(
+                "UPDATE jobs SET lease_until = ? WHERE id = ? AND worker = ? AND status = 'leased'",
+                (time.time() + lease_seconds, job_id, worker)
+            )
+        return cursor.rowcount == 1
+
+    def complete(self, job_id, worker, seconds, video_seconds=None, frames=None):
+        with self._transaction():
+            self.conn.execute(
+                "UPDATE jobs SET status = 'done', finished_at = ?, seconds = ?, video_seconds = ?, frames = ?, "
+                "lease_until = NULL WHERE id = ? AND worker = ?",
+                (time.time(), seconds, video_seconds, frames, job_id, worker)
+            )
+
+    def fail(self, job_id, worker, error):
+        with self._transaction():
+            self.conn.execute(
+                "UPDATE jobs SET status = CASE WHEN attempts >= max_attempts THEN 'failed' ELSE 'pending' END, "
+                "error = ?, finished_at = ?, worker = NULL, lease_until = NULL WHERE id = ? AND worker = ?",
+                (error, time.time(), job_id, worker)
+            )
+
+    def release(self, job_id, worker):
+        """Возвращает задачу в очередь без траты попытки (воркер остановлен)."""
+        with self._transaction():
+            self.conn.execute(
+                "UPDATE jobs SET status = 'pending', attempts = attempts - 1, worker = NULL, lease_until = NULL "
+                "WHERE id = ? AND worker = ? AND status = 'leased'", (job_id, worker)
+            )
+
+    def release_worker(self, worker) -> int:
+        """Все задачи остановленного воркера — в очередь без траты попытки."""
+        with self._transaction():
+            cursor = self.conn.execute(
+                "UPDATE jobs SET status = 'pending', attempts = MAX(attempts - 1, 0), worker = NULL, "
+                "lease_until = NULL WHERE worker = ? AND status = 'leased'", (worker,)
+            )
+        return cursor.rowcount
+
+    def abandon_worker(self, worker, error="worker crashed") -> int:
+        """Задачи упавшего воркера — сразу в очередь, не дожидаясь конца аренды."""
+        with self._transaction():
+            cursor = self.conn.execute(
+                "UPDATE jobs SET status = CASE WHEN attempts >= max_attempts THEN 'failed' ELSE 'pending' END, "
+                "error = ?, worker = NULL, lease_until = NULL WHERE worker = ? AND status = 'leased'",
+                (error, worker)
+            )
+        return cursor.rowcount
+
+    def retry_failed(self) -> int:
+        with self._transaction():
+            cursor = self.conn.execute(
+                "UPDATE jobs SET status = 'pending', attempts = 0, error = NULL WHERE status = 'failed'")
+        return cursor.rowcount
+
+    def get(self, job_id) -> Optional[Job]:
+        row = self.conn.execute(f"SELECT {', '.join(JOB_COLUMNS)} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return Job(*row) if row else None
+
+    def jobs(self, status=None) -> List[Job]:
+        rows = self.conn.execute(
+            f"SELECT {', '.join(JOB_COLUMNS)} FROM jobs WHERE (:status IS NULL OR status = :status) ORDER BY id",
+            {"status": status}
+        ).fetchall()
+        return [Job(*row) for row in rows]
+
+    def counts(self) -> dict:
+        return dict(self.conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+
+    def throughput(self) -> dict:
+        """Сводка по выполненным задачам: сколько видео обработано за какое время."""
+        row = self.conn.execute(
+            "SELECT COUNT(*), SUM(seconds), SUM(video_seconds), SUM(frames), MIN(started_at), MAX(finished_at) "
+            "FROM jobs WHERE status = 'done'"
+        ).fetchone()
+        jobs, busy, video, frames, first, last = row
+        durations = sorted(seconds for (seconds,) in self.conn.execute(
+            "SELECT seconds FROM jobs WHERE status = 'done' AND seconds IS NOT NULL"))
+        wall = (last - first) if jobs and first is not None and last is not None else 0.0
+        return {
+            "jobs": jobs,
+            "wall_seconds": wall,
+            "busy_seconds": busy or 0.0,
+            "video_seconds": video or 0.0,
+            "frames": frames or 0,
+            "realtime_factor": (video or 0.0) / wall if wall > 0 else None,
+            "frames_per_sec": (frames or 0) / wall if wall > 0 else None,
+            "jobs_per_hour": jobs * 3600 / wall if wall > 0 else None,
+            "median_job_seconds": _percentile(durations, 0.5),
+            "p95_job_seconds": _percentile(durations, 0.95),
+        }
+
+
+class _Transaction:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+
+
+def _percentile(values, q):
+    if not values:
+        return None
+    return values[min(int(q * len(values)), len(values) - 1)]
+
+
+def worker_name(pid=None) -> str:
+    return f"{socket.gethostname()}:{pid or os.getpid()}"
+
+
+class _LeaseKeeper:
+    """Поток, продлевающий аренду задачи, пока её анализирует воркер."""
+
+    def __init__(self, queue_path, job_id, worker, lease_seconds):
+        self.lost = False
+        self._stop = threading.Event()
+        self._args = (queue_path, job_id, worker, lease_seconds)
+        self._thread = threading.Thread(target=self._run, name="lease-keeper", daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        queue_path, job_id, worker, lease_seconds = self._args
+        queue = JobQueue(queue_path)
+        try:
+            while not self._stop.wait(lease_seconds / 3):
+                if not queue.heartbeat(job_id, worker, lease_seconds):
+                    logger.warning(f"Lease of job {job_id} was lost")
+                    self.lost = True
+                    return
+        finally:
+            queue.close()
+
+
+def _finish_job(queue: JobQueue, catalog, job: Job, worker, result, metadata, started, **save_options):
+    catalog.save(job.path, result, metadata, channel=job.channel, recorded_at=job.recorded_at, **save_options)
+    elapsed = time.perf_counter() - started
+    frames = result.metrics.get("counters", {}).get("frames_classified", 0)
+    queue.complete(job.id, worker, elapsed, metadata["duration"], frames)
+    logger.info(f"Job {job.id} done in {elapsed:.1f} s: {len(result.segments)} ad segments, "
+                f"x{metadata['duration'] / elapsed if elapsed > 0 else 0:.1f} realtime")
+
+
+def run_worker(queue_path, model_name, lease_seconds, torch_threads, exit_when_empty, poll_seconds, stop_event):
+    """Процесс-воркер: модель грузится один раз, дальше задачи берутся из очереди до остановки."""
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(processName)s - %(levelname)s - %(message)s")
+    # torch и модель нужны только воркерам: add, status и report работают и без них
+    import torch
+
+    import model_loader
+    from analysis import AnalysisSettings, analyze_video
+    from catalog import Catalog, file_fingerprint
+    from checkpoint import AnalysisCheckpoint
+    from video_source import VideoSource
+
+    model = model_loader.load_model(model_name)
+    if model is None:
+        raise RuntimeError(f"Failed to load model {model_name}")
+    if torch_threads:
+        # Потоки torch делятся между воркерами, иначе они дерутся за ядра
+        torch.set_num_threads(torch_threads)
+    model_id = model_loader.model_identity(model_name)
+
+    name = worker_name()
+    queue = JobQueue(queue_path)
+    catalog = Catalog()
+    try:
+        while not stop_event.is_set():
+            job = queue.lease(name, lease_seconds)
+            if job is None:
+                if exit_when_empty:
+                    break
+                stop_event.wait(poll_seconds)
+                continue
+
+            logger.info(f"Job {job.id}: {job.path} (attempt {job.attempts}/{job.max_attempts})")
+            started = time.perf_counter()
+            result = metadata = None
+            try:
+                settings = AnalysisSettings(**json.loads(job.settings or "{}"))
+                fingerprint = file_fingerprint(job.path)
+                checkpoint = AnalysisCheckpoint.for_video(job.path, settings, model_id, fingerprint)
+                with _LeaseKeeper(queue_path, job.id, name, lease_seconds) as keeper, \
+                        VideoSource(job.path, max_handles=settings.max_workers()) as source:
+                    result = analyze_video(source, model, settings,
+                                           should_stop=lambda: stop_event.is_set() or keeper.lost,
+                                           checkpoint=checkpoint)
+                    metadata = source.metadata.as_dict()
+                if keeper.lost:
+                    continue
+                if not result.completed:
+                    # Остановлен посреди видео: следующий воркер продолжит с контрольной точки
+                    queue.release(job.id, name)
+                    break
+                _finish_job(queue, catalog, job, name, result, metadata, started,
+                            model=model_id, settings=settings, fingerprint=fingerprint)
+            except KeyboardInterrupt:
+                # Ctrl-C получает вся группа процессов, а не только супервизор: готовый результат
+                # сохраняется, прерванный анализ возвращается в очередь без траты попытки
+                if result is not None and result.completed and metadata is not None:
+                    _finish_job(queue, catalog, job, name, result, metadata, started,
+                                model=model_id, settings=settings, fingerprint=fingerprint)
+                else:
+                    queue.release(job.id, name)
+                break
+            except Exception as e:
+                logger.exception(f"Job {job.id} failed")
+                queue.fail(job.id, name, f"{type(e).__name__}: {e}")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        catalog.close()
+        queue.close()
+
+
+def run_pool(queue_path, workers, model_name="Swin", lease_seconds=600.0, exit_when_empty=False,
+             poll_seconds=5.0, max_restarts=10):
+    """Супервизор: держит workers процессов, перезапускает упавшие и сразу возвращает их задачи."""
+    queue = JobQueue(queue_path)
+    ctx = multiprocessing.get_context("spawn")
+    stop_event = ctx.Event()
+    torch_threads = max((os.cpu_count() or 1) // workers, 1)
+    args = (queue.path, model_name, lease_seconds, torch_threads, exit_when_empty, poll_seconds, stop_event)
+
+    def start():
+        proc = ctx.Process(target=run_worker, args=args, name=f"worker-{len(procs) + restarts + 1}")
+        proc.start()
+        return proc
+
+    procs = []
+    restarts = 0
+    started = time.time()
+    try:
+        for _ in range(workers):
+            procs.append(start())
+        while procs:
+            time.sleep(1.0)
+            for i, proc in enumerate(procs):
+                if proc.is_alive():
+                    continue
+                proc.join()
+                if proc.exitcode != 0:
+                    returned = queue.abandon_worker(worker_name(proc.pid), f"worker exited with code {proc.exitcode}")
+                    logger.warning(f"{proc.name} exited with code {proc.exitcode}, {returned} job(s) requeued")
+                    if not stop_event.is_set() and restarts < max_restarts:
+                        restarts += 1
+                        procs[i] = start()
+                        continue
+                procs[i] = None
+            procs = [proc for proc in procs if proc is not None]
+    except KeyboardInterrupt:
+        logger.info("Stopping workers, running jobs go back to the queue")
+        stop_event.set()
+        for proc in procs:
+            proc.join()
+            # Воркер мог не успеть вернуть задачу сам (прерван до release или убит)
+            returned = queue.release_worker(worker_name(proc.pid))
+            if returned:
+                logger.info(f"{proc.name}: {returned} job(s) returned to the queue")
+    finally:
+        report = queue.throughput()
+        queue.close()
+    logger.info(f"Pool finished in {time.time() - started:.0f} s")
+    return report
+
+
+def _video_files(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, names in os.walk(path):
+                for name in sorted(names):
+                    if name.lower().endswith(VIDEO_EXTENSIONS):
+                        yield os.path.join(root, name)
+        else:
+            yield path
+
+
+def print_status(queue: JobQueue):
+    counts = queue.counts()
+    print("  ".join(f"{status} {counts.get(status, 0)}" for status in ("pending", "leased", "done", "failed")))
+    stats = queue.throughput()
+    if stats["jobs"]:
+        print(f"done: {stats['jobs']} jobs, {stats['video_seconds'] / 3600:.1f} h of video "
+              f"in {stats['wall_seconds'] / 3600:.2f} h wall (x{stats['realtime_factor'] or 0:.1f} realtime), "
+              f"{stats['frames_per_sec'] or 0:.1f} frames/s, {stats['jobs_per_hour'] or 0:.1f} jobs/h")
+        print(f"per job: median {stats['median_job_seconds']:.1f} s, p95 {stats['p95_job_seconds']:.1f} s")
+    for job in queue.jobs("failed"):
+        print(f"failed #{job.id} {job.path}: {job.error}")
+
+
+def write_report(queue: JobQueue, path):
+    rows = []
+    for job in queue.jobs():
+        row = asdict(job)
+        row["realtime_factor"] = job.video_seconds / job.seconds if job.seconds and job.video_seconds else None
+        rows.append(row)
+    if path.endswith(".json"):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"throughput": queue.throughput(), "jobs": rows}, f, indent=2)
+        return
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=list(JOB_COLUMNS) + ["realtime_factor"])
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def main(argv=None):
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(processName)s - %(levelname)s - %(message)s")
+    parser = argparse.ArgumentParser(description="Durable analysis queue for batch processing")
+    parser.add_argument("--queue", default=None, help=f"defaults to ${QUEUE_PATH_ENV} or {DEFAULT_QUEUE_PATH}")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    add = sub.add_parser("add", help="enqueue video files or directories")
+    add.add_argument("paths", nargs="+")
+    add.add_argument("--settings", default=None, help="JSON object of AnalysisSettings fields")
+    add.add_argument("--max-attempts", type=int, default=3)
+    add.add_argument("--force", action="store_true", help="enqueue again even if already queued or done")
+    add.add_argument("--channel", help="channel for the catalog report (defaults to the parent directory name)")
+    add.add_argument("--recorded-at", help="recording start, YYYY-MM-DDTHH:MM[:SS]; only with a single video "
+                                           "(defaults to the file name or its creation_time tag)")
+
+    run = sub.add_parser("run", help="process the queue with worker processes")
+    run.add_argument("--workers", type=int, default=2)
+    run.add_argument("--model", default="Swin")
+    run.add_argument("--lease", type=float, default=600.0, help="lease timeout, seconds")
+    run.add_argument("--poll", type=float, default=5.0, help="idle polling interval, seconds")
+    run.add_argument("--exit-when-empty", action="store_true")
+
+    sub.add_parser("status", help="job counts and throughput")
+    sub.add_parser("retry", help="move failed jobs back to pending")
+    report = sub.add_parser("report", help="per-job timings as CSV or JSON")
+    report.add_argument("--output", default="jobs.csv")
+    args = parser.parse_args(argv)
+
+    if args.command == "run":
+        stats = run_pool(args.queue, args.workers, args.model, args.lease, args.exit_when_empty, args.poll)
+        print(json.dumps(stats, indent=2))
+        return
+
+    recorded_at = None
+    if args.command == "add" and args.recorded_at:
+        from catalog import parse_recorded_at
+
+        try:
+            recorded_at = parse_recorded_at(args.recorded_at)
+        except ValueError:
+            parser.error(f"invalid --recorded-at: {args.recorded_at}")
+
+    queue = JobQueue(args.queue)
+    try:
+        if args.command == "add":
+            settings = json.loads(args.settings) if args.settings else None
+            if settings:
+                from analysis import AnalysisSettings
+
+                # Ошибка в настройках видна сразу, а не в каждой задаче ночью
+                AnalysisSettings(**settings)
+            paths = list(_video_files(args.paths))
+            if recorded_at and len(paths) > 1:
+                parser.error("--recorded-at applies to a single video")
+            added = queue.enqueue(paths, settings, args.max_attempts, args.force, args.channel, recorded_at)
+            print(f"Enqueued {added} video(s)")
+        elif args.command == "status":
+            print_status(queue)
+        elif args.command == "retry":
+            print(f"Requeued {queue.retry_failed()} failed job(s)")
+        elif args.command == "report":
+            write_report(queue, args.output)
+            print(f"Report written to {args.output}")
+    finally:
+        queue.close()
+
+
+if __name__ == "__main__":
+    main()
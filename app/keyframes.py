@@ -0,0 +1,151 @@
+"""Индекс ключевых кадров видео по пакетам контейнера (ffprobe, без декодирования).
+
+Ключевые кадры — единственные точки, с которых декодер начинает GOP без предыдущих кадров:
+на них приходятся границы фрагментов при копировании потоков (export.py), и к ним
+video_source.CaptureHandle делает seek, а до нужного кадра доходит grab(). Индекс
+(время и смещение пакета в файле) строится один раз и лежит в каталоге артефактов видео.
+"""
+import json
+import logging
+import os
+import shutil
+import subprocess
+import tempfile
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+
+from artifacts import artifact_dir
+from metrics import METRICS
+
+logger = logging.getLogger(__name__)
+
+KEYFRAME_FILE = "keyframes.npz"
+
+
+@dataclass
+class Keyframes:
+    # Время ключевых кадров в секундах от начала видеодорожки (по возрастанию, как время
+    # анализа и cv2) и смещение пакета в файле (-1 — неизвестно)
+    pts: np.ndarray
+    pos: np.ndarray
+    # start_time дорожки: прибавляется ко времени для инструментов, работающих с метками файла (ffmpeg)
+    start_time: float = 0.0
+
+    def __len__(self):
+        return len(self.pts)
+
+    def frame_numbers(self, fps) -> np.ndarray:
+        return np.floor(self.pts * fps + 0.5).astype(np.int64)
+
+    def save(self, path):
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".npz")
+        with os.fdopen(fd, "wb") as f:
+            np.savez(f, pts=self.pts, pos=self.pos, start_time=np.float64(self.start_time))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path) -> "Keyframes":
+        with np.load(path) as data:
+            return cls(pts=data["pts"], pos=data["pos"], start_time=float(data["start_time"]))
+
+    def nearest(self, seconds: float) -> Optional[float]:
+        if not len(self.pts):
+            return None
+        i = int(np.searchsorted(self.pts, seconds))
+        candidates = self.pts[max(i - 1, 0):i + 1]
+        return float(candidates[np.argmin(np.abs(candidates - seconds))])
+
+    def at_or_after(self, seconds: float) -> Optional[float]:
+        i = int(np.searchsorted(self.pts, seconds, side="left"))
+        return float(self.pts[i]) if i < len(self.pts) else None
+
+    def at_or_before(self, seconds: float) -> Optional[float]:
+        i = int(np.searchsorted(self.pts, seconds, side="right"))
+        return float(self.pts[i - 1]) if i > 0 else None
+
+
+def _ffprobe():
+    ffprobe = shutil.which("ffprobe")
+    if ffprobe is None:
+        raise RuntimeError("ffprobe not found, install ffmpeg")
+    return ffprobe
+
+
+def _number(value):
+    return None if value in (None, "", "N/A") else float(value)
+
+
+def parse_packets(output: str) -> Keyframes:
+    """Разбор `ffprobe -show_entries packet=pts_time,dts_time,pos,flags:stream=start_time -of compact`."""
+    pts = []
+    pos = []
+    start_time = None
+    for line in output.splitlines():
+        items = line.strip().split("|")
+        fields = dict(item.split("=", 1) for item in items if "=" in item)
+        if items[0] == "stream":
+            start_time = _number(fields.get("start_time"))
+            continue
+        if "K" not in fields.get("flags", ""):
+            continue
+        time = _number(fields.get("pts_time"))
+        if time is None:
+            time = _number(fields.get("dts_time"))
+        if time is None:
+            continue
+        offset = fields.get("pos", "N/A")
+        pts.append(time)
+        pos.append(int(offset) if offset.isdigit() else -1)
+    if start_time is None:
+        start_time = min(pts, default=0.0)
+    # Пакеты идут в порядке декодирования, у ключевых кадров он обычно совпадает с порядком показа
+    times = np.array(pts, dtype=np.float64) - start_time
+    order = np.argsort(times, kind="stable")
+    return Keyframes(pts=times[order], pos=np.array(pos, dtype=np.int64)[order], start_time=start_time)
+
+
+def scan_keyframes(video_path) -> Keyframes:
+    command = [_ffprobe(), "-v", "error", "-select_streams", "v:0",
+               "-show_entries", "packet=pts_time,dts_time,pos,flags:stream=start_time", "-of", "compact",
+               video_path]
+    with METRICS.timer("keyframe_scan"):
+        process = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if process.returncode != 0:
+        raise RuntimeError(f"ffprobe failed: {process.stderr.decode(errors='replace').strip()}")
+    keyframes = parse_packets(process.stdout.decode(errors="replace"))
+    logger.info(f"{len(keyframes)} keyframes in {video_path}")
+    return keyframes
+
+
+def probe_video(video_path) -> dict:
+    """{"duration": секунды, "fps": кадров в секунду} первой видеодорожки."""
+    command = [_ffprobe(), "-v", "error", "-select_streams", "v:0",
+               "-show_entries", "stream=r_frame_rate:format=duration", "-of", "json", video_path]
+    process = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if process.returncode != 0:
+        raise RuntimeError(f"ffprobe failed: {process.stderr.decode(errors='replace').strip()}")
+    data = json.loads(process.stdout or b"{}")
+    fps = 0.0
+    streams = data.get("streams") or [{}]
+    rate = streams[0].get("r_frame_rate", "0/1")
+    numerator, _, denominator = rate.partition("/")
+    if float(denominator or 1):
+        fps = float(numerator) / float(denominator or 1)
+    return {"duration": float(data.get("format", {}).get("duration", 0.0) or 0.0), "fps": fps}
+
+
+def keyframe_index(video_path, fingerprint=None) -> Keyframes:
+    """Индекс из каталога артефактов; при первом обращении — сканирование и сохранение."""
+    path = os.path.join(artifact_dir(video_path, fingerprint), KEYFRAME_FILE)
+    if os.path.exists(path):
+        try:
+            return Keyframes.load(path)
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Rebuilding unreadable keyframe index {path}: {e}")
+    keyframes = scan_keyframes(video_path)
+    keyframes.save(path)
+    return keyframes
@@ -4,9 +4,11 @@ from PyQt6.QtWidgets import QApplication
 
 from gui import VideoAnalyzerApp
 from model_loader import preload_all_models
+from service_client import service_url
 
 if __name__ == "__main__":
-    preload_all_models()
+    if not service_url():
+        preload_all_models()
     app = QApplication(sys.argv)
     window = VideoAnalyzerApp()
     window.show()
@@ -0,0 +1,227 @@
+"""Лёгкие счётчики и таймеры этапов пайплайна.
+
+Глобальный реестр METRICS накапливает значения за всё время жизни процесса; сводка по
+одному прогону считается как разница двух снимков (см. summarize). Максимумы разностью
+не считаются, поэтому для прогона открывается окно: snapshot(window=True) в начале и
+snapshot(since=начальный снимок) в конце дают максимумы только за этот прогон. Если задана переменная
+окружения AD_DETECTOR_METRICS_FILE, сводка каждого прогона сохраняется туда: файл *.prom
+перезаписывается в текстовом формате Prometheus, в остальные дописывается строка JSON.
+"""
+import json
+import os
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+METRICS_FILE_ENV = "AD_DETECTOR_METRICS_FILE"
+# Окна прогонов, упавших до закрывающего снимка, вытесняются, чтобы не копиться
+MAX_OPEN_WINDOWS = 64
+
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._timings = {}
+        self._counters = {}
+        self._gauges = {}
+        # id окна -> {"timings": {этап: максимум}, "gauges": {имя: максимум}}
+        self._windows = OrderedDict()
+        self._next_window = 0
+
+    @contextmanager
+    def timer(self, stage):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - started)
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            timing = self._timings.get(stage)
+            if timing is None:
+                self._timings[stage] = [1, seconds, seconds]
+            else:
+                timing[0] += 1
+                timing[1] += seconds
+                if seconds > timing[2]:
+                    timing[2] = seconds
+            for window in self._windows.values():
+                _raise_max(window["timings"], stage, seconds)
+
+    def count(self, name, value=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def gauge(self, name, value):
+        with self._lock:
+            gauge = self._gauges.get(name)
+            if gauge is None:
+                self._gauges[name] = [value, value]
+            else:
+                gauge[0] = value
+                if value > gauge[1]:
+                    gauge[1] = value
+            for window in self._windows.values():
+                _raise_max(window["gauges"], name, value)
+
+    def snapshot(self, window=False, since=None):
+        """window=True открывает окно максимумов с этого снимка; since — снимок, открывший
+        окно: оно закрывается, а максимумы за окно попадают в "window_max"."""
+        with self._lock:
+            result = {
+                "time": time.perf_counter(),
+                "timings": {k: list(v) for k, v in self._timings.items()},
+                "counters": dict(self._counters),
+                "gauges": {k: list(v) for k, v in self._gauges.items()},
+            }
+            if since is not None and "window" in since:
+                result["window_max"] = self._windows.pop(since["window"], {"timings": {}, "gauges": {}})
+            if window:
+                # Текущие значения датчиков — начальные максимумы окна
+                self._windows[self._next_window] = {
+                    "timings": {},
+                    "gauges": {k: v[0] for k, v in self._gauges.items()},
+                }
+                result["window"] = self._next_window
+                self._next_window += 1
+                while len(self._windows) > MAX_OPEN_WINDOWS:
+                    self._windows.popitem(last=False)
+            return result
+
+    def reset(self):
+        with self._lock:
+            self._timings.clear()
+            self._counters.clear()
+            self._gauges.clear()
+            for window in self._windows.values():
+                window["timings"].clear()
+                window["gauges"].clear()
+
+
+def _raise_max(maxima, name, value):
+    if name not in maxima or value > maxima[name]:
+        maxima[name] = value
+
+
+METRICS = Metrics()
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux отдаёт килобайты, macOS — байты
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def current_rss_mb():
+    try:
+        with open("/proc/self/statm") as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def record_memory():
+    rss = current_rss_mb()
+    if rss is not None:
+        METRICS.gauge("rss_mb", rss)
+    peak = peak_rss_mb()
+    if peak is not None:
+        METRICS.gauge("peak_rss_mb", peak)
+
+
+def summarize(before, after):
+    """Сводка по прогону между двумя снимками METRICS.snapshot().
+
+    Максимумы берутся из окна (after = snapshot(since=before)); без окна — максимумы
+    за всё время жизни реестра."""
+    wall = after["time"] - before["time"]
+    window_max = after.get("window_max")
+    stages = {}
+    for stage, (calls, total, max_seconds) in after["timings"].items():
+        prev_calls, prev_total, _ = before["timings"].get(stage, (0, 0.0, 0.0))
+        calls -= prev_calls
+        if calls <= 0:
+            continue
+        total -= prev_total
+        if window_max is not None:
+            max_seconds = window_max["timings"].get(stage, 0.0)
+        stages[stage] = {
+            "calls": calls,
+            "seconds": total,
+            "mean_ms": total / calls * 1000,
+            "max_ms": max_seconds * 1000,
+        }
+
+    counters = {}
+    for name, value in after["counters"].items():
+        delta = value - before["counters"].get(name, 0)
+        if delta:
+            counters[name] = delta
+
+    throughput = {}
+    if wall > 0:
+        for name in ("frames_decoded", "frames_classified"):
+            if name in counters:
+                throughput[f"{name}_per_sec"] = counters[name] / wall
+
+    return {
+        "wall_seconds": wall,
+        "stages": stages,
+        "counters": counters,
+        "gauges": {name: {"last": last, "max": window_max["gauges"].get(name, last) if window_max else peak}
+                   for name, (last, peak) in after["gauges"].items()},
+        "throughput": throughput,
+    }
+
+
+def _metric_name(name):
+    return re.sub(r"[^a-zA-Z0-9_]", "_", name)
+
+
+def to_prometheus(summary, prefix="ad_detector"):
+    lines = []
+    for stage, values in summary["stages"].items():
+        stage = _metric_name(stage)
+        lines.append(f'{prefix}_stage_seconds_total{{stage="{stage}"}} {values["seconds"]:.6f}')
+        lines.append(f'{prefix}_stage_calls_total{{stage="{stage}"}} {values["calls"]}')
+        lines.append(f'{prefix}_stage_max_seconds{{stage="{stage}"}} {values["max_ms"] / 1000:.6f}')
+    for name, value in summary["counters"].items():
+        lines.append(f"{prefix}_{_metric_name(name)}_total {value}")
+    for name, values in summary["gauges"].items():
+        lines.append(f"{prefix}_{_metric_name(name)} {values['last']}")
+        lines.append(f"{prefix}_{_metric_name(name)}_max {values['max']}")
+    for name, value in summary["throughput"].items():
+        lines.append(f"{prefix}_{_metric_name(name)} {value:.3f}")
+    lines.append(f"{prefix}_run_wall_seconds {summary['wall_seconds']:.6f}")
+    return "\n".join(lines) + "\n"
+
+
+def to_json_line(summary, **labels):
+    return json.dumps({"ts": time.time(), **labels, **summary}, ensure_ascii=False) + "\n"
+
+
+def dump(summary, path=None, **labels):
+    path = path or os.environ.get(METRICS_FILE_ENV)
+    if not path:
+        return
+    if path.endswith(".prom"):
+        # Prometheus textfile collector ждёт полный файл, поэтому перезаписываем атомарно
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(to_prometheus(summary))
+        os.replace(tmp_path, path)
+    else:
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(to_json_line(summary, **labels))
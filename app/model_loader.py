@@ -6,9 +6,13 @@ import zipfile
 import torch
 import timm
 
+from host_config import HostConfig, host_config
+from metrics import METRICS
+
 AVAILABLE_MODELS = {
     "Swin": "../models/ad_classifier_swin.pth"
 }
+MODEL_ARCH = "swin_tiny_patch4_window7_224"
 
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 PRELOADED_MODELS = {}
@@ -18,17 +22,78 @@ def extract_model_if_needed(zip_path, extract_to):
         with zipfile.ZipFile(zip_path, 'r') as zip_ref:
             zip_ref.extractall(os.path.dirname(extract_to))
 
+def build_model(pretrained=True):
+    return timm.create_model(MODEL_ARCH, pretrained=pretrained, num_classes=2)
+
+
+class TunedModel(torch.nn.Module):
+    """Модель с раскладкой входа и точностью из конфигурации хоста; выход всегда float32."""
+
+    def __init__(self, model, channels_last=False, bf16=False):
+        super().__init__()
+        self.model = model
+        self.channels_last = channels_last
+        self.bf16 = bf16
+
+    def forward(self, x):
+        if self.channels_last:
+            x = x.contiguous(memory_format=torch.channels_last)
+        if self.bf16:
+            with torch.autocast(device_type=x.device.type, dtype=torch.bfloat16):
+                return self.model(x).float()
+        return self.model(x)
+
+
+def apply_host_config(model, config: HostConfig):
+    if config.torch_threads:
+        torch.set_num_threads(config.torch_threads)
+    if not config.channels_last and not config.bf16:
+        return model
+    if config.channels_last:
+        model = model.to(memory_format=torch.channels_last)
+    return TunedModel(model, channels_last=config.channels_last, bf16=config.bf16).eval()
+
+
+def quantize_dynamic(model):
+    """int8-квантизация весов Linear-слоёв (у Swin это почти весь расчёт), только для CPU."""
+    return torch.ao.quantization.quantize_dynamic(model.cpu(), {torch.nn.Linear}, dtype=torch.qint8).eval()
+
+
+def model_identity(model_name):
+    """Строка, меняющаяся вместе с архитектурой или файлом весов, — ключ для сохранённых оценок."""
+    model_path = AVAILABLE_MODELS.get(model_name)
+    try:
+        stat = os.stat(model_path)
+        weights = f"{os.path.basename(model_path)}:{stat.st_size}:{int(stat.st_mtime)}"
+    except (TypeError, OSError):
+        weights = "missing"
+    return f"{model_name}:{MODEL_ARCH}:{weights}"
+
+
 def load_model(model_name):
     if model_name in PRELOADED_MODELS:
+        METRICS.count("model_cache_hits")
         return PRELOADED_MODELS[model_name]
+    METRICS.count("model_cache_misses")
+
+    with METRICS.timer("model_load"):
+        model = load_weights(model_name)
+        if model is None:
+            return None
+        model = apply_host_config(model, host_config())
+    PRELOADED_MODELS[model_name] = model
+    return model
+
 
+def load_weights(model_name):
+    """Модель с весами без настроек хоста и без кэша (нужна autotune.py как эталон)."""
     model_path = AVAILABLE_MODELS.get(model_name)
 
     zip_path = model_path.replace('.pth', '.zip')
     if os.path.exists(zip_path):
         extract_model_if_needed(zip_path, '../ad_classifier_swin.pth')
 
-    model = timm.create_model("swin_tiny_patch4_window7_224", pretrained=True, num_classes=2)
+    model = build_model()
     if model_path and model is not None:
         try:
             model.load_state_dict(torch.load(model_path, map_location=device))
@@ -40,8 +105,6 @@ def load_model(model_name):
     else:
         print(f"Ошибка: модель {model_name} не найдена в AVAILABLE_MODELS.")
         return None
-
-    PRELOADED_MODELS[model_name] = model
     return model
 
 
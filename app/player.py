@@ -1,23 +1,30 @@
+import difflib
 import logging
 import os
 import re
 import sys
+from collections import OrderedDict
 from typing import List, Tuple
 
 import vlc
-from PyQt6.QtCore import QTimer, QSize, pyqtSignal, QPointF, Qt, QRect
-from PyQt6.QtGui import QColor, QPalette, QIcon, QPainter, QPen, QLinearGradient
+from PyQt6.QtCore import QTimer, QSize, pyqtSignal, Qt, QRect, QPoint, QAbstractListModel, QModelIndex
+from PyQt6.QtGui import QColor, QPalette, QIcon, QPainter, QPen, QPixmap
 from PyQt6.QtWidgets import (
     QVBoxLayout, QHBoxLayout, QLabel, QPushButton, QWidget, QStyle, QSlider, QStyleOptionSlider, QLineEdit,
-    QGridLayout, QScrollArea, QGroupBox
+    QGroupBox, QListView
 )
 
+from intervals import IntervalIndex
+
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
 logger = logging.getLogger(__name__)
 
+# Наборы миниатюр последних видео, которые плеер держит загруженными для быстрого переключения
+THUMBNAIL_CACHE_SIZE = 4
+
 
 def format_time(seconds: float) -> str:
     minutes = int(seconds // 60)
@@ -25,6 +32,50 @@ def format_time(seconds: float) -> str:
     return f"{minutes:02d}:{secs:02d}"
 
 
+class ThumbnailPixmaps:
+    """Миниатюры из спрайт-листов (thumbnails.ThumbnailIndex): лист грузится один раз, плитка вырезается."""
+
+    def __init__(self, index):
+        self.index = index
+        self._sheets = {}
+        # Уменьшенные миниатюры для списка сегментов по (секунды, ширина, высота)
+        self._icons = {}
+
+    @staticmethod
+    def cache_key(index):
+        # Листы перезаписываются при повторном анализе, поэтому в ключе их mtime
+        mtimes = []
+        for path in index.sheets:
+            try:
+                mtimes.append(os.path.getmtime(path))
+            except OSError:
+                mtimes.append(None)
+        return index.directory, len(index), tuple(mtimes)
+
+    def pixmap_at(self, seconds):
+        place = self.index.lookup(seconds)
+        if place is None:
+            return None
+        path, x, y, width, height = place
+        sheet = self._sheets.get(path)
+        if sheet is None:
+            sheet = QPixmap(path)
+            if sheet.isNull():
+                return None
+            self._sheets[path] = sheet
+        return sheet.copy(QRect(x, y, width, height))
+
+    def icon_at(self, seconds, size):
+        key = (seconds, size.width(), size.height())
+        if key not in self._icons:
+            pixmap = self.pixmap_at(seconds)
+            if pixmap is not None:
+                pixmap = pixmap.scaled(size, Qt.AspectRatioMode.KeepAspectRatio,
+                                       Qt.TransformationMode.SmoothTransformation)
+            self._icons[key] = pixmap
+        return self._icons[key]
+
+
 class AdSlider(QSlider):
     def __init__(self, ad_timestamps, total_duration, parent=None):
         super().__init__(Qt.Orientation.Horizontal, parent)
@@ -32,9 +83,15 @@ class AdSlider(QSlider):
         self.total_duration = total_duration
         self.setRange(0, 1000)
 
-        self._segment_cache = None
-        self._last_paint_rect = None
-        self._last_paint_size = None
+        # Подложка с рекламой рисуется один раз в pixmap и пересобирается только
+        # при изменении размера, длительности или списка сегментов
+        self._overlay = None
+        self._overlay_key = None
+
+        # thumbnail_provider(секунды) -> QPixmap | None, превью при наведении на таймлайн
+        self.thumbnail_provider = None
+        self._preview = None
+        self.setMouseTracking(True)
 
         self.setStyleSheet("""
             QSlider::groove:horizontal {
@@ -59,55 +116,128 @@ class AdSlider(QSlider):
             }
         """)
 
-    def _calculate_segments(self, groove_rect):
-        if not self.ad_timestamps or not self.total_duration:
-            return []
+    def set_ad_timestamps(self, ad_timestamps):
+        self.set_timeline(ad_timestamps, self.total_duration)
 
-        segments = []
-        groove_width = groove_rect.width()
-        width_multiplier = groove_width / self.total_duration
+    def set_total_duration(self, total_duration):
+        self.set_timeline(self.ad_timestamps, total_duration)
 
-        for start, end in self.ad_timestamps:
-            start_pos = int(start * width_multiplier)
-            end_pos = int(end * width_multiplier)
+    def set_timeline(self, ad_timestamps, total_duration):
+        # Подложка пересобирается, только если что-то действительно изменилось
+        if ad_timestamps == self.ad_timestamps and total_duration == self.total_duration:
+            return
+        self.ad_timestamps = ad_timestamps
+        self.total_duration = total_duration
+        self.invalidate_overlay()
 
-            segment_rect = QRect(groove_rect.x() + start_pos, groove_rect.y(),
-                                 end_pos - start_pos, groove_rect.height())
-            segments.append(segment_rect)
-        return segments
+    def invalidate_overlay(self):
+        self._overlay = None
+        self._overlay_key = None
+        self.update()
 
-    def paintEvent(self, event):
-        super().paintEvent(event)
+    def _merged_runs(self, width):
+        """Сегменты в пикселях [x0, x1), слитые по столбцам: их не больше width / 2."""
+        if not self.ad_timestamps or not self.total_duration or width <= 0:
+            return []
 
+        width_multiplier = width / self.total_duration
+        columns = sorted(
+            (int(start * width_multiplier), max(int(end * width_multiplier), int(start * width_multiplier) + 1))
+            for start, end in self.ad_timestamps
+        )
+        runs = []
+        for x0, x1 in columns:
+            x0, x1 = max(x0, 0), min(x1, width)
+            if x0 >= x1:
+                continue
+            if runs and x0 <= runs[-1][1]:
+                if x1 > runs[-1][1]:
+                    runs[-1][1] = x1
+            else:
+                runs.append([x0, x1])
+        return runs
+
+    def _render_overlay(self, size):
+        ratio = self.devicePixelRatioF()
+        pixmap = QPixmap(max(int(size.width() * ratio), 1), max(int(size.height() * ratio), 1))
+        pixmap.setDevicePixelRatio(ratio)
+        pixmap.fill(Qt.GlobalColor.transparent)
+
+        runs = self._merged_runs(size.width())
+        if runs:
+            ad_color = QColor(191, 97, 106, 128)
+            painter = QPainter(pixmap)
+            painter.setPen(QPen(ad_color.lighter(150), 1))
+            painter.setBrush(ad_color.lighter(120))
+            for x0, x1 in runs:
+                painter.drawRect(QRect(x0, 0, x1 - x0, size.height() - 1))
+            painter.end()
+        return pixmap
+
+    def _groove_rect(self):
         opt = QStyleOptionSlider()
         self.initStyleOption(opt)
-        groove_rect = self.style().subControlRect(QStyle.ComplexControl.CC_Slider, opt,
-                                                  QStyle.SubControl.SC_SliderGroove, self)
+        return self.style().subControlRect(QStyle.ComplexControl.CC_Slider, opt,
+                                           QStyle.SubControl.SC_SliderGroove, self)
+
+    def set_thumbnail_provider(self, provider):
+        self.thumbnail_provider = provider
+        if provider is None:
+            self._hide_preview()
+
+    def _hide_preview(self):
+        if self._preview is not None:
+            self._preview.hide()
+
+    def _show_preview(self, pos):
+        groove_rect = self._groove_rect()
+        if self.thumbnail_provider is None or not self.total_duration or groove_rect.width() <= 0:
+            self._hide_preview()
+            return
 
-        current_size = groove_rect.size()
-        if (self._segment_cache is None or
-                self._last_paint_size != current_size):
-            self._segment_cache = self._calculate_segments(groove_rect)
-            self._last_paint_size = current_size
-            self._last_paint_rect = groove_rect
+        fraction = min(max((pos.x() - groove_rect.x()) / groove_rect.width(), 0.0), 1.0)
+        seconds = fraction * self.total_duration
+        pixmap = self.thumbnail_provider(seconds)
+        if pixmap is None:
+            self._hide_preview()
+            return
 
-        painter = QPainter(self)
-        painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+        if self._preview is None:
+            self._preview = QLabel(self, Qt.WindowType.ToolTip)
+            self._preview.setAlignment(Qt.AlignmentFlag.AlignHCenter | Qt.AlignmentFlag.AlignTop)
+            self._preview.setStyleSheet(
+                "background-color: #2E3440; border: 1px solid #4A5568;"
+            )
+        self._preview.setPixmap(pixmap)
+        self._preview.adjustSize()
+        self._preview.move(self.mapToGlobal(
+            QPoint(pos.x() - self._preview.width() // 2, -self._preview.height() - 4)
+        ))
+        self._preview.show()
 
-        ad_color = QColor(191, 97, 106, 128)
+    def mouseMoveEvent(self, event):
+        super().mouseMoveEvent(event)
+        self._show_preview(event.position().toPoint())
 
-        for segment_rect in self._segment_cache:
-            gradient = QLinearGradient(
-                QPointF(segment_rect.topLeft()),
-                QPointF(segment_rect.topRight())
-            )
-            gradient.setColorAt(0, ad_color.lighter(120))
-            gradient.setColorAt(1, ad_color.lighter(120))
+    def leaveEvent(self, event):
+        self._hide_preview()
+        super().leaveEvent(event)
 
-            painter.fillRect(segment_rect, gradient)
+    def hideEvent(self, event):
+        self._hide_preview()
+        super().hideEvent(event)
 
-            painter.setPen(QPen(ad_color.lighter(150), 1))
-            painter.drawRect(segment_rect)
+    def paintEvent(self, event):
+        super().paintEvent(event)
+
+        groove_rect = self._groove_rect()
+        key = (groove_rect.width(), groove_rect.height(), self.devicePixelRatioF())
+        if self._overlay is None or self._overlay_key != key:
+            self._overlay = self._render_overlay(groove_rect.size())
+            self._overlay_key = key
+
+        painter = QPainter(self)
+        painter.drawPixmap(groove_rect.topLeft(), self._overlay)
 
 
 def parse_time(text):
@@ -131,25 +261,144 @@ def parse_time(text):
     return None
 
 
+class AdTimecodeModel(QAbstractListModel):
+    """Список рекламных сегментов для QListView: строки рисуются только для видимой области,
+    фильтр хранит позиции в IntervalIndex, а не виджеты.
+
+    Смена сегментов и фильтра не сбрасывает модель: показанные строки сравниваются с новыми,
+    и представление получает вставки, удаления и dataChanged только для изменившихся строк,
+    так что выделение и прокрутка переживают живое обновление во время анализа."""
+
+    StartRole = Qt.ItemDataRole.UserRole + 1
+    ICON_SIZE = QSize(64, 36)
+
+    def __init__(self, ad_timestamps=(), parent=None):
+        super().__init__(parent)
+        self.index = IntervalIndex([])
+        self.labels = []
+        self.query = ""
+        # Показанные строки — сегменты (начало, конец) в порядке отображения
+        self._shown = []
+        self._label_by_segment = {}
+        # thumbnail_provider(секунды) -> иконка ICON_SIZE | None; кэш иконок — у провайдера,
+        # поэтому он переживает смену сегментов и переключение между видео
+        self.thumbnail_provider = None
+        self.set_segments(ad_timestamps)
+
+    def set_thumbnail_provider(self, provider):
+        self.thumbnail_provider = provider
+        # Меняются только иконки: строки и фильтр остаются, модель не сбрасываем
+        if self.rowCount():
+            self.dataChanged.emit(self.createIndex(0, 0), self.createIndex(self.rowCount() - 1, 0),
+                                  [Qt.ItemDataRole.DecorationRole])
+
+    def set_segments(self, ad_timestamps):
+        self.index = IntervalIndex(list(ad_timestamps))
+        segments = list(zip(self.index.starts, self.index.ends))
+        # Подписи уже показанных сегментов переиспользуются, форматируются только новые
+        labels = self._label_by_segment
+        self.labels = [labels.get(segment) or f"{format_time(segment[0])} – {format_time(segment[1])}"
+                       for segment in segments]
+        self._label_by_segment = dict(zip(segments, self.labels))
+        self.set_rows(self.filter(self.query))
+
+    def set_query(self, query):
+        self.query = query
+        self.set_rows(self.filter(query))
+
+    def set_rows(self, rows):
+        # rows — позиции в индексе, None — показать всё
+        positions = range(len(self.labels)) if rows is None else rows
+        self._update_shown([(self.index.starts[p], self.index.ends[p]) for p in positions])
+
+    def _update_shown(self, shown):
+        matcher = difflib.SequenceMatcher(None, self._shown, shown, autojunk=False)
+        # С конца, чтобы номера строк ещё не обработанных участков не сдвигались
+        for tag, i1, i2, j1, j2 in reversed(matcher.get_opcodes()):
+            if tag == "equal":
+                continue
+            if tag == "replace" and i2 - i1 == j2 - j1:
+                self._shown[i1:i2] = shown[j1:j2]
+                self.dataChanged.emit(self.createIndex(i1, 0), self.createIndex(i2 - 1, 0))
+                continue
+            if i2 > i1:
+                self.beginRemoveRows(QModelIndex(), i1, i2 - 1)
+                del self._shown[i1:i2]
+                self.endRemoveRows()
+            if j2 > j1:
+                self.beginInsertRows(QModelIndex(), i1, i1 + j2 - j1 - 1)
+                self._shown[i1:i1] = shown[j1:j2]
+                self.endInsertRows()
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self._shown)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        segment = self._shown[index.row()]
+        if role == Qt.ItemDataRole.DisplayRole:
+            return self._label_by_segment[segment]
+        if role == Qt.ItemDataRole.ToolTipRole:
+            return f"Перейти к рекламе: {self._label_by_segment[segment]}"
+        if role == Qt.ItemDataRole.DecorationRole and self.thumbnail_provider is not None:
+            return self.thumbnail_provider(segment[0])
+        if role == self.StartRole:
+            return segment[0]
+        return None
+
+    def filter(self, query):
+        query = query.strip()
+        if not query:
+            return None
+
+        range_match = re.match(r'(.+)[–\-](.+)', query)
+        if range_match:
+            start_text, end_text = range_match.groups()
+            start_sec = parse_time(start_text)
+            end_sec = parse_time(end_text)
+            if start_sec is not None and end_sec is not None:
+                return self.index.overlapping(start_sec, end_sec)
+
+        target = parse_time(query)
+        if target is not None:
+            return self.index.at(target)
+
+        q = query.lower()
+        return [position for position, label in enumerate(self.labels) if q in label.lower()]
+
+
 class VLCPlayer(QWidget):
+    """Плеер живёт всё время работы приложения: один vlc.Instance и один media player,
+    при смене видео или результатов анализа подменяются media и сегменты (set_media)."""
+
     error_occurred = pyqtSignal(str)
+    # События libvlc приходят в его потоке; виджеты трогаем только в потоке интерфейса
+    _media_parsed = pyqtSignal(object)
 
-    def __init__(self, video_path, ad_timestamps):
+    def __init__(self, video_path=None, ad_timestamps=()):
         super().__init__()
         self.buttons_layout = QVBoxLayout()
         self.setWindowTitle("Плеер с таймкодами")
 
         self.instance = vlc.Instance('--no-video-title-show --no-xlib')
         self.mediaplayer = self.instance.media_player_new()
+        self.media = None
+        self._released = False
 
-        self.ad_timestamps = ad_timestamps
+        self.ad_timestamps = list(ad_timestamps)
         self.total_duration = 0
-        self.video_path = video_path
+        self.video_path = None
+        # Длительность уже открывавшихся видео: при возврате к ним таймлайн рисуется сразу
+        self._durations = {}
+        self._thumbnail_cache = OrderedDict()
         self._last_position = 0
         self._update_threshold = 0.01
         self._is_playing = False
 
-        self.position_slider = AdSlider(ad_timestamps, self.total_duration)
+        self.position_slider = AdSlider(self.ad_timestamps, self.total_duration)
         self.position_slider.sliderPressed.connect(self.slider_pressed)
         self.position_slider.sliderReleased.connect(self.slider_released)
         self.position_slider.sliderMoved.connect(self.slider_moved)
@@ -160,13 +409,17 @@ class VLCPlayer(QWidget):
         self.timer = QTimer(self)
         self.timer.setInterval(100)
         self.timer.timeout.connect(self.update_ui)
+        self._media_parsed.connect(self._on_media_parsed, Qt.ConnectionType.QueuedConnection)
 
         self.is_seeking = False
         self._media_loaded = False
+        self.thumbnails = None
 
         self.setup_ui()
-        self.load_video(video_path)
-        self.create_ad_section(ad_timestamps)
+        self._attach_video_frame()
+        self.create_ad_section(self.ad_timestamps)
+        if video_path is not None:
+            self.load_video(video_path)
 
     def setup_ui(self):
         self.video_frame = QWidget()
@@ -205,35 +458,79 @@ class VLCPlayer(QWidget):
         layout.addLayout(self.buttons_layout)
         self.setLayout(layout)
 
+    def _attach_video_frame(self):
+        # Окно вывода привязывается один раз: media player переживает смену видео
+        if sys.platform.startswith("linux"):
+            self.mediaplayer.set_xwindow(self.video_frame.winId())
+        elif sys.platform == "win32":
+            self.mediaplayer.set_hwnd(self.video_frame.winId())
+        elif sys.platform == "darwin":
+            self.mediaplayer.set_nsobject(int(self.video_frame.winId()))
+
+    def set_media(self, video_path, ad_timestamps):
+        """Показывает video_path с сегментами ad_timestamps; то же видео не перезагружается."""
+        self.load_video(video_path)
+        self.set_ad_timestamps(ad_timestamps)
+
     def load_video(self, video_path):
+        if video_path == self.video_path and self.media is not None:
+            return
         try:
             if not os.path.exists(video_path):
                 raise FileNotFoundError(f"Видео файл не найден: {video_path}")
+            self.stop()
+            self._release_media()
+            self.video_path = video_path
+            self.total_duration = self._durations.get(video_path, 0)
+            self.position_slider.set_total_duration(self.total_duration)
+            self._media_loaded = video_path in self._durations
+
             self.media = self.instance.media_new(video_path)
             self.mediaplayer.set_media(self.media)
-            self.media.parse_async()
+            # media передаётся в обработчик: событие от прежнего media после смены видео игнорируется
             self.media.event_manager().event_attach(
                 vlc.EventType.MediaParsedChanged,
-                self._on_media_parsed
+                self._on_vlc_media_parsed,
+                self.media
             )
-
-            if sys.platform.startswith("linux"):
-                self.mediaplayer.set_xwindow(self.video_frame.winId())
-            elif sys.platform == "win32":
-                self.mediaplayer.set_hwnd(self.video_frame.winId())
-            elif sys.platform == "darwin":
-                self.mediaplayer.set_nsobject(int(self.video_frame.winId()))
+            self.media.parse_async()
 
         except Exception as e:
             self.error_occurred.emit(f"Ошибка загрузки видео: {str(e)}")
 
-    def _on_media_parsed(self, event):
-        self.total_duration = self.media.get_duration() / 1000
-        self.position_slider.total_duration = self.total_duration
-        self.position_slider._segment_cache = None
-        self.position_slider.update()
+    def _on_vlc_media_parsed(self, event, media):
+        # Поток libvlc: только передаём событие в поток интерфейса
+        self._media_parsed.emit(media)
+
+    def _on_media_parsed(self, media):
+        if media is not self.media:
+            return
+        self.total_duration = media.get_duration() / 1000
+        self._durations[self.video_path] = self.total_duration
+        self.position_slider.set_total_duration(self.total_duration)
         self._media_loaded = True
 
+    def _release_media(self):
+        if self.media is None:
+            return
+        try:
+            self.media.event_manager().event_detach(vlc.EventType.MediaParsedChanged)
+            self.media.release()
+        except Exception:
+            pass
+        self.media = None
+
+    def stop(self):
+        self.timer.stop()
+        self._is_playing = False
+        try:
+            self.mediaplayer.stop()
+        except Exception:
+            pass
+        self._last_position = 0
+        self.position_slider.setValue(0)
+        self.time_label.setText("00:00 / 00:00")
+
     def is_playing_safe(self):
         try:
             return self.mediaplayer.is_playing()
@@ -303,83 +600,86 @@ class VLCPlayer(QWidget):
             self._is_playing = False
 
     def create_ad_section(self, ad_timestamps):
-        self.all_ad_buttons = []
-
         self.search_input = QLineEdit()
         self.search_input.setPlaceholderText("🔍 Поиск по таймкодам...")
         self.search_input.textChanged.connect(self.filter_ad_buttons)
 
-        self.grid_layout = QGridLayout()
-        self.grid_layout.setSpacing(6)
-
-        max_columns = 3
-        for i, (start, end) in enumerate(ad_timestamps):
-            label = f"{format_time(start)} – {format_time(end)}"
-            btn = QPushButton(label)
-            btn.setToolTip(f"Перейти к рекламе: {label}")
-            btn.clicked.connect(lambda _, s=start: self.seek_to(s))
-            btn.setStyleSheet("""
-                QPushButton {
-                    background-color: #BF616A;
-                    color: white;
-                    padding: 4px 8px;
-                    border-radius: 4px;
-                    font-size: 10px;
-                }
-                QPushButton:hover {
-                    background-color: #D08770;
-                }
-            """)
-
-            row = i // max_columns
-            col = i % max_columns
-            self.grid_layout.addWidget(btn, row, col)
-            self.all_ad_buttons.append((btn, start, end))
-
-        container = QWidget()
-        container.setLayout(self.grid_layout)
-
-        scroll_area = QScrollArea()
-        scroll_area.setWidgetResizable(True)
-        scroll_area.setWidget(container)
+        self.ad_model = AdTimecodeModel(ad_timestamps, self)
+        self.ad_list = QListView()
+        self.ad_list.setModel(self.ad_model)
+        self.ad_list.setUniformItemSizes(True)
+        self.ad_list.setIconSize(AdTimecodeModel.ICON_SIZE)
+        self.ad_list.setEditTriggers(QListView.EditTrigger.NoEditTriggers)
+        self.ad_list.clicked.connect(
+            lambda index: self.seek_to(self.ad_model.data(index, AdTimecodeModel.StartRole))
+        )
+        self.ad_list.setStyleSheet("""
+            QListView {
+                background-color: #2E3440;
+                border: none;
+            }
+            QListView::item {
+                background-color: #BF616A;
+                color: white;
+                padding: 4px 8px;
+                margin: 2px 0;
+                border-radius: 4px;
+                font-size: 10px;
+            }
+            QListView::item:hover {
+                background-color: #D08770;
+            }
+        """)
 
         layout = QVBoxLayout()
         layout.addWidget(QLabel("Таймкоды рекламы"))
         layout.addWidget(self.search_input)
-        layout.addWidget(scroll_area)
+        layout.addWidget(self.ad_list)
 
         group = QGroupBox()
         group.setLayout(layout)
         self.buttons_layout.addWidget(group)
 
-    def filter_ad_buttons(self, text):
-        query = text.strip()
-        if not query:
-            for btn, _, _ in self.all_ad_buttons:
-                btn.setVisible(True)
+    def set_ad_timestamps(self, ad_timestamps):
+        if list(ad_timestamps) == self.ad_timestamps:
+            return
+        self.ad_timestamps = list(ad_timestamps)
+        self.position_slider.set_ad_timestamps(self.ad_timestamps)
+        # Модель сама применяет текущий фильтр к новым сегментам
+        self.ad_model.set_segments(self.ad_timestamps)
+
+    def set_thumbnails(self, index):
+        """index — thumbnails.ThumbnailIndex или None, если превью для видео ещё нет."""
+        thumbnails = None
+        if index is not None and len(index):
+            # Загруженные листы и иконки недавних видео переиспользуются при возврате к ним
+            key = ThumbnailPixmaps.cache_key(index)
+            thumbnails = self._thumbnail_cache.pop(key, None) or ThumbnailPixmaps(index)
+            self._thumbnail_cache[key] = thumbnails
+            while len(self._thumbnail_cache) > THUMBNAIL_CACHE_SIZE:
+                self._thumbnail_cache.popitem(last=False)
+        if thumbnails is self.thumbnails:
             return
 
-        range_match = re.match(r'(.+)[–\-](.+)', query)
-        if range_match:
-            start_text, end_text = range_match.groups()
-            start_sec = parse_time(start_text)
-            end_sec = parse_time(end_text)
-            if start_sec is not None and end_sec is not None:
-                for btn, start, end in self.all_ad_buttons:
-                    btn.setVisible(start_sec <= start <= end_sec or start_sec <= end <= end_sec)
-                return
-
-        target = parse_time(query)
-        if target is not None:
-            for btn, start, end in self.all_ad_buttons:
-                btn.setVisible(start <= target <= end)
+        self.thumbnails = thumbnails
+        if thumbnails is None:
+            self.position_slider.set_thumbnail_provider(None)
+            self.ad_model.set_thumbnail_provider(None)
         else:
-            q = query.lower()
-            for btn, start, end in self.all_ad_buttons:
-                label = f"{format_time(start)} – {format_time(end)}"
-                btn.setVisible(q in label.lower())
+            self.position_slider.set_thumbnail_provider(thumbnails.pixmap_at)
+            self.ad_model.set_thumbnail_provider(
+                lambda seconds: thumbnails.icon_at(seconds, AdTimecodeModel.ICON_SIZE)
+            )
 
-    def closeEvent(self, event):
+    def filter_ad_buttons(self, text):
+        self.ad_model.set_query(text)
+
+    def release(self):
+        """Освобождает ресурсы VLC; вызывается один раз при закрытии приложения."""
+        if self._released:
+            return
+        self._released = True
+        self.timer.stop()
         try:
             if self.is_playing_safe():
                 self.mediaplayer.stop()
@@ -391,16 +691,15 @@ class VLCPlayer(QWidget):
         except Exception:
             pass
 
-        try:
-            self.media.release()
-        except Exception:
-            pass
+        self._release_media()
 
         try:
             self.instance.release()
         except Exception:
             pass
 
+    def closeEvent(self, event):
+        self.release()
         super().closeEvent(event)
         event.accept()
 
@@ -0,0 +1,289 @@
+"""Дешёвый предфильтр рекламных блоков: чёрные кадры и провалы звука.
+
+Рекламный блок в эфире обычно обрамлён чёрными кадрами и тишиной. Проход по уменьшенным
+кадрам (статистика яркости в NumPy, пороги как у ffmpeg blackdetect) и по RMS звука из
+локального ffmpeg даёт маркеры; окна-кандидаты вокруг них складываются в IntervalIndex.
+Анализ с settings.prefilter классифицирует сцены внутри окон с обычным шагом, остальные —
+редко (см. analysis.sample_intervals).
+
+Чтобы предфильтр был дешевле самого анализа, видео не декодируется целиком: сначала считается
+звук, и кадры с шагом step читаются только около тишины. Без звука смотрятся одни ключевые
+кадры (индекс keyframes.py у VideoSource), и плотно — только GOP вокруг чёрных; без звука
+и без индекса остаётся полный проход.
+
+    python prefilter.py recall labels.json --margin 60
+
+labels.json: {"путь/к/видео.mp4": [[начало, конец], ...], ...} — размеченные рекламные сегменты.
+"""
+import argparse
+import json
+import logging
+import shutil
+import subprocess
+from dataclasses import asdict, dataclass, field
+from typing import List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from intervals import IntervalIndex, merge_intervals
+from metrics import METRICS
+from video_source import VideoSource, lease_capture
+
+logger = logging.getLogger(__name__)
+
+Interval = Tuple[float, float]
+
+PREVIEW_SIZE = (64, 36)
+AUDIO_RATE = 8000
+
+
+@dataclass
+class Candidates:
+    duration: float
+    black: List[Interval] = field(default_factory=list)
+    # None — звук недоступен (нет ffmpeg или аудиодорожки)
+    silence: Optional[List[Interval]] = None
+    markers: List[Interval] = field(default_factory=list)
+    windows: List[Interval] = field(default_factory=list)
+
+    def index(self) -> IntervalIndex:
+        return IntervalIndex(self.windows)
+
+    @property
+    def coverage(self) -> float:
+        """Доля длительности видео, попавшая в окна, — столько будет анализироваться плотно."""
+        if self.duration <= 0:
+            return 0.0
+        return sum(end - start for start, end in self.windows) / self.duration
+
+
+def _runs(flags, step, min_duration, offset=0.0) -> List[Interval]:
+    padded = np.concatenate(([0], flags.astype(np.int8), [0]))
+    edges = np.flatnonzero(np.diff(padded))
+    return [(float(offset + start * step), float(offset + end * step))
+            for start, end in zip(edges[0::2], edges[1::2])
+            if (end - start) * step >= min_duration]
+
+
+class _BlackTest:
+    def __init__(self, pixel_threshold=0.10, picture_ratio=0.98):
+        self.luma_threshold = pixel_threshold * 255
+        self.picture_ratio = picture_ratio
+        self.small = np.empty((PREVIEW_SIZE[1], PREVIEW_SIZE[0], 3), dtype=np.uint8)
+        self.gray = np.empty((PREVIEW_SIZE[1], PREVIEW_SIZE[0]), dtype=np.uint8)
+
+    def __call__(self, frame) -> bool:
+        cv2.resize(frame, PREVIEW_SIZE, dst=self.small, interpolation=cv2.INTER_AREA)
+        cv2.cvtColor(self.small, cv2.COLOR_BGR2GRAY, dst=self.gray)
+        return np.count_nonzero(self.gray <= self.luma_threshold) >= self.picture_ratio * self.gray.size
+
+
+def black_intervals(video, step=0.1, pixel_threshold=0.10, picture_ratio=0.98,
+                    min_duration=0.0, windows=None, should_stop=None) -> List[Interval]:
+    """Участки, где не меньше picture_ratio пикселей темнее pixel_threshold (доля от 255).
+    windows — просматривать только эти интервалы (None — всё видео)."""
+    is_black = _BlackTest(pixel_threshold, picture_ratio)
+    result = []
+    frames = 0
+    with METRICS.timer("prefilter_video"), lease_capture(video, 0.0) as handle:
+        frame = None
+        for start, end in windows if windows is not None else [(0.0, float("inf"))]:
+            first = int(np.ceil(start / step))
+            flags = []
+            i = first
+            while i * step <= end and (should_stop is None or not should_stop()):
+                if not handle.seek(i * step):
+                    break
+                ret, frame = handle.read(frame)
+                if not ret:
+                    break
+                flags.append(is_black(frame))
+                i += 1
+            frames += len(flags)
+            result.extend(_runs(np.array(flags, dtype=bool), step, min_duration, offset=first * step))
+    METRICS.count("prefilter_frames", frames)
+    return merge_intervals(result, gap=step / 2)
+
+
+def keyframe_windows(video, keyframes, pixel_threshold=0.10, picture_ratio=0.98, should_stop=None):
+    """GOP ([предыдущий, следующий ключевой кадр]) вокруг чёрных ключевых кадров.
+
+    Читается только сам ключевой кадр, без декодирования GOP. Чёрная перебивка почти всегда
+    начинается со смены сцены, на которую кодер ставит ключевой кадр; чёрный участок целиком
+    внутри GOP этот проход пропустит."""
+    is_black = _BlackTest(pixel_threshold, picture_ratio)
+    times = keyframes.pts
+    windows = []
+    with METRICS.timer("prefilter_keyframes"), lease_capture(video, 0.0) as handle:
+        frame = None
+        for k, seconds in enumerate(times):
+            if should_stop is not None and should_stop():
+                break
+            # Мимо CaptureHandle.seek: тот дошёл бы до ключевого кадра grab(), декодируя весь GOP
+            handle.cap.set(cv2.CAP_PROP_POS_MSEC, float(seconds) * 1000)
+            handle.invalidate()
+            ret, frame = handle.read(frame)
+            if not ret:
+                break
+            METRICS.count("prefilter_keyframes_read")
+            if is_black(frame):
+                windows.append((float(times[k - 1]) if k else 0.0,
+                                float(times[k + 1]) if k + 1 < len(times) else float(seconds) + 10.0))
+    return merge_intervals(windows)
+
+
+def audio_rms_db(video_path, window=0.05, rate=AUDIO_RATE) -> Optional[np.ndarray]:
+    """RMS звука в dBFS по окнам window секунд; None, если ffmpeg нет или звук не декодируется."""
+    ffmpeg = shutil.which("ffmpeg")
+    if ffmpeg is None:
+        logger.warning("ffmpeg not found, prefilter works without audio")
+        return None
+
+    command = [ffmpeg, "-nostdin", "-v", "error", "-i", video_path,
+               "-map", "0:a:0", "-vn", "-ac", "1", "-ar", str(rate), "-f", "s16le", "-"]
+    with METRICS.timer("prefilter_audio"):
+        process = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if process.returncode != 0 or not process.stdout:
+        logger.warning(f"No audio for prefilter: {process.stderr.decode(errors='replace').strip()}")
+        return None
+
+    samples = np.frombuffer(process.stdout, dtype=np.int16)
+    per_window = max(int(rate * window), 1)
+    usable = len(samples) // per_window * per_window
+    if not usable:
+        return None
+    blocks = samples[:usable].reshape(-1, per_window).astype(np.float32) / 32768.0
+    rms = np.sqrt(np.mean(blocks * blocks, axis=1))
+    return 20 * np.log10(np.maximum(rms, 1e-6))
+
+
+def silence_intervals(rms_db, window=0.05, noise_db=-45.0, min_duration=0.15) -> List[Interval]:
+    return _runs(rms_db <= noise_db, window, min_duration)
+
+
+def find_candidates(video, margin=60.0, step=0.1, audio_window=0.05, noise_db=-45.0,
+                    pair_tolerance=0.5, require_silence=True, should_stop=None) -> Candidates:
+    """Окна [маркер - margin, маркер + margin], где маркер — чёрный участок (рядом с тишиной,
+    если звук есть и require_silence)."""
+    if isinstance(video, VideoSource):
+        duration = video.metadata.duration
+        path = video.path
+    else:
+        with VideoSource(video, max_handles=1) as source:
+            duration = source.metadata.duration
+        path = video
+
+    result = Candidates(duration=duration)
+    rms_db = audio_rms_db(path, window=audio_window)
+    if rms_db is not None:
+        result.silence = silence_intervals(rms_db, window=audio_window, noise_db=noise_db)
+
+    keyframes = video.keyframes if isinstance(video, VideoSource) else None
+    if result.silence is not None and require_silence:
+        # Маркер всё равно должен пересекаться с тишиной — кадры вдали от неё не нужны
+        scan = merge_intervals((max(start - pair_tolerance, 0.0), end + pair_tolerance)
+                               for start, end in result.silence)
+    elif keyframes is not None and len(keyframes):
+        scan = keyframe_windows(video, keyframes, should_stop=should_stop)
+    else:
+        logger.info("Prefilter has neither audio nor a keyframe index, scanning every frame")
+        scan = None
+    result.black = black_intervals(video, step=step, windows=scan, should_stop=should_stop)
+
+    markers = result.black
+    if result.silence is not None and require_silence:
+        silence = IntervalIndex(result.silence)
+        markers = [(start, end) for start, end in markers
+                   if silence.overlapping(start - pair_tolerance, end + pair_tolerance)]
+    result.markers = merge_intervals(markers)
+    result.windows = merge_intervals(
+        (max(start - margin, 0.0), min(end + margin, duration) if duration > 0 else end + margin)
+        for start, end in result.markers
+    )
+
+    METRICS.count("prefilter_markers", len(result.markers))
+    METRICS.gauge("prefilter_coverage", result.coverage)
+    return result
+
+
+def _covered_seconds(index: IntervalIndex, start, end) -> float:
+    return sum(min(index.ends[i], end) - max(index.starts[i], start)
+               for i in index.overlapping(start, end))
+
+
+def recall_report(labels: dict, **options) -> dict:
+    """Полнота предфильтра на размеченных видео: доля рекламных секунд и сегментов, попавших в
+    окна, и доля видео, которую придётся анализировать плотно."""
+    videos = {}
+    total = {"ad_seconds": 0.0, "covered_seconds": 0.0, "segments": 0, "segments_hit": 0,
+             "duration": 0.0, "window_seconds": 0.0}
+    for video_path, segments in labels.items():
+        candidates = find_candidates(video_path, **options)
+        index = candidates.index()
+        ad_seconds = sum(end - start for start, end in segments)
+        covered = sum(_covered_seconds(index, start, end) for start, end in segments)
+        hit = sum(1 for start, end in segments if index.overlapping(start, end))
+        stats = {
+            "ad_seconds": ad_seconds,
+            "covered_seconds": covered,
+            "segments": len(segments),
+            "segments_hit": hit,
+            "duration": candidates.duration,
+            "window_seconds": candidates.coverage * candidates.duration,
+        }
+        for key, value in stats.items():
+            total[key] += value
+        videos[video_path] = dict(
+            stats,
+            seconds_recall=covered / ad_seconds if ad_seconds else None,
+            segment_recall=hit / len(segments) if segments else None,
+            coverage=candidates.coverage,
+            audio=candidates.silence is not None,
+            candidates=asdict(candidates),
+        )
+
+    total["seconds_recall"] = total["covered_seconds"] / total["ad_seconds"] if total["ad_seconds"] else None
+    total["segment_recall"] = total["segments_hit"] / total["segments"] if total["segments"] else None
+    total["coverage"] = total["window_seconds"] / total["duration"] if total["duration"] else None
+    return {"options": options, "total": total, "videos": videos}
+
+
+def _ratio(value):
+    return "n/a" if value is None else f"{value:.3f}"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Black-frame/silence prefilter for ad breaks")
+    sub = parser.add_subparsers(dest="command", required=True)
+    recall = sub.add_parser("recall", help="report prefilter recall on labeled videos")
+    recall.add_argument("labels", help='JSON: {"video.mp4": [[start, end], ...], ...}')
+    recall.add_argument("--margin", type=float, default=60.0, help="seconds around each marker")
+    recall.add_argument("--step", type=float, default=0.1, help="video sampling step, seconds")
+    recall.add_argument("--noise-db", type=float, default=-45.0, help="silence threshold, dBFS")
+    recall.add_argument("--no-require-silence", action="store_true",
+                        help="use black frames as markers even without a nearby audio dip")
+    recall.add_argument("--output", help="write the full report as JSON")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    with open(args.labels, encoding="utf-8") as f:
+        labels = json.load(f)
+    report = recall_report(labels, margin=args.margin, step=args.step, noise_db=args.noise_db,
+                           require_silence=not args.no_require_silence)
+
+    for video_path, stats in report["videos"].items():
+        print(f"{video_path}: seconds recall {_ratio(stats['seconds_recall'])}, "
+              f"segment recall {_ratio(stats['segment_recall'])}, coverage {_ratio(stats['coverage'])}"
+              + ("" if stats["audio"] else " (no audio)"))
+    total = report["total"]
+    print(f"TOTAL: seconds recall {_ratio(total['seconds_recall'])}, "
+          f"segment recall {_ratio(total['segment_recall'])}, coverage {_ratio(total['coverage'])}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
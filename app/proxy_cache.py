@@ -0,0 +1,236 @@
+"""Кэш прокси-кадров: видео, один раз декодированное с частотой выборки в разрешении модели.
+
+Прокси — uint8 RGB-кадры 224×224 с шагом 1/fps секунд (по умолчанию 4 кадра в секунду)
+в .npy, открываемом через memmap, плюс массив времён кадров. Повторный анализ того же файла
+(другие пороги, модель, параметры детектора сцен) ищет сцены и классифицирует кадры прямо
+из прокси, не декодируя видео. Размер кэша ограничен: при переполнении удаляются прокси,
+которые дольше всего не открывались.
+
+Каталог — ~/.ad_detector/proxies (или AD_DETECTOR_PROXY_DIR), предел — AD_DETECTOR_PROXY_CACHE_GB.
+Час видео при 4 кадрах в секунду занимает около 2,2 ГБ.
+"""
+import json
+import logging
+import os
+import shutil
+import time
+from typing import List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from catalog import file_fingerprint
+from metrics import METRICS
+from video_source import lease_capture
+
+logger = logging.getLogger(__name__)
+
+PROXY_DIR_ENV = "AD_DETECTOR_PROXY_DIR"
+PROXY_LIMIT_ENV = "AD_DETECTOR_PROXY_CACHE_GB"
+DEFAULT_PROXY_DIR = os.path.join(os.path.expanduser("~"), ".ad_detector", "proxies")
+DEFAULT_LIMIT_GB = 20.0
+# Размер входа модели (buffers.INPUT_SIZE); buffers не импортируем, чтобы не тянуть torch
+PROXY_SIZE = 224
+
+FRAMES_FILE = "frames.npy"
+TIMES_FILE = "times.npy"
+META_FILE = "meta.json"
+
+
+class Proxy:
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, META_FILE), encoding="utf-8") as f:
+            self.meta = json.load(f)
+        self.fps = self.meta["fps"]
+        self.times = np.load(os.path.join(directory, TIMES_FILE))
+        # copy-on-write: кадры можно отдавать в torch.from_numpy, файл при этом не меняется
+        self.frames = np.load(os.path.join(directory, FRAMES_FILE), mmap_mode="c")[:len(self.times)]
+
+    def __len__(self):
+        return len(self.times)
+
+    def index_of(self, seconds) -> int:
+        i = int(np.searchsorted(self.times, seconds))
+        if i > 0 and (i == len(self.times) or seconds - self.times[i - 1] <= self.times[i] - seconds):
+            i -= 1
+        return i
+
+    def iter_frames(self, times, should_stop=None):
+        """(время, RGB-кадр 224×224) ближайших к times кадров прокси."""
+        for current_time in times:
+            if should_stop is not None and should_stop():
+                break
+            if not len(self.times) or current_time > self.times[-1] + 1.0 / self.fps:
+                break
+            METRICS.count("proxy_frames_read")
+            yield current_time, self.frames[self.index_of(current_time)]
+
+    def capture(self) -> "ProxyCapture":
+        return ProxyCapture(self)
+
+
+class ProxyCapture:
+    """Минимальный cv2.VideoCapture поверх прокси для scenedetect VideoCaptureAdapter."""
+
+    def __init__(self, proxy: Proxy):
+        self.proxy = proxy
+        self.position = 0
+        self._bgr = np.empty((PROXY_SIZE, PROXY_SIZE, 3), dtype=np.uint8)
+
+    def isOpened(self):
+        return True
+
+    def grab(self):
+        if self.position >= len(self.proxy):
+            return False
+        self.position += 1
+        return True
+
+    def retrieve(self, image=None):
+        if self.position == 0:
+            return False, None
+        cv2.cvtColor(self.proxy.frames[self.position - 1], cv2.COLOR_RGB2BGR, dst=self._bgr)
+        return True, self._bgr
+
+    def read(self, image=None):
+        return self.retrieve(image) if self.grab() else (False, None)
+
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_FPS:
+            return self.proxy.fps
+        if prop in (cv2.CAP_PROP_FRAME_WIDTH, cv2.CAP_PROP_FRAME_HEIGHT):
+            return PROXY_SIZE
+        if prop == cv2.CAP_PROP_FRAME_COUNT:
+            return len(self.proxy)
+        if prop == cv2.CAP_PROP_POS_FRAMES:
+            return self.position
+        if prop == cv2.CAP_PROP_POS_MSEC:
+            return float(self.proxy.times[self.position - 1]) * 1000 if self.position else 0.0
+        return 0.0
+
+    def release(self):
+        pass
+
+
+def build_proxy(source, directory, fps=4.0, should_stop=None) -> Optional[Proxy]:
+    """Декодирует source (VideoSource) в прокси в directory; None, если анализ остановили."""
+    count = int(source.metadata.duration * fps) + 1
+    tmp_dir = f"{directory}.tmp-{os.getpid()}"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    try:
+        frames = np.lib.format.open_memmap(os.path.join(tmp_dir, FRAMES_FILE), mode="w+", dtype=np.uint8,
+                                           shape=(count, PROXY_SIZE, PROXY_SIZE, 3))
+        resized = np.empty((PROXY_SIZE, PROXY_SIZE, 3), dtype=np.uint8)
+        times = []
+        with METRICS.timer("proxy_build"), lease_capture(source, 0.0) as handle:
+            frame = None
+            for i in range(count):
+                if should_stop is not None and should_stop():
+                    return None
+                if not handle.seek(i / fps):
+                    break
+                ret, frame = handle.read(frame)
+                if not ret:
+                    break
+                cv2.resize(frame, (PROXY_SIZE, PROXY_SIZE), dst=resized, interpolation=cv2.INTER_AREA)
+                cv2.cvtColor(resized, cv2.COLOR_BGR2RGB, dst=frames[len(times)])
+                times.append(i / fps)
+        frames.flush()
+        del frames
+        METRICS.count("proxy_frames_written", len(times))
+
+        np.save(os.path.join(tmp_dir, TIMES_FILE), np.array(times, dtype=np.float64))
+        with open(os.path.join(tmp_dir, META_FILE), "w", encoding="utf-8") as f:
+            json.dump({"fps": fps, "size": PROXY_SIZE, "source": os.path.abspath(source.path),
+                       "created_at": time.time()}, f)
+        shutil.rmtree(directory, ignore_errors=True)
+        os.replace(tmp_dir, directory)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return Proxy(directory)
+
+
+def _dir_size(directory) -> int:
+    total = 0
+    for name in os.listdir(directory):
+        try:
+            total += os.path.getsize(os.path.join(directory, name))
+        except OSError:
+            pass
+    return total
+
+
+class ProxyCache:
+    def __init__(self, root=None, max_bytes=None):
+        self.root = root or os.environ.get(PROXY_DIR_ENV) or DEFAULT_PROXY_DIR
+        if max_bytes is None:
+            max_bytes = float(os.environ.get(PROXY_LIMIT_ENV) or DEFAULT_LIMIT_GB) * 1024 ** 3
+        self.max_bytes = int(max_bytes)
+
+    def path(self, fingerprint) -> str:
+        return os.path.join(self.root, fingerprint)
+
+    def get(self, fingerprint, fps) -> Optional[Proxy]:
+        directory = self.path(fingerprint)
+        meta_path = os.path.join(directory, META_FILE)
+        if not os.path.exists(meta_path):
+            return None
+        try:
+            proxy = Proxy(directory)
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Dropping unreadable proxy {directory}: {e}")
+            shutil.rmtree(directory, ignore_errors=True)
+            return None
+        if proxy.fps != fps:
+            return None
+        # Время последнего использования для LRU — mtime meta.json
+        os.utime(meta_path)
+        METRICS.count("proxy_hits")
+        return proxy
+
+    def get_or_build(self, source, fps=4.0, fingerprint=None, should_stop=None) -> Optional[Proxy]:
+        fingerprint = fingerprint or file_fingerprint(source.path)
+        proxy = self.get(fingerprint, fps)
+        if proxy is not None:
+            return proxy
+        estimate = (int(source.metadata.duration * fps) + 1) * PROXY_SIZE * PROXY_SIZE * 3
+        if estimate > self.max_bytes:
+            logger.info(f"Proxy of {source.path} ({estimate / 1024 ** 3:.1f} GB) exceeds the cache limit")
+            return None
+        self.evict(reserve=estimate, keep=fingerprint)
+        os.makedirs(self.root, exist_ok=True)
+        logger.info(f"Building proxy of {source.path} at {fps} fps")
+        return build_proxy(source, self.path(fingerprint), fps, should_stop)
+
+    def entries(self) -> List[Tuple[float, int, str]]:
+        """(время последнего использования, байт, каталог) всех прокси, старые первыми."""
+        if not os.path.isdir(self.root):
+            return []
+        result = []
+        for name in os.listdir(self.root):
+            directory = os.path.join(self.root, name)
+            meta_path = os.path.join(directory, META_FILE)
+            if not os.path.exists(meta_path):
+                continue
+            result.append((os.path.getmtime(meta_path), _dir_size(directory), directory))
+        return sorted(result)
+
+    def evict(self, reserve=0, keep=None) -> int:
+        """Удаляет давно не использованные прокси, пока кэш с reserve байт не влезет в предел."""
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for _, size, directory in entries:
+            if total + reserve <= self.max_bytes:
+                break
+            if keep is not None and os.path.basename(directory) == keep:
+                continue
+            shutil.rmtree(directory, ignore_errors=True)
+            total -= size
+            removed += 1
+            logger.info(f"Evicted proxy {directory}")
+        if removed:
+            METRICS.count("proxy_evictions", removed)
+        return removed
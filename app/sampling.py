@@ -0,0 +1,71 @@
+import random
+
+
+def sample_times(start_time, end_time, frame_interval=0.5):
+    current_time = start_time
+    while current_time <= end_time:
+        yield current_time
+        current_time += frame_interval
+
+
+def count_samples(start_time, end_time, frame_interval=0.5):
+    if end_time < start_time:
+        return 0
+    return int((end_time - start_time) / frame_interval) + 1
+
+
+def distinct_frames(start_time, end_time, fps) -> int:
+    """Сколько разных кадров видео с частотой fps попадает в [start_time, end_time]."""
+    return int(round(end_time * fps)) - int(round(start_time * fps)) + 1
+
+
+def budget_samples(start_time, end_time, frame_interval=0.5, min_samples=None, max_samples=None, fps=None):
+    """Число кадров сцены: count_samples, ограниченное бюджетом [min_samples, max_samples]
+    и (если известна fps) числом разных кадров сцены."""
+    count = count_samples(start_time, end_time, frame_interval)
+    if count == 0:
+        return 0
+    if min_samples is not None:
+        count = max(count, min_samples)
+    if max_samples is not None:
+        count = min(count, max_samples)
+    if fps:
+        count = min(count, max(distinct_frames(start_time, end_time, fps), 1))
+    return count
+
+
+def _unique_frames(times, fps):
+    # Два момента выборки на одном кадре декодировали бы его дважды и дважды учли бы в проценте
+    seen = set()
+    result = []
+    for current_time in times:
+        key = int(round(current_time * fps)) if fps else current_time
+        if key not in seen:
+            seen.add(key)
+            result.append(current_time)
+    return result
+
+
+def scene_sample_times(start_time, end_time, frame_interval=0.5, min_samples=None, max_samples=None, fps=None):
+    """Моменты выборки кадров сцены с бюджетом кадров.
+
+    Если шаг frame_interval укладывается в бюджет, выборка прежняя (sample_times). Иначе сцена
+    делится на равные страты по числу кадров и из каждой берётся один кадр со сдвигом внутри
+    страты: длинная сцена покрывается целиком за max_samples кадров, короткая получает хотя бы
+    min_samples кадров. Сдвиги зависят только от границ сцены, так что повтор анализа (и повтор
+    той же рекламы для ad_index) выбирает те же кадры.
+
+    fps — частота кадров источника: кадров не больше, чем разных кадров в сцене, и моменты,
+    попадающие на один кадр, схлопываются (без fps — только совпадающие моменты)."""
+    count = budget_samples(start_time, end_time, frame_interval, min_samples, max_samples, fps)
+    if count == count_samples(start_time, end_time, frame_interval):
+        return _unique_frames(sample_times(start_time, end_time, frame_interval), fps)
+    if fps:
+        first = int(round(start_time * fps))
+        if count >= distinct_frames(start_time, end_time, fps):
+            # Бюджет не меньше числа кадров сцены — берём каждый кадр; крайние кадры ближе всего
+            # к границам сцены, но их время может выйти за границы — прижимаем его к ним
+            return [min(max((first + k) / fps, start_time), end_time) for k in range(count)]
+    stratum = (end_time - start_time) / count
+    rng = random.Random(f"{start_time:.3f}-{end_time:.3f}")
+    return _unique_frames([start_time + (k + rng.random()) * stratum for k in range(count)], fps)
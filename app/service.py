@@ -0,0 +1,415 @@
+"""Локальный сервис анализа: модель грузится один раз на хост, кадры всех активных задач
+склеиваются в общие батчи.
+
+    python service.py --host 0.0.0.0 --port 8765 [--media-root /mnt/recordings]
+
+API (JSON):
+    POST   /jobs                      {"path": "...", "settings": {...}} — видео на диске сервера;
+                                      только внутри --media-root, без него задачи по пути запрещены
+    POST   /jobs?filename=a.mp4       тело запроса — сам файл (application/octet-stream)
+    GET    /jobs/<id>                 статус и итоговые сегменты
+    GET    /jobs/<id>/events          NDJSON-поток: scenes, progress, scene, done | error | cancelled
+    DELETE /jobs/<id>                 остановить задачу
+    GET    /health
+"""
+import argparse
+import json
+import logging
+import os
+import queue
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import fields
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import torch
+
+import model_loader
+from analysis import AnalysisSettings, analyze_video
+from metrics import METRICS
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+MAX_FINISHED_JOBS = 1000
+UPLOAD_CHUNK = 1 << 20
+
+
+class InferenceBatcher:
+    """Ведёт себя как модель: model(batch) -> logits. Запросы из разных потоков и задач
+    собираются в один forward, пока не наберётся max_batch кадров или не пройдёт max_wait."""
+
+    def __init__(self, model, max_batch=32, max_wait=0.01):
+        self.model = model
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._requests = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="inference-batcher", daemon=True)
+        self._thread.start()
+
+    def __call__(self, batch):
+        request = {"input": batch, "done": threading.Event(), "output": None, "error": None}
+        self._requests.put(request)
+        request["done"].wait()
+        if request["error"] is not None:
+            raise request["error"]
+        return request["output"]
+
+    def _collect(self):
+        pending = [self._requests.get()]
+        rows = pending[0]["input"].shape[0]
+        deadline = time.monotonic() + self.max_wait
+        while rows < self.max_batch:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                request = self._requests.get(timeout=timeout)
+            except queue.Empty:
+                break
+            pending.append(request)
+            rows += request["input"].shape[0]
+        return pending, rows
+
+    def _run(self):
+        while True:
+            pending, rows = self._collect()
+            METRICS.gauge("batcher_queue_depth", self._requests.qsize())
+            try:
+                with METRICS.timer("shared_forward"), torch.no_grad():
+                    outputs = self.model(torch.cat([request["input"] for request in pending]))
+                METRICS.count("shared_batches")
+                METRICS.count("shared_batch_rows", rows)
+                offset = 0
+                for request in pending:
+                    size = request["input"].shape[0]
+                    request["output"] = outputs[offset:offset + size]
+                    offset += size
+            except Exception as e:
+                for request in pending:
+                    request["error"] = e
+            finally:
+                for request in pending:
+                    request["done"].set()
+
+
+class Job:
+    def __init__(self, video_path, settings, cleanup_path=None):
+        self.id = uuid.uuid4().hex
+        self.video_path = video_path
+        self.settings = settings
+        self.cleanup_path = cleanup_path
+        self.status = "pending"
+        self.events = []
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self._running = True
+        self._cond = threading.Condition()
+
+    @property
+    def finished(self):
+        return self.status in ("done", "failed", "cancelled")
+
+    def stop(self):
+        self._running = False
+
+    def should_stop(self):
+        return not self._running
+
+    def emit(self, event):
+        with self._cond:
+            self.events.append(event)
+            self._cond.notify_all()
+
+    def finish(self, status, event):
+        # Статус и последнее событие меняются под одной блокировкой, чтобы поток событий не оборвался раньше
+        with self._cond:
+            self.status = status
+            self.finished_at = time.time()
+            self.events.append(event)
+            self._cond.notify_all()
+
+    def iter_events(self, timeout=15.0):
+        # Отдаём события по мере появления; None — keep-alive, если долго нет новых
+        index = 0
+        while True:
+            with self._cond:
+                if index >= len(self.events) and not self.finished:
+                    self._cond.wait(timeout)
+                batch = self.events[index:]
+                finished = self.finished
+            index += len(batch)
+            if not batch:
+                if finished:
+                    return
+                yield None
+            for event in batch:
+                yield event
+
+    def to_dict(self):
+        info = {
+            "id": self.id,
+            "status": self.status,
+            "video": os.path.basename(self.video_path),
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+            "error": self.error,
+        }
+        if self.result is not None:
+            info["scenes"] = self.result.scenes
+            info["scores"] = self.result.scores
+            info["segments"] = self.result.segments
+            info["metrics"] = self.result.metrics
+        return info
+
+
+class AnalysisService:
+    def __init__(self, model, max_jobs=4, upload_dir=None, media_root=None):
+        self.model = model
+        self.media_root = os.path.realpath(media_root) if media_root else None
+        self.upload_dir = upload_dir or tempfile.mkdtemp(prefix="ad_detector_uploads_")
+        self.jobs = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_jobs, thread_name_prefix="analysis-job")
+
+    def submit(self, video_path, settings, cleanup_path=None):
+        job = Job(video_path, settings, cleanup_path)
+        with self._lock:
+            self.jobs[job.id] = job
+            self._forget_old_jobs()
+        self._executor.submit(self._run, job)
+        return job
+
+    def resolve_path(self, video_path):
+        """Путь к видео на сервере, если он внутри media_root; иначе PermissionError."""
+        if self.media_root is None:
+            raise PermissionError("Jobs by server path are disabled, upload the file instead")
+        # realpath раскрывает .. и симлинки, чтобы нельзя было выйти за пределы каталога
+        path = os.path.realpath(os.path.join(self.media_root, video_path))
+        if os.path.commonpath([path, self.media_root]) != self.media_root:
+            raise PermissionError("Path is outside of the media root")
+        return path
+
+    def get(self, job_id):
+        with self._lock:
+            return self.jobs.get(job_id)
+
+    def _forget_old_jobs(self):
+        finished = [job for job in self.jobs.values() if job.finished]
+        for job in sorted(finished, key=lambda j: j.finished_at or 0)[:max(len(finished) - MAX_FINISHED_JOBS, 0)]:
+            del self.jobs[job.id]
+
+    def _run(self, job):
+        if job.should_stop():
+            job.finish("cancelled", {"type": "cancelled"})
+            return
+
+        job.status = "running"
+        scenes = []
+        frames_done = 0
+        last_progress = 0.0
+        progress_lock = threading.Lock()
+
+        def on_scenes(detected, frame_counts):
+            scenes.extend(detected)
+            job.emit({"type": "scenes", "scenes": detected, "frame_counts": frame_counts})
+
+        def on_scene(index, score):
+            start, end = scenes[index]
+            job.emit({"type": "scene", "index": index, "start": start, "end": end, "score": score})
+
+        def on_frame(count):
+            nonlocal frames_done, last_progress
+            with progress_lock:
+                frames_done += count
+                now = time.monotonic()
+                if now - last_progress < 0.5:
+                    return
+                last_progress = now
+            job.emit({"type": "progress", "frames_done": frames_done})
+
+        try:
+            job.result = analyze_video(job.video_path, self.model, job.settings,
+                                       should_stop=job.should_stop, on_scenes=on_scenes,
+                                       on_scene=on_scene, on_frame=on_frame)
+            if job.should_stop():
+                job.finish("cancelled", {"type": "cancelled"})
+            else:
+                job.finish("done", {"type": "done", "scores": job.result.scores,
+                                    "segments": job.result.segments, "metrics": job.result.metrics})
+        except Exception as e:
+            logger.exception(f"Job {job.id} failed")
+            job.error = str(e)
+            job.finish("failed", {"type": "error", "message": str(e)})
+        finally:
+            if job.cleanup_path:
+                try:
+                    os.remove(job.cleanup_path)
+                except OSError:
+                    pass
+
+
+def parse_settings(raw):
+    allowed = {f.name for f in fields(AnalysisSettings)}
+    unknown = set(raw or {}) - allowed
+    if unknown:
+        raise ValueError(f"Unknown settings: {', '.join(sorted(unknown))}")
+    return AnalysisSettings(**(raw or {}))
+
+
+class ServiceHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    service: AnalysisService = None
+
+    def log_message(self, format, *args):
+        logger.info("%s %s", self.address_string(), format % args)
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _job_from_path(self, parts):
+        job = self.service.get(parts[1]) if len(parts) >= 2 else None
+        if job is None:
+            self._send_json(HTTPStatus.NOT_FOUND, {"error": "job not found"})
+        return job
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        parts = [p for p in url.path.split("/") if p]
+        if parts == ["health"]:
+            self._send_json(HTTPStatus.OK, {"status": "ok", "jobs": len(self.service.jobs)})
+        elif len(parts) == 2 and parts[0] == "jobs":
+            job = self._job_from_path(parts)
+            if job is not None:
+                self._send_json(HTTPStatus.OK, job.to_dict())
+        elif len(parts) == 3 and parts[0] == "jobs" and parts[2] == "events":
+            job = self._job_from_path(parts)
+            if job is not None:
+                self._stream_events(job)
+        else:
+            self._send_json(HTTPStatus.NOT_FOUND, {"error": "not found"})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path.rstrip("/") != "/jobs":
+            self._send_json(HTTPStatus.NOT_FOUND, {"error": "not found"})
+            return
+
+        query = parse_qs(url.query)
+        content_type = self.headers.get("Content-Type", "")
+        try:
+            if content_type.startswith("application/json"):
+                payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                settings = parse_settings(payload.get("settings"))
+                if not payload.get("path"):
+                    raise ValueError("Video path is required")
+                video_path = self.service.resolve_path(payload["path"])
+                if not os.path.isfile(video_path):
+                    raise ValueError(f"Video not found on server: {payload['path']}")
+                job = self.service.submit(video_path, settings)
+            else:
+                settings = parse_settings(json.loads(query.get("settings", ["{}"])[0]))
+                filename = os.path.basename(query.get("filename", ["upload.mp4"])[0])
+                video_path = self._save_upload(filename)
+                job = self.service.submit(video_path, settings, cleanup_path=video_path)
+        except PermissionError as e:
+            self._send_json(HTTPStatus.FORBIDDEN, {"error": str(e)})
+            return
+        except (ValueError, TypeError) as e:
+            self._send_json(HTTPStatus.BAD_REQUEST, {"error": str(e)})
+            return
+        self._send_json(HTTPStatus.ACCEPTED, job.to_dict())
+
+    def do_DELETE(self):
+        parts = [p for p in urlparse(self.path).path.split("/") if p]
+        if len(parts) != 2 or parts[0] != "jobs":
+            self._send_json(HTTPStatus.NOT_FOUND, {"error": "not found"})
+            return
+        job = self._job_from_path(parts)
+        if job is not None:
+            job.stop()
+            self._send_json(HTTPStatus.OK, job.to_dict())
+
+    def _save_upload(self, filename):
+        length = self.headers.get("Content-Length")
+        if length is None:
+            raise ValueError("Content-Length is required for uploads")
+        remaining = int(length)
+        fd, path = tempfile.mkstemp(prefix="job_", suffix="_" + filename, dir=self.service.upload_dir)
+        with os.fdopen(fd, "wb") as f:
+            while remaining > 0:
+                chunk = self.rfile.read(min(UPLOAD_CHUNK, remaining))
+                if not chunk:
+                    break
+                f.write(chunk)
+                remaining -= len(chunk)
+        if remaining:
+            os.remove(path)
+            raise ValueError("Upload was truncated")
+        return path
+
+    def _stream_events(self, job):
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            for event in job.iter_events():
+                line = b"\n" if event is None else json.dumps(event, ensure_ascii=False).encode("utf-8") + b"\n"
+                self.wfile.write(f"{len(line):X}\r\n".encode("ascii") + line + b"\r\n")
+                self.wfile.flush()
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            logger.info(f"Event stream of job {job.id} closed by client")
+
+
+def serve(host="127.0.0.1", port=8765, max_jobs=4, max_batch=32, max_wait_ms=10.0, model_name="Swin",
+          media_root=None):
+    model = model_loader.load_model(model_name)
+    if model is None:
+        raise RuntimeError(f"Failed to load model {model_name}")
+    batcher = InferenceBatcher(model, max_batch=max_batch, max_wait=max_wait_ms / 1000)
+    service = AnalysisService(batcher, max_jobs=max_jobs, media_root=media_root)
+    handler = type("BoundServiceHandler", (ServiceHandler,), {"service": service})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    logger.info(f"Analysis service listening on http://{host}:{port}")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        shutil.rmtree(service.upload_dir, ignore_errors=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local ad detection service with cross-request batching")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--max-jobs", type=int, default=4, help="analyses running at the same time")
+    parser.add_argument("--max-batch", type=int, default=32, help="frames per shared forward pass")
+    parser.add_argument("--max-wait-ms", type=float, default=10.0,
+                        help="how long the batcher waits to fill a batch")
+    parser.add_argument("--media-root",
+                        help="directory whose videos may be analyzed by server path; without it only uploads work")
+    args = parser.parse_args(argv)
+    serve(args.host, args.port, args.max_jobs, args.max_batch, args.max_wait_ms, media_root=args.media_root)
+
+
+if __name__ == "__main__":
+    main()
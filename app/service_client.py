@@ -0,0 +1,132 @@
+import http.client
+import json
+import os
+from dataclasses import asdict
+from typing import Callable, List, Optional
+from urllib.parse import quote, urlencode, urlparse
+
+from analysis import AnalysisResult, AnalysisSettings, Scene
+
+SERVICE_URL_ENV = "AD_DETECTOR_SERVICE_URL"
+# Если сервис видит те же пути (общий диск), файл не загружается, передаётся только путь;
+# сервис принимает его, только если файл внутри его --media-root
+SERVICE_SEND_PATH_ENV = "AD_DETECTOR_SERVICE_SEND_PATH"
+
+
+def service_url() -> Optional[str]:
+    return os.environ.get(SERVICE_URL_ENV) or None
+
+
+class ServiceClient:
+    def __init__(self, base_url: str, timeout: float = 60.0):
+        url = urlparse(base_url)
+        self.host = url.hostname
+        self.port = url.port or 80
+        self.timeout = timeout
+
+    def _connection(self):
+        return http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+    def _request_json(self, method, path, body=None, headers=None):
+        conn = self._connection()
+        try:
+            conn.request(method, path, body=body, headers=headers or {})
+            response = conn.getresponse()
+            payload = json.loads(response.read() or b"{}")
+            if response.status >= 400:
+                raise RuntimeError(f"Analysis service error {response.status}: {payload.get('error')}")
+            return payload
+        finally:
+            conn.close()
+
+    def submit(self, video_path: str, settings: AnalysisSettings, send_path: bool = False) -> str:
+        settings_json = json.dumps(asdict(settings))
+        if send_path:
+            body = json.dumps({"path": os.path.abspath(video_path), "settings": asdict(settings)})
+            job = self._request_json("POST", "/jobs", body.encode("utf-8"),
+                                     {"Content-Type": "application/json"})
+        else:
+            query = urlencode({"filename": os.path.basename(video_path), "settings": settings_json})
+            with open(video_path, "rb") as f:
+                job = self._request_json("POST", f"/jobs?{query}", f, {
+                    "Content-Type": "application/octet-stream",
+                    "Content-Length": str(os.path.getsize(video_path)),
+                })
+        return job["id"]
+
+    def cancel(self, job_id: str):
+        self._request_json("DELETE", f"/jobs/{quote(job_id)}")
+
+    def events(self, job_id: str):
+        conn = self._connection()
+        try:
+            conn.request("GET", f"/jobs/{quote(job_id)}/events")
+            response = conn.getresponse()
+            if response.status >= 400:
+                raise RuntimeError(f"Analysis service error {response.status}")
+            while True:
+                line = response.readline()
+                if not line:
+                    return
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+        finally:
+            conn.close()
+
+
+def analyze_remote(
+        video_path: str,
+        settings: Optional[AnalysisSettings] = None,
+        base_url: Optional[str] = None,
+        should_stop: Optional[Callable[[], bool]] = None,
+        on_scenes: Optional[Callable[[List[Scene], List[int]], None]] = None,
+        on_scene: Optional[Callable[[int, float], None]] = None,
+        on_frame: Optional[Callable[[int], None]] = None
+) -> AnalysisResult:
+    """То же, что analysis.analyze_video, но анализ выполняет сервис (см. service.py).
+
+    Если поток событий оборвался до done (обрыв связи, перезапуск или отмена задачи на сервисе),
+    бросает RuntimeError; при остановке через should_stop возвращает результат с completed=False."""
+    settings = settings or AnalysisSettings()
+    client = ServiceClient(base_url or service_url())
+    job_id = client.submit(video_path, settings, send_path=bool(os.environ.get(SERVICE_SEND_PATH_ENV)))
+
+    result = AnalysisResult()
+    frames_reported = 0
+    stopped = False
+    for event in client.events(job_id):
+        if should_stop is not None and should_stop():
+            client.cancel(job_id)
+            stopped = True
+            break
+
+        kind = event["type"]
+        if kind == "scenes":
+            result.scenes = [tuple(scene) for scene in event["scenes"]]
+            result.scores = [None] * len(result.scenes)
+            if on_scenes is not None:
+                on_scenes(result.scenes, event["frame_counts"])
+        elif kind == "scene":
+            result.scores[event["index"]] = event["score"]
+            if on_scene is not None:
+                on_scene(event["index"], event["score"])
+        elif kind == "progress":
+            if on_frame is not None:
+                on_frame(event["frames_done"] - frames_reported)
+            frames_reported = event["frames_done"]
+        elif kind == "done":
+            if "scores" in event:
+                result.scores = event["scores"]
+            result.segments = [tuple(segment) for segment in event["segments"]]
+            result.metrics = event.get("metrics", {})
+            result.completed = True
+            break
+        elif kind == "error":
+            raise RuntimeError(f"Remote analysis failed: {event['message']}")
+        elif kind == "cancelled":
+            break
+
+    if not result.completed and not stopped and not (should_stop is not None and should_stop()):
+        raise RuntimeError("Remote analysis ended before completion")
+    return result
@@ -0,0 +1,58 @@
+import cv2
+import numpy as np
+
+
+def generate_synthetic_video(path, width=640, height=360, duration=60.0, fps=25.0,
+                             cut_every=5.0, codec="mp4v", seed=0):
+    """Пишет детерминированное видео: каждые cut_every секунд новый "план" с другой
+    цветовой гаммой (жёсткая склейка), внутри плана движется прямоугольник.
+
+    Возвращает описание ролика, включая времена склеек, для сверки с detect_scenes.
+    """
+    rng = np.random.RandomState(seed)
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*codec), fps, (width, height))
+    if not writer.isOpened():
+        raise RuntimeError(f"VideoWriter cannot encode '{codec}' into {path}")
+
+    total_frames = int(round(duration * fps))
+    frames_per_shot = max(int(round(cut_every * fps)), 1)
+    ramp = np.linspace(0.0, 1.0, width, dtype=np.float32)[None, :, None]
+    box_w, box_h = max(width // 8, 1), max(height // 8, 1)
+
+    frame = np.empty((height, width, 3), dtype=np.uint8)
+    background = None
+    box_color = None
+    box_y = 0
+    cuts = []
+    try:
+        for index in range(total_frames):
+            shot_frame = index % frames_per_shot
+            if shot_frame == 0:
+                base = rng.randint(0, 256, 3).astype(np.float32)
+                accent = rng.randint(0, 256, 3).astype(np.float32)
+                row = (ramp * accent + (1.0 - ramp) * base).astype(np.uint8)
+                background = np.repeat(row, height, axis=0)
+                box_color = rng.randint(0, 256, 3).astype(np.uint8)
+                box_y = rng.randint(0, max(height - box_h, 1))
+                if index:
+                    cuts.append(index / fps)
+
+            frame[:] = background
+            box_x = int(shot_frame / frames_per_shot * max(width - box_w, 1))
+            frame[box_y:box_y + box_h, box_x:box_x + box_w] = box_color
+            writer.write(frame)
+    finally:
+        writer.release()
+
+    return {
+        "path": path,
+        "width": width,
+        "height": height,
+        "fps": fps,
+        "frames": total_frames,
+        "duration": total_frames / fps,
+        "cut_every": cut_every,
+        "codec": codec,
+        "seed": seed,
+        "cuts": cuts,
+    }
@@ -0,0 +1,145 @@
+"""Спрайт-листы миниатюр для превью на таймлайне.
+
+Кадры, которые анализ всё равно декодирует, уменьшаются и складываются в JPEG-листы
+columns×rows плиток; index.json хранит время каждой плитки и её место на листе.
+"""
+import json
+import os
+import threading
+from bisect import bisect_left
+
+import cv2
+import numpy as np
+
+INDEX_FILE = "index.json"
+
+
+class ThumbnailSpriteWriter:
+    def __init__(self, directory, interval=2.0, tile_width=160, columns=10, rows=10, quality=80):
+        self.directory = directory
+        self.interval = interval
+        self.tile_width = tile_width
+        self.tile_height = None
+        self.columns = columns
+        self.rows = rows
+        self.quality = quality
+        # Сцены анализируются параллельно и не по порядку: копим сжатые плитки по "корзинам" времени
+        self._tiles = {}
+        self._lock = threading.Lock()
+
+    def add(self, frame_time, frame):
+        bucket = int(round(frame_time / self.interval))
+        with self._lock:
+            if bucket in self._tiles:
+                return
+            if self.tile_height is None:
+                height, width = frame.shape[:2]
+                self.tile_height = max(int(round(self.tile_width * height / width / 2)) * 2, 2)
+            self._tiles[bucket] = None
+
+        tile = cv2.resize(frame, (self.tile_width, self.tile_height), interpolation=cv2.INTER_AREA)
+        ok, encoded = cv2.imencode(".jpg", tile, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+        with self._lock:
+            if ok:
+                self._tiles[bucket] = (frame_time, encoded)
+            else:
+                del self._tiles[bucket]
+
+    def _previous_tiles(self):
+        # Продолженный анализ (checkpoint.py) декодирует только оставшиеся сцены: плитки
+        # прошлого прогона переносим в новые листы, а не теряем
+        previous = ThumbnailIndex.load(self.directory)
+        if previous is None or (previous.tile_width, previous.tile_height) != (self.tile_width, self.tile_height):
+            return {}
+        sheets = {}
+        tiles = {}
+        for frame_time, (sheet, x, y, width, height) in zip(previous.times, previous.places()):
+            bucket = int(round(frame_time / self.interval))
+            if bucket in self._tiles or bucket in tiles:
+                continue
+            if sheet not in sheets:
+                sheets[sheet] = cv2.imread(sheet, cv2.IMREAD_COLOR)
+            if sheets[sheet] is None:
+                continue
+            ok, encoded = cv2.imencode(".jpg", sheets[sheet][y:y + height, x:x + width],
+                                       [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+            if ok:
+                tiles[bucket] = (frame_time, encoded)
+        return tiles
+
+    def finish(self):
+        with self._lock:
+            if self.tile_height is None:
+                return None
+            tiles = dict(self._previous_tiles())
+            tiles.update((bucket, tile) for bucket, tile in self._tiles.items() if tile is not None)
+        tiles = sorted(tiles.values(), key=lambda tile: tile[0])
+        if not tiles:
+            return None
+
+        os.makedirs(self.directory, exist_ok=True)
+        per_sheet = self.columns * self.rows
+        entries = []
+        sheets = []
+        for sheet_index in range(0, len(tiles), per_sheet):
+            sheet = np.zeros((self.rows * self.tile_height, self.columns * self.tile_width, 3), dtype=np.uint8)
+            name = f"sheet_{sheet_index // per_sheet:04d}.jpg"
+            for i, (frame_time, encoded) in enumerate(tiles[sheet_index:sheet_index + per_sheet]):
+                row, col = divmod(i, self.columns)
+                y, x = row * self.tile_height, col * self.tile_width
+                sheet[y:y + self.tile_height, x:x + self.tile_width] = cv2.imdecode(encoded, cv2.IMREAD_COLOR)
+                entries.append([frame_time, len(sheets), col, row])
+            cv2.imwrite(os.path.join(self.directory, name), sheet, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+            sheets.append(name)
+
+        index = {
+            "interval": self.interval,
+            "tile_width": self.tile_width,
+            "tile_height": self.tile_height,
+            "columns": self.columns,
+            "rows": self.rows,
+            "sheets": sheets,
+            "thumbnails": entries,
+        }
+        tmp_path = os.path.join(self.directory, INDEX_FILE + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(index, f)
+        os.replace(tmp_path, os.path.join(self.directory, INDEX_FILE))
+        return index
+
+
+class ThumbnailIndex:
+    def __init__(self, directory, index):
+        self.directory = directory
+        self.tile_width = index["tile_width"]
+        self.tile_height = index["tile_height"]
+        self.sheets = [os.path.join(directory, name) for name in index["sheets"]]
+        entries = index["thumbnails"]
+        self.times = [entry[0] for entry in entries]
+        self._places = [tuple(entry[1:]) for entry in entries]
+
+    @classmethod
+    def load(cls, directory):
+        path = os.path.join(directory, INDEX_FILE)
+        if not os.path.exists(path):
+            return None
+        with open(path, encoding="utf-8") as f:
+            return cls(directory, json.load(f))
+
+    def __len__(self):
+        return len(self.times)
+
+    def places(self):
+        for sheet, col, row in self._places:
+            yield self.sheets[sheet], col * self.tile_width, row * self.tile_height, self.tile_width, self.tile_height
+
+    def lookup(self, seconds):
+        """(путь к листу, x, y, ширина, высота) ближайшей по времени миниатюры или None."""
+        if not self.times:
+            return None
+        i = bisect_left(self.times, seconds)
+        if i == len(self.times) or (i > 0 and seconds - self.times[i - 1] <= self.times[i] - seconds):
+            i -= 1
+        sheet, col, row = self._places[i]
+        return (self.sheets[sheet], col * self.tile_width, row * self.tile_height,
+                self.tile_width, self.tile_height)
@@ -0,0 +1,245 @@
+"""Общий источник кадров видео: метаданные читаются один раз, открытые cv2.VideoCapture
+переиспользуются между сценами и потоками анализа.
+
+Дескриптор помнит номер кадра, который прочитает следующим. Если нужный кадр недалеко
+впереди, до него доходим grab() вместо seek: seek в ffmpeg откатывается к ключевому кадру
+и декодирует GOP заново. С индексом ключевых кадров (keyframes.py) grab() идёт до кадра
+в том же GOP на любом расстоянии, а дальний seek делается ровно на ключевой кадр, от которого
+до нужного кадра доходим grab(), — без неточного seek по времени внутри GOP.
+"""
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass
+
+import cv2
+import numpy as np
+
+from metrics import METRICS
+
+# Дальше этого (в секундах) дешевле seek, чем пролистывать кадры grab()
+MAX_GRAB_SECONDS = 2.0
+
+
+@dataclass(frozen=True)
+class VideoMetadata:
+    fps: float
+    frame_count: int
+    width: int
+    height: int
+
+    @property
+    def duration(self) -> float:
+        return self.frame_count / self.fps if self.fps > 0 else 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            "duration": self.duration,
+            "fps": self.fps,
+            "frame_count": self.frame_count,
+            "width": self.width,
+            "height": self.height,
+        }
+
+
+def open_capture(video_path):
+    with METRICS.timer("capture_open"):
+        cap = cv2.VideoCapture(video_path)
+    METRICS.count("capture_opens")
+    if not cap.isOpened():
+        cap.release()
+        raise RuntimeError(f"Failed to open video file: {video_path}")
+    return cap
+
+
+class CaptureHandle:
+    def __init__(self, cap, fps, max_grab_frames, keyframes=None):
+        self.cap = cap
+        self.fps = fps
+        self.max_grab_frames = max_grab_frames
+        # Отсортированные номера ключевых кадров или None, если индекса нет
+        self.keyframes = keyframes
+        # None — позиция неизвестна, следующий seek пойдёт через cap.set
+        self.next_frame = 0
+
+    def seek(self, seconds) -> bool:
+        target = int(seconds * self.fps + 0.5)
+        skip = target - self.next_frame if self.next_frame is not None else -1
+        if 0 <= skip and (skip <= self.max_grab_frames or self._same_gop(self.next_frame, target)):
+            return self._grab(skip, target)
+        if self.keyframes is not None and len(self.keyframes):
+            return self._seek_keyframe(target)
+
+        with METRICS.timer("seek"):
+            self.cap.set(cv2.CAP_PROP_POS_MSEC, seconds * 1000)
+        METRICS.count("seeks")
+        self.next_frame = int(self.cap.get(cv2.CAP_PROP_POS_FRAMES))
+        return True
+
+    def _same_gop(self, frame, target) -> bool:
+        # Между frame и target нет ключевого кадра: seek всё равно декодировал бы те же кадры
+        if self.keyframes is None:
+            return False
+        return np.searchsorted(self.keyframes, frame, side="right") == \
+            np.searchsorted(self.keyframes, target, side="right")
+
+    def _grab(self, skip, target) -> bool:
+        with METRICS.timer("grab"):
+            for _ in range(skip):
+                if not self.cap.grab():
+                    self.next_frame = None
+                    return False
+        METRICS.count("frames_grabbed", skip)
+        self.next_frame = target
+        return True
+
+    def _seek_keyframe(self, target) -> bool:
+        i = int(np.searchsorted(self.keyframes, target, side="right")) - 1
+        keyframe = int(self.keyframes[i]) if i >= 0 else 0
+        with METRICS.timer("seek"):
+            self.cap.set(cv2.CAP_PROP_POS_MSEC, keyframe / self.fps * 1000)
+        METRICS.count("keyframe_seeks")
+        self.next_frame = int(self.cap.get(cv2.CAP_PROP_POS_FRAMES))
+        skip = target - self.next_frame
+        if skip < 0:
+            # Контейнер встал дальше ключевого кадра — остаёмся там, как при обычном seek
+            return True
+        return self._grab(skip, target)
+
+    def read(self, image=None):
+        # Та же сигнатура, что у cap.read, чтобы BatchBuffers.read работал с дескриптором
+        ret, frame = self.cap.read(image)
+        if ret and self.next_frame is not None:
+            self.next_frame += 1
+        else:
+            self.next_frame = None
+        return ret, frame
+
+    def invalidate(self):
+        self.next_frame = None
+
+    def release(self):
+        self.cap.release()
+
+
+class VideoSource:
+    """Пул не более max_handles открытых дескрипторов одного видео, выдаваемых через lease()."""
+
+    def __init__(self, video_path, max_handles=4, max_grab_seconds=MAX_GRAB_SECONDS, keyframes=None):
+        self.path = video_path
+        self.max_handles = max(max_handles, 1)
+        self.max_grab_seconds = max_grab_seconds
+        self._idle = []
+        self._opened = 1
+        self._closed = False
+        self._cond = threading.Condition()
+
+        cap = open_capture(video_path)
+        self.metadata = VideoMetadata(
+            fps=cap.get(cv2.CAP_PROP_FPS),
+            frame_count=int(cap.get(cv2.CAP_PROP_FRAME_COUNT)),
+            width=int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+            height=int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+        )
+        self.keyframes = None
+        self._keyframe_frames = None
+        self._idle.append(self._wrap(cap))
+        if keyframes is not None:
+            self.set_keyframes(keyframes)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _wrap(self, cap):
+        return CaptureHandle(cap, self.metadata.fps, int(self.max_grab_seconds * self.metadata.fps),
+                             self._keyframe_frames)
+
+    def set_keyframes(self, keyframes):
+        """Подключает индекс ключевых кадров (keyframes.Keyframes) ко всем дескрипторам."""
+        with self._cond:
+            self.keyframes = keyframes
+            self._keyframe_frames = keyframes.frame_numbers(self.metadata.fps) if self.metadata.fps > 0 else None
+            for handle in self._idle:
+                handle.keyframes = self._keyframe_frames
+
+    @contextmanager
+    def lease(self, seconds=None):
+        """Дескриптор на время блока; seconds — откуда начнётся чтение, чтобы выдать ближайший
+        дескриптор, стоящий до этой точки."""
+        handle = self._acquire(seconds)
+        try:
+            yield handle
+        finally:
+            self._release(handle)
+
+    def _acquire(self, seconds):
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise RuntimeError("VideoSource is closed")
+                if self._idle:
+                    METRICS.count("capture_reuses")
+                    return self._idle.pop(self._pick(seconds))
+                if self._opened < self.max_handles:
+                    self._opened += 1
+                    break
+                with METRICS.timer("capture_lease_wait"):
+                    self._cond.wait()
+
+        try:
+            return self._wrap(open_capture(self.path))
+        except Exception:
+            with self._cond:
+                self._opened -= 1
+                self._cond.notify()
+            raise
+
+    def _pick(self, seconds):
+        if seconds is None:
+            return len(self._idle) - 1
+        target = int(seconds * self.metadata.fps + 0.5)
+        best, best_skip = len(self._idle) - 1, None
+        for i, handle in enumerate(self._idle):
+            if handle.next_frame is None or handle.next_frame > target:
+                continue
+            skip = target - handle.next_frame
+            if best_skip is None or skip < best_skip:
+                best, best_skip = i, skip
+        return best
+
+    def _release(self, handle):
+        with self._cond:
+            if self._closed:
+                handle.release()
+                self._opened -= 1
+            else:
+                # Индекс мог появиться, пока дескриптор был выдан
+                handle.keyframes = self._keyframe_frames
+                self._idle.append(handle)
+            self._cond.notify()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            for handle in self._idle:
+                handle.release()
+            self._opened -= len(self._idle)
+            self._idle.clear()
+            self._cond.notify_all()
+
+
+def source_path(video) -> str:
+    return video.path if isinstance(video, VideoSource) else video
+
+
+@contextmanager
+def lease_capture(video, seconds=None):
+    """Дескриптор из VideoSource или, если передан путь, отдельный capture на время блока."""
+    if isinstance(video, VideoSource):
+        with video.lease(seconds) as handle:
+            yield handle
+    else:
+        with VideoSource(video, max_handles=1) as source, source.lease(seconds) as handle:
+            yield handle
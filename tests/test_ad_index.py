@@ -0,0 +1,79 @@
+import multiprocessing
+import random
+
+import pytest
+
+pytest.importorskip("cv2")
+
+from ad_index import AdIndex, AdMatchSession
+
+
+def scene_hashes(seed, count=4):
+    rng = random.Random(seed)
+    return [rng.getrandbits(64) for _ in range(count)]
+
+
+def test_match_needs_min_matches():
+    index = AdIndex()
+    hashes = scene_hashes(1)
+    scene_id = index.add(hashes, 95.0)
+
+    assert index.match(hashes) == (scene_id, 95.0)
+    # Один бит разницы — тот же кадр после перекодирования
+    assert index.match([value ^ 1 for value in hashes[:3]] + [None]) == (scene_id, 95.0)
+    assert index.match(hashes[:2] + [None, None]) is None
+    assert index.add(hashes[:2], 95.0) is None
+
+
+def test_confirm_adds_only_confident_unmatched_scenes():
+    index = AdIndex()
+    index.add(scene_hashes(1), 90.0)
+    session = AdMatchSession(index)
+    assert session.match(0.0, 10.0, scene_hashes(1)) == 90.0
+    assert session.match(10.0, 20.0, scene_hashes(2)) is None
+    assert session.match(20.0, 30.0, scene_hashes(3)) is None
+    assert session.match(30.0, 40.0, scene_hashes(4)) is None
+
+    scores = {(0.0, 10.0): 90.0, (10.0, 20.0): 85.0, (20.0, 30.0): 60.0, (30.0, 40.0): None}
+    assert session.confirm([(0.0, 10.0), (10.0, 20.0), (20.0, 30.0), (30.0, 40.0)], scores) == 1
+    assert index.scene_count == 2
+
+
+def test_save_keeps_other_writers_scenes(tmp_path):
+    path = str(tmp_path / "ad_index.npz")
+    first = AdIndex.load(path)
+    second = AdIndex.load(path)
+    first.add(scene_hashes(1), 90.0)
+    first.save()
+    second.add(scene_hashes(2), 95.0)
+    second.save()
+
+    merged = AdIndex.load(path)
+    assert merged.scene_count == 2
+    assert merged.match(scene_hashes(1))[1] == 90.0
+    assert merged.match(scene_hashes(2))[1] == 95.0
+    # После записи процесс видит и чужие сцены
+    assert second.match(scene_hashes(1))[1] == 90.0
+
+
+def _add_and_save(path, seeds):
+    index = AdIndex.load(path)
+    for seed in seeds:
+        index.add(scene_hashes(seed), 90.0)
+        index.save()
+
+
+def test_concurrent_workers_lose_nothing(tmp_path):
+    path = str(tmp_path / "ad_index.npz")
+    ctx = multiprocessing.get_context("spawn")
+    procs = [ctx.Process(target=_add_and_save, args=(path, range(worker * 10, worker * 10 + 5)))
+             for worker in range(4)]
+    for proc in procs:
+        proc.start()
+    for proc in procs:
+        proc.join()
+    assert [proc.exitcode for proc in procs] == [0] * 4
+
+    index = AdIndex.load(path)
+    assert index.scene_count == 20
+    assert all(index.match(scene_hashes(worker * 10 + k)) for worker in range(4) for k in range(5))
@@ -0,0 +1,18 @@
+import pytest
+
+for module in ("cv2", "torch", "torchvision", "timm", "scenedetect", "PIL"):
+    pytest.importorskip(module)
+
+from autotune import make_inputs
+from synthetic_video import generate_synthetic_video
+
+
+def test_make_inputs_on_synthetic_video(tmp_path):
+    video_path = str(tmp_path / "autotune.avi")
+    generate_synthetic_video(video_path, 96, 64, duration=4.0, fps=25.0, cut_every=1.0, codec="MJPG")
+
+    inputs = make_inputs(video_path, 4.0, 16)
+
+    assert tuple(inputs.shape) == (16, 3, 224, 224)
+    # Кадры разные: выборка идёт по всему ролику, а не по одному кадру
+    assert len({round(float(frame.mean()), 4) for frame in inputs}) > 1
@@ -0,0 +1,104 @@
+import sqlite3
+from types import SimpleNamespace
+
+import pytest
+
+import catalog
+from catalog import Catalog, file_fingerprint, recording_time
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = Catalog(str(tmp_path / "catalog.sqlite3"))
+    yield db
+    db.close()
+
+
+@pytest.fixture(autouse=True)
+def no_ffprobe(monkeypatch):
+    monkeypatch.setattr(catalog, "_probe_creation_time", lambda video_path: None)
+
+
+def make_video(directory, name):
+    directory.mkdir(parents=True, exist_ok=True)
+    path = directory / name
+    path.write_bytes(name.encode("utf-8") * 100)
+    return str(path)
+
+
+def result(segments):
+    scenes = [(0.0, 10.0)] + list(segments)
+    return SimpleNamespace(scenes=scenes, scores=[0.0] + [100.0] * len(segments), segments=list(segments))
+
+
+def test_report_per_channel_per_day(db, tmp_path):
+    first = make_video(tmp_path / "ch1", "evening.ts")
+    db.save(first, result([(60.0, 90.0), (120.0, 150.0)]), recorded_at="2026-10-17T20:00")
+    # Канал из параметра важнее имени каталога; сегмент после полуночи — в следующий день
+    second = make_video(tmp_path / "misc", "night.ts")
+    db.save(second, result([(0.0, 20.0), (7200.0, 7210.0)]), channel="ch2", recorded_at="2026-10-17T23:00")
+
+    assert db.ad_seconds_per_channel_per_day() == [
+        ("ch1", "2026-10-17", 60.0),
+        ("ch2", "2026-10-17", 20.0),
+        ("ch2", "2026-10-18", 10.0),
+    ]
+    assert db.ad_seconds_per_channel_per_day(channel="ch2", since="2026-10-18") == [("ch2", "2026-10-18", 10.0)]
+
+
+def test_recording_time_from_file_name(db, tmp_path):
+    path = make_video(tmp_path / "ch1", "ch1_2026-10-17_20-30-00.ts")
+    db.save(path, result([(0.0, 15.0)]))
+
+    assert recording_time(path) == "2026-10-17T20:30:00"
+    assert db.find_by_path(path).recorded_at == "2026-10-17T20:30:00"
+    assert db.ad_seconds_per_channel_per_day() == [("ch1", "2026-10-17", 15.0)]
+
+
+def test_unknown_recording_time_until_tagged(db, tmp_path):
+    path = make_video(tmp_path / "ch1", "recording.ts")
+    db.save(path, result([(0.0, 15.0)]))
+    assert db.ad_seconds_per_channel_per_day() == []
+
+    assert db.tag(file_fingerprint(path), recorded_at="2026-10-17T08:00")
+    assert db.ad_seconds_per_channel_per_day() == [("ch1", "2026-10-17", 15.0)]
+    assert not db.tag("missing", channel="ch1")
+
+
+def test_tag_command(tmp_path, capsys):
+    catalog_path = str(tmp_path / "catalog.sqlite3")
+    path = make_video(tmp_path / "ch1", "recording.ts")
+    db = Catalog(catalog_path)
+    db.save(path, result([(0.0, 15.0)]))
+    db.close()
+
+    catalog.main(["--catalog", catalog_path, "tag", path, "--channel", "Первый канал",
+                  "--recorded-at", "2026-10-17T20:00"])
+    catalog.main(["--catalog", catalog_path, "report"])
+
+    assert capsys.readouterr().out == "2026-10-17\tПервый канал\t15.0\n"
+    with pytest.raises(SystemExit):
+        catalog.main(["--catalog", catalog_path, "tag", path, "--recorded-at", "yesterday"])
+
+
+def test_find_requires_same_model_and_settings(db, tmp_path):
+    path = make_video(tmp_path / "ch1", "recording.ts")
+    db.save(path, result([(0.0, 15.0)]), model="Swin:abc", settings={"frame_interval": 0.5, "workers": 4})
+
+    assert db.find_by_path(path, "Swin:abc", {"frame_interval": 0.5, "workers": 1}) is not None
+    assert db.find_by_path(path, "Swin:abc", {"frame_interval": 1.0, "workers": 4}) is None
+    assert db.find_by_path(path, "Swin:def", {"frame_interval": 0.5, "workers": 4}) is None
+
+
+def test_old_catalog_is_migrated(tmp_path):
+    path = str(tmp_path / "catalog.sqlite3")
+    conn = sqlite3.connect(path)
+    conn.executescript(catalog.SCHEMA.replace("    settings_hash TEXT,\n", ""))
+    conn.close()
+
+    db = Catalog(path)
+    try:
+        columns = {row[1] for row in db.conn.execute("PRAGMA table_info(videos)")}
+    finally:
+        db.close()
+    assert "settings_hash" in columns
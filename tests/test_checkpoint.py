@@ -0,0 +1,108 @@
+from types import SimpleNamespace
+
+from checkpoint import CHECKPOINT_FILE, AnalysisCheckpoint
+
+SCENES = [(0.0, 10.0), (10.0, 25.0), (25.0, 30.0)]
+INTERVALS = [0.5, 2.0, 0.5]
+
+
+def make_checkpoint(tmp_path, model="Swin:abc", **options):
+    options.setdefault("flush_interval", 0.0)
+    return AnalysisCheckpoint(str(tmp_path / CHECKPOINT_FILE), {"model": model}, **options)
+
+
+def test_resume_from_recorded_scenes(tmp_path):
+    checkpoint = make_checkpoint(tmp_path)
+    checkpoint.start(SCENES, INTERVALS)
+    checkpoint.record(0, 12.5)
+    checkpoint.record(2, 100.0)
+    checkpoint.close()
+
+    assert make_checkpoint(tmp_path).load() == (SCENES, INTERVALS, {0: 12.5, 2: 100.0})
+
+
+def test_nothing_to_resume(tmp_path):
+    assert make_checkpoint(tmp_path).load() is None
+    (tmp_path / CHECKPOINT_FILE).write_text("", encoding="utf-8")
+    assert make_checkpoint(tmp_path).load() is None
+
+
+def test_other_model_is_ignored(tmp_path):
+    checkpoint = make_checkpoint(tmp_path)
+    checkpoint.start(SCENES, INTERVALS)
+    checkpoint.close()
+
+    assert make_checkpoint(tmp_path, model="Swin:def").load() is None
+
+
+def test_truncated_last_line_is_skipped(tmp_path):
+    checkpoint = make_checkpoint(tmp_path)
+    checkpoint.start(SCENES, INTERVALS)
+    checkpoint.record(0, 12.5)
+    checkpoint.close()
+    with open(tmp_path / CHECKPOINT_FILE, "a", encoding="utf-8") as f:
+        f.write('{"i": 1, "s"')
+
+    assert make_checkpoint(tmp_path).load() == (SCENES, INTERVALS, {0: 12.5})
+
+    # Продолжение после сбоя: новая строка не склеивается с оборванной
+    resumed = make_checkpoint(tmp_path)
+    resumed.record(1, 40.0)
+    resumed.close()
+    assert make_checkpoint(tmp_path).load() == (SCENES, INTERVALS, {0: 12.5, 1: 40.0})
+
+
+def test_out_of_range_scenes_are_dropped(tmp_path):
+    checkpoint = make_checkpoint(tmp_path)
+    checkpoint.start(SCENES, INTERVALS)
+    checkpoint.record(3, 50.0)
+    checkpoint.record(-1, 50.0)
+    checkpoint.close()
+
+    assert make_checkpoint(tmp_path).load()[2] == {}
+
+
+def test_records_are_buffered_until_flush(tmp_path):
+    checkpoint = make_checkpoint(tmp_path, flush_interval=3600.0, max_buffered=2)
+    checkpoint.start(SCENES, INTERVALS)
+    checkpoint._last_flush = float("inf")
+    checkpoint.record(0, 1.0)
+    assert make_checkpoint(tmp_path).load()[2] == {}
+    checkpoint.record(1, 2.0)
+    assert make_checkpoint(tmp_path).load()[2] == {0: 1.0, 1: 2.0}
+    checkpoint.close()
+
+
+def test_start_discards_previous_run(tmp_path):
+    checkpoint = make_checkpoint(tmp_path)
+    checkpoint.start(SCENES, INTERVALS)
+    checkpoint.record(0, 12.5)
+    checkpoint.start(SCENES[:2], INTERVALS[:2])
+    checkpoint.close()
+
+    assert make_checkpoint(tmp_path).load() == (SCENES[:2], INTERVALS[:2], {})
+
+
+def test_remove(tmp_path):
+    checkpoint = make_checkpoint(tmp_path)
+    checkpoint.start(SCENES, INTERVALS)
+    checkpoint.record(0, 12.5)
+    checkpoint.remove()
+
+    assert not (tmp_path / CHECKPOINT_FILE).exists()
+    assert make_checkpoint(tmp_path).load() is None
+
+
+def test_for_video_keys_on_score_settings(tmp_path, monkeypatch):
+    monkeypatch.setenv("AD_DETECTOR_CACHE_DIR", str(tmp_path / "cache"))
+    video = tmp_path / "rec.ts"
+    video.write_bytes(b"video" * 100)
+    settings = SimpleNamespace(frame_interval=0.5, workers=4)
+    checkpoint = AnalysisCheckpoint.for_video(str(video), settings, "Swin:abc", flush_interval=0.0)
+    checkpoint.start(SCENES, INTERVALS)
+    checkpoint.close()
+
+    faster = SimpleNamespace(frame_interval=0.5, workers=1)
+    assert AnalysisCheckpoint.for_video(str(video), faster, "Swin:abc").load() is not None
+    coarser = SimpleNamespace(frame_interval=1.0, workers=4)
+    assert AnalysisCheckpoint.for_video(str(video), coarser, "Swin:abc").load() is None
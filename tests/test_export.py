@@ -0,0 +1,81 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from export import Cut, _timecode, concat_script, cut_list, keep_intervals, to_edl
+from keyframes import Keyframes
+
+DURATION = 60.0
+
+
+def keyframes(every=2.0, last=DURATION):
+    pts = np.arange(0.0, last + 1e-9, every)
+    return Keyframes(pts=pts, pos=np.full(len(pts), -1, dtype=np.int64))
+
+
+def test_keep_intervals_merge_and_clip():
+    segments = [(20.5, 30.0), (10.3, 20.2), (55.0, 70.0), (-5.0, -1.0)]
+
+    assert keep_intervals(segments, DURATION, "ads_only") == [(10.3, 30.0), (55.0, 60.0)]
+    assert keep_intervals(segments, DURATION) == [(0.0, 10.3), (30.0, 55.0)]
+    assert keep_intervals([], DURATION) == [(0.0, DURATION)]
+    with pytest.raises(ValueError):
+        keep_intervals(segments, DURATION, "everything")
+
+
+def test_cuts_snap_to_keyframes():
+    segments = [(10.3, 20.2), (20.5, 30.0)]
+
+    assert cut_list(segments, DURATION, keyframes()) == [
+        Cut(0.0, 10.0, 0.0, 10.3),
+        Cut(30.0, DURATION, 30.0, DURATION),
+    ]
+    assert cut_list(segments, DURATION, keyframes(), mode="ads_only") == [Cut(10.0, 30.0, 10.3, 30.0)]
+
+
+def test_ad_free_and_ads_only_are_complementary():
+    segments = [(5.1, 12.9), (33.3, 41.7)]
+    ad_free = cut_list(segments, DURATION, keyframes(), tolerance=1.0)
+    ads = cut_list(segments, DURATION, keyframes(), mode="ads_only", tolerance=1.0)
+
+    bounds = sorted((cut.start, cut.end) for cut in ad_free + ads)
+    assert bounds[0][0] == 0.0 and bounds[-1][1] == DURATION
+    assert all(left[1] == right[0] for left, right in zip(bounds, bounds[1:]))
+
+
+def test_start_outside_tolerance_moves_to_next_keyframe():
+    [cut] = cut_list([(13.0, 25.0)], DURATION, keyframes(), mode="ads_only", tolerance=0.5)
+
+    # Фрагмент не может начаться раньше ключевого кадра, а конец режется где угодно
+    assert (cut.start, cut.end) == (14.0, 25.0)
+
+
+def test_cut_without_keyframe_is_dropped():
+    cuts = cut_list([(58.5, 59.5)], DURATION, keyframes(last=58.0), mode="ads_only", tolerance=0.2)
+
+    assert cuts == []
+
+
+def test_edl_timecodes():
+    cuts = [Cut(0.0, 10.0, 0.0, 10.3), Cut(30.0, DURATION, 30.0, DURATION)]
+    lines = to_edl(cuts, 25.0, title="rec").splitlines()
+
+    assert lines[:2] == ["TITLE: rec", "FCM: NON-DROP FRAME"]
+    assert lines[3].split()[-4:] == ["00:00:00:00", "00:00:10:00", "00:00:00:00", "00:00:10:00"]
+    assert lines[4].split()[-4:] == ["00:00:30:00", "00:01:00:00", "00:00:10:00", "00:00:40:00"]
+    assert lines[3].startswith("001 ") and lines[4].startswith("002 ")
+
+
+def test_timecode_frames():
+    assert _timecode(3725.48, 25.0) == "01:02:05:12"
+    assert _timecode(1.5, 29.97) == "00:00:01:15"
+
+
+def test_concat_script_uses_track_start_time(tmp_path):
+    video = str(tmp_path / "rec.ts")
+    cuts = [Cut(0.0, 10.0, 0.0, 10.3), Cut(30.0, DURATION, 30.0, DURATION)]
+
+    assert concat_script(video, cuts, DURATION, start_time=1.4) == (
+        f"file '{video}'\noutpoint 11.400000\n"
+        f"file '{video}'\ninpoint 31.400000\n"
+    )
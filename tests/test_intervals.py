@@ -0,0 +1,52 @@
+import random
+
+from intervals import IntervalIndex, merge_intervals
+
+
+def test_merge_overlapping_and_touching():
+    assert merge_intervals([(5.0, 7.0), (0.0, 2.0), (1.0, 3.0), (3.0, 4.0)]) == [(0.0, 4.0), (5.0, 7.0)]
+
+
+def test_merge_gap():
+    intervals = [(0.0, 1.0), (1.4, 2.0), (3.0, 4.0)]
+    assert merge_intervals(intervals) == intervals
+    assert merge_intervals(intervals, gap=0.5) == [(0.0, 2.0), (3.0, 4.0)]
+
+
+def test_merge_contained_and_generator():
+    assert merge_intervals((start, end) for start, end in [(0.0, 10.0), (2.0, 3.0)]) == [(0.0, 10.0)]
+    assert merge_intervals([]) == []
+
+
+def test_index_orders_by_start():
+    index = IntervalIndex([(30.0, 40.0), (0.0, 5.0), (10.0, 20.0)])
+
+    assert len(index) == 3
+    assert [index[i] for i in range(3)] == [(0.0, 5.0), (10.0, 20.0), (30.0, 40.0)]
+    assert index.order == [1, 2, 0]
+
+
+def test_index_queries():
+    index = IntervalIndex([(0.0, 5.0), (10.0, 20.0), (12.0, 100.0), (30.0, 40.0)])
+
+    assert index.at(5.0) == [0]
+    assert index.at(7.0) == []
+    assert index.at(35.0) == [2, 3]
+    assert index.overlapping(4.0, 11.0) == [0, 1]
+    assert index.overlapping(101.0, 200.0) == []
+    assert IntervalIndex([]).at(1.0) == []
+
+
+def test_index_matches_linear_scan():
+    rng = random.Random(0)
+    for size in (1, 2, 7, 100):
+        intervals = []
+        for _ in range(size):
+            start = rng.uniform(0.0, 1000.0)
+            intervals.append((start, start + rng.choice([0.0, 1.0, 50.0, 500.0]) * rng.random()))
+        index = IntervalIndex(intervals)
+        for _ in range(200):
+            start = rng.uniform(-10.0, 1100.0)
+            end = start + rng.choice([0.0, 5.0, 200.0]) * rng.random()
+            expected = [i for i in range(len(index)) if index.starts[i] <= end and index.ends[i] >= start]
+            assert sorted(index.overlapping(start, end)) == expected
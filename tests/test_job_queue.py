@@ -0,0 +1,283 @@
+import sqlite3
+import sys
+import threading
+import time
+from dataclasses import dataclass
+from types import SimpleNamespace
+
+import pytest
+
+import job_queue
+from job_queue import JobQueue
+
+
+@pytest.fixture
+def queue(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.sqlite3"))
+    yield queue
+    queue.close()
+
+
+def test_enqueue_keeps_catalog_metadata(queue, tmp_path):
+    video = str(tmp_path / "rec.ts")
+    assert queue.enqueue([video], channel="ch1", recorded_at="2026-10-17T20:00:00") == 1
+
+    job = queue.jobs()[0]
+    assert (job.path, job.channel, job.recorded_at) == (video, "ch1", "2026-10-17T20:00:00")
+
+
+def test_add_command(tmp_path):
+    queue_path = str(tmp_path / "jobs.sqlite3")
+    (tmp_path / "a.ts").write_bytes(b"")
+    (tmp_path / "b.ts").write_bytes(b"")
+
+    job_queue.main(["--queue", queue_path, "add", str(tmp_path / "a.ts"),
+                    "--channel", "ch1", "--recorded-at", "2026-10-17T20:00"])
+    with pytest.raises(SystemExit):
+        job_queue.main(["--queue", queue_path, "add", str(tmp_path), "--recorded-at", "2026-10-17T20:00"])
+
+    queue = JobQueue(queue_path)
+    try:
+        assert [(job.channel, job.recorded_at) for job in queue.jobs()] == [("ch1", "2026-10-17T20:00:00")]
+    finally:
+        queue.close()
+
+
+def test_old_queue_is_migrated(tmp_path):
+    path = str(tmp_path / "jobs.sqlite3")
+    conn = sqlite3.connect(path)
+    conn.executescript(job_queue.SCHEMA.replace("    error TEXT,\n    channel TEXT,\n    recorded_at TEXT\n",
+                                                "    error TEXT\n"))
+    conn.execute("INSERT INTO jobs (path, status, max_attempts, enqueued_at) VALUES ('a.ts', 'pending', 3, 0)")
+    conn.commit()
+    conn.close()
+
+    queue = JobQueue(path)
+    try:
+        job = queue.jobs()[0]
+    finally:
+        queue.close()
+    assert (job.path, job.channel, job.recorded_at) == ("a.ts", None, None)
+
+
+def enqueue_one(queue, tmp_path, name="rec.ts", **options):
+    queue.enqueue([str(tmp_path / name)], **options)
+    return queue.jobs()[-1].id
+
+
+def test_lease_takes_jobs_in_order(queue, tmp_path):
+    first = enqueue_one(queue, tmp_path, "a.ts")
+    second = enqueue_one(queue, tmp_path, "b.ts")
+
+    job = queue.lease("w1")
+    assert (job.id, job.status, job.worker, job.attempts) == (first, "leased", "w1", 1)
+    assert job.lease_until > time.time()
+    assert queue.lease("w2").id == second
+    assert queue.lease("w3") is None
+
+
+def test_expired_lease_goes_back_to_the_queue(queue, tmp_path):
+    job_id = enqueue_one(queue, tmp_path, max_attempts=2)
+    queue.lease("w1", lease_seconds=-1.0)
+
+    job = queue.lease("w2", lease_seconds=-1.0)
+    assert (job.id, job.worker, job.attempts) == (job_id, "w2", 2)
+    # Воркер, потерявший аренду, не может её продлить или завершить задачу
+    assert not queue.heartbeat(job_id, "w1")
+
+    queue._expire_leases(time.time())
+    job = queue.get(job_id)
+    assert (job.status, job.error, job.worker) == ("failed", "lease expired", None)
+    assert queue.lease("w3") is None
+
+
+def test_heartbeat_extends_lease(queue, tmp_path):
+    job_id = enqueue_one(queue, tmp_path)
+    queue.lease("w1", lease_seconds=-1.0)
+
+    assert queue.heartbeat(job_id, "w1", lease_seconds=600.0)
+    queue._expire_leases(time.time())
+    assert queue.get(job_id).status == "leased"
+
+
+def test_release_does_not_charge_an_attempt(queue, tmp_path):
+    job_id = enqueue_one(queue, tmp_path, max_attempts=1)
+    queue.lease("w1")
+    queue.release(job_id, "w2")
+    assert queue.get(job_id).status == "leased"
+
+    queue.release(job_id, "w1")
+    job = queue.get(job_id)
+    assert (job.status, job.attempts, job.worker, job.lease_until) == ("pending", 0, None, None)
+    assert queue.lease("w1").attempts == 1
+
+
+def test_release_worker_returns_all_its_jobs(queue, tmp_path):
+    for name in ("a.ts", "b.ts", "c.ts"):
+        enqueue_one(queue, tmp_path, name)
+    queue.lease("w1")
+    queue.lease("w1")
+    other = queue.lease("w2")
+
+    assert queue.release_worker("w1") == 2
+    assert queue.counts() == {"pending": 2, "leased": 1}
+    assert all(job.attempts == 0 for job in queue.jobs("pending"))
+    assert queue.get(other.id).worker == "w2"
+
+
+def test_abandon_worker_charges_the_attempt(queue, tmp_path):
+    job_id = enqueue_one(queue, tmp_path, max_attempts=1)
+    queue.lease("w1")
+
+    assert queue.abandon_worker("w1", "worker exited with code -9") == 1
+    job = queue.get(job_id)
+    assert (job.status, job.attempts, job.error) == ("failed", 1, "worker exited with code -9")
+
+
+def test_complete_and_fail(queue, tmp_path):
+    done = enqueue_one(queue, tmp_path, "a.ts")
+    failed = enqueue_one(queue, tmp_path, "b.ts", max_attempts=2)
+    queue.lease("w1")
+    queue.lease("w1")
+
+    queue.complete(done, "w2", 5.0)
+    assert queue.get(done).status == "leased"
+    queue.complete(done, "w1", 5.0, video_seconds=60.0, frames=240)
+    job = queue.get(done)
+    assert (job.status, job.seconds, job.video_seconds, job.frames) == ("done", 5.0, 60.0, 240)
+
+    queue.fail(failed, "w1", "RuntimeError: boom")
+    assert queue.get(failed).status == "pending"
+    queue.lease("w1")
+    queue.fail(failed, "w1", "RuntimeError: boom")
+    assert queue.get(failed).status == "failed"
+    assert queue.retry_failed() == 1
+    assert queue.get(failed).attempts == 0
+
+    # Готовое видео повторно не ставится
+    assert queue.enqueue([queue.get(done).path]) == 0
+    assert queue.throughput()["jobs"] == 1
+
+
+class FakeSource:
+    def __init__(self, path, max_handles=None):
+        self.metadata = SimpleNamespace(as_dict=lambda: {"duration": 60.0, "fps": 25.0})
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+@pytest.fixture
+def worker_env(tmp_path, monkeypatch):
+    """run_worker без torch и модели: анализ подменяется функцией теста."""
+    monkeypatch.setenv("AD_DETECTOR_CATALOG", str(tmp_path / "catalog.sqlite3"))
+    monkeypatch.setenv("AD_DETECTOR_CACHE_DIR", str(tmp_path / "cache"))
+    env = SimpleNamespace(analyze=None, source=FakeSource, queue_path=str(tmp_path / "jobs.sqlite3"))
+
+    @dataclass
+    class Settings:
+        frame_interval: float = 0.5
+
+        def max_workers(self):
+            return 1
+
+    modules = {
+        "torch": SimpleNamespace(set_num_threads=lambda threads: None),
+        "model_loader": SimpleNamespace(load_model=lambda name: object(), model_identity=lambda name: "Swin:test"),
+        "analysis": SimpleNamespace(AnalysisSettings=Settings,
+                                    analyze_video=lambda *args, **kwargs: env.analyze(*args, **kwargs)),
+        "video_source": SimpleNamespace(VideoSource=lambda *args, **kwargs: env.source(*args, **kwargs)),
+    }
+    for name, module in modules.items():
+        monkeypatch.setitem(sys.modules, name, module)
+
+    for name in ("a.ts", "b.ts"):
+        (tmp_path / name).write_bytes(name.encode("ascii") * 100)
+    queue = JobQueue(env.queue_path)
+    queue.enqueue([str(tmp_path / "a.ts"), str(tmp_path / "b.ts")])
+    queue.close()
+
+    def run(stop_event=None):
+        job_queue.run_worker(env.queue_path, "Swin", 600.0, None, True, 0.01, stop_event or threading.Event())
+        queue = JobQueue(env.queue_path)
+        try:
+            return queue.jobs()
+        finally:
+            queue.close()
+
+    env.run = run
+    return env
+
+
+def analysis_result(completed=True):
+    return SimpleNamespace(completed=completed, scenes=[(0.0, 10.0)], scores=[90.0], segments=[(0.0, 10.0)],
+                           metrics={"counters": {"frames_classified": 20}})
+
+
+def saved_paths():
+    from catalog import Catalog
+
+    db = Catalog()
+    try:
+        return [path for (path,) in db.conn.execute("SELECT path FROM videos ORDER BY path")]
+    finally:
+        db.close()
+
+
+def test_worker_processes_the_queue(worker_env):
+    worker_env.analyze = lambda *args, **kwargs: analysis_result()
+
+    jobs = worker_env.run()
+    assert [(job.status, job.frames) for job in jobs] == [("done", 20), ("done", 20)]
+    assert saved_paths() == [job.path for job in jobs]
+
+
+def test_worker_keeps_result_finished_before_stop(worker_env):
+    stop_event = threading.Event()
+
+    def analyze(*args, **kwargs):
+        stop_event.set()
+        return analysis_result()
+
+    worker_env.analyze = analyze
+    jobs = worker_env.run(stop_event)
+    assert [job.status for job in jobs] == ["done", "pending"]
+    assert saved_paths() == [jobs[0].path]
+
+
+def test_worker_keeps_result_finished_before_ctrl_c(worker_env):
+    class InterruptedSource(FakeSource):
+        def __exit__(self, *exc):
+            raise KeyboardInterrupt
+
+    worker_env.analyze = lambda *args, **kwargs: analysis_result()
+    worker_env.source = InterruptedSource
+    jobs = worker_env.run()
+    assert [job.status for job in jobs] == ["done", "pending"]
+    assert saved_paths() == [jobs[0].path]
+
+
+def test_worker_releases_interrupted_analysis(worker_env):
+    def analyze(*args, **kwargs):
+        raise KeyboardInterrupt
+
+    worker_env.analyze = analyze
+    jobs = worker_env.run()
+    assert [(job.status, job.attempts) for job in jobs] == [("pending", 0), ("pending", 0)]
+    assert saved_paths() == []
+
+
+def test_worker_releases_stopped_analysis(worker_env):
+    stop_event = threading.Event()
+
+    def analyze(*args, **kwargs):
+        stop_event.set()
+        return analysis_result(completed=False)
+
+    worker_env.analyze = analyze
+    jobs = worker_env.run(stop_event)
+    assert [(job.status, job.attempts) for job in jobs] == [("pending", 0), ("pending", 0)]
+    assert saved_paths() == []
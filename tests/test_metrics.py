@@ -0,0 +1,109 @@
+import json
+
+from metrics import Metrics, dump, summarize, to_prometheus
+
+
+def test_summary_counts_only_the_run():
+    metrics = Metrics()
+    metrics.count("frames_decoded", 10)
+    metrics.observe("decode", 0.5)
+    before = metrics.snapshot(window=True)
+    metrics.count("frames_decoded", 3)
+    metrics.observe("decode", 0.1)
+    metrics.observe("decode", 0.2)
+    summary = summarize(before, metrics.snapshot(since=before))
+
+    assert summary["counters"] == {"frames_decoded": 3}
+    assert summary["stages"]["decode"]["calls"] == 2
+    assert abs(summary["stages"]["decode"]["seconds"] - 0.3) < 1e-9
+
+
+def test_window_max_ignores_earlier_runs():
+    metrics = Metrics()
+    metrics.observe("classify", 5.0)
+    metrics.gauge("queue_depth", 40)
+    metrics.gauge("queue_depth", 2)
+    before = metrics.snapshot(window=True)
+    metrics.observe("classify", 1.0)
+    metrics.gauge("queue_depth", 7)
+    metrics.gauge("queue_depth", 3)
+    summary = summarize(before, metrics.snapshot(since=before))
+
+    assert summary["stages"]["classify"]["max_ms"] == 1000.0
+    assert summary["gauges"]["queue_depth"] == {"last": 3, "max": 7}
+
+
+def test_window_starts_from_current_gauge_value():
+    metrics = Metrics()
+    metrics.gauge("rss_mb", 100)
+    before = metrics.snapshot(window=True)
+    summary = summarize(before, metrics.snapshot(since=before))
+
+    assert summary["gauges"]["rss_mb"] == {"last": 100, "max": 100}
+
+
+def test_closed_window_stops_collecting():
+    metrics = Metrics()
+    before = metrics.snapshot(window=True)
+    metrics.snapshot(since=before)
+    metrics.observe("decode", 1.0)
+
+    assert metrics._windows == {}
+
+
+def test_reset_clears_open_windows():
+    metrics = Metrics()
+    before = metrics.snapshot(window=True)
+    metrics.observe("decode", 9.0)
+    metrics.gauge("queue_depth", 9)
+    metrics.reset()
+    metrics.observe("decode", 1.0)
+    summary = summarize(before, metrics.snapshot(since=before))
+
+    assert summary["stages"]["decode"]["max_ms"] == 1000.0
+    assert "queue_depth" not in summary["gauges"]
+
+
+def test_open_windows_are_capped(monkeypatch):
+    monkeypatch.setattr("metrics.MAX_OPEN_WINDOWS", 3)
+    metrics = Metrics()
+    first = metrics.snapshot(window=True)
+    for _ in range(3):
+        metrics.snapshot(window=True)
+
+    assert len(metrics._windows) == 3
+    assert first["window"] not in metrics._windows
+
+
+def test_prometheus_dump(tmp_path):
+    metrics = Metrics()
+    before = metrics.snapshot(window=True)
+    metrics.count("frames_decoded", 4)
+    metrics.observe("decode stage", 0.25)
+    metrics.gauge("queue_depth", 5)
+    summary = summarize(before, metrics.snapshot(since=before))
+    path = tmp_path / "run.prom"
+    dump(summary, str(path))
+
+    lines = path.read_text(encoding="utf-8").splitlines()
+    assert lines == to_prometheus(summary).splitlines()
+    assert 'ad_detector_stage_calls_total{stage="decode_stage"} 1' in lines
+    assert 'ad_detector_stage_max_seconds{stage="decode_stage"} 0.250000' in lines
+    assert "ad_detector_frames_decoded_total 4" in lines
+    assert "ad_detector_queue_depth 5" in lines
+    assert "ad_detector_queue_depth_max 5" in lines
+    assert not (tmp_path / "run.prom.tmp").exists()
+
+
+def test_json_dump_appends(tmp_path):
+    metrics = Metrics()
+    before = metrics.snapshot()
+    metrics.count("frames_classified")
+    summary = summarize(before, metrics.snapshot())
+    path = tmp_path / "runs.jsonl"
+    dump(summary, str(path), video="a.mp4")
+    dump(summary, str(path), video="b.mp4")
+
+    rows = [json.loads(line) for line in path.read_text(encoding="utf-8").splitlines()]
+    assert [row["video"] for row in rows] == ["a.mp4", "b.mp4"]
+    assert rows[0]["counters"] == {"frames_classified": 1}
@@ -0,0 +1,60 @@
+import random
+
+import pytest
+
+from sampling import budget_samples, count_samples, distinct_frames, sample_times, scene_sample_times
+
+
+def test_unbudgeted_scene_keeps_the_fixed_step():
+    assert scene_sample_times(10.0, 12.0, 0.5, 2, 32) == list(sample_times(10.0, 12.0, 0.5))
+    assert count_samples(10.0, 12.0, 0.5) == 5
+    assert count_samples(12.0, 10.0, 0.5) == 0
+    assert scene_sample_times(12.0, 10.0, 0.5, 2, 32) == []
+
+
+def test_long_scene_is_capped_and_covered():
+    times = scene_sample_times(0.0, 600.0, 0.5, 2, 32, fps=25.0)
+
+    assert len(times) == 32
+    assert times == sorted(times)
+    assert all(0.0 <= t <= 600.0 for t in times)
+    # По кадру из каждой страты — покрыта вся сцена
+    stratum = 600.0 / 32
+    assert [int(t // stratum) for t in times] == list(range(32))
+
+
+def test_short_scene_gets_min_samples():
+    times = scene_sample_times(5.0, 5.4, 0.5, 4, 32, fps=25.0)
+
+    assert len(times) == 4
+    assert all(5.0 <= t <= 5.4 for t in times)
+
+
+def test_budget_never_exceeds_distinct_frames():
+    assert distinct_frames(5.0, 5.2, 25.0) == 6
+    assert budget_samples(5.0, 5.2, 0.5, 8, 32, fps=25.0) == 6
+    times = scene_sample_times(5.0, 5.2, 0.5, 8, 32, fps=25.0)
+    assert sorted({round(t * 25) for t in times}) == list(range(125, 131))
+    assert scene_sample_times(5.0, 5.0, 0.5, 2, 32, fps=25.0) == [5.0]
+
+
+def test_sampling_is_deterministic():
+    assert scene_sample_times(3.0, 400.0, 0.5, 2, 16, fps=25.0) == scene_sample_times(3.0, 400.0, 0.5, 2, 16, fps=25.0)
+
+
+@pytest.mark.parametrize("fps", [10.0, 25.0, 29.97])
+def test_no_frame_is_sampled_twice(fps):
+    rng = random.Random(0)
+    for _ in range(500):
+        start = rng.uniform(0.0, 3600.0)
+        end = start + rng.choice([0.0, 0.04, 0.3, 1.0, 7.5, 90.0, 900.0]) * rng.random()
+        interval = rng.choice([0.04, 0.1, 0.5, 2.0])
+        low, high = rng.choice([(None, None), (2, 32), (8, 8), (16, None)])
+        times = scene_sample_times(start, end, interval, low, high, fps)
+        frames = [int(round(t * fps)) for t in times]
+
+        assert len(frames) == len(set(frames))
+        assert all(start <= t <= end + 1e-9 for t in times)
+        assert len(times) <= budget_samples(start, end, interval, low, high, fps)
+        if high is not None:
+            assert len(times) <= high